@@ -1,24 +1,68 @@
+import mimetypes
+import os
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Sequence
+
+from google.genai import types
 
 # Based on the understanding that ADK's InvocationContext
 # expects Pydantic models for content and parts, especially
 # for new_message in Runner.run_async.
 
+# Inline image parts count towards the provider's ~20 MB request limit; larger charts are sent by URL only.
+INLINE_IMAGE_MAX_BYTES = int(float(os.environ.get("INLINE_IMAGE_MAX_MB", "15")) * 1024 * 1024)
+
+class Blob(BaseModel):
+    mime_type: str
+    data: bytes
+
 class Part(BaseModel):
     text: Optional[str] = None
+    # Raw bytes of an attached image; the genai client base64-encodes them when the request is sent.
+    inline_data: Optional[Blob] = None
     # We are omitting executable_code and code_execution_result for simple text messages.
     # If ADK's InvocationContext strictly requires these fields even when None,
     # they can be added here as Optional[SomePydanticModel] = None.
     # For now, Pydantic's default behavior for missing optional fields (treating them as None)
     # should be sufficient if InvocationContext's Part model also defines them as Optional.
 
+    def to_genai(self) -> types.Part:
+        if self.inline_data is not None:
+            return types.Part(inline_data=types.Blob(mime_type=self.inline_data.mime_type, data=self.inline_data.data))
+        return types.Part(text=self.text)
+
 class Content(BaseModel):
     role: str
     parts: List[Part]
 
-def create_simple_text_content(text: str, role: str = "user") -> Content:
+    def to_genai(self) -> types.Content:
+        return types.Content(role=self.role, parts=[part.to_genai() for part in self.parts])
+
+def load_image_part(path: str, max_bytes: int = INLINE_IMAGE_MAX_BYTES) -> Part:
+    """
+    Reads an image file into an inline-data Part (mime type from the extension).
+    Raises ValueError for non-image files or files above max_bytes.
+    """
+    mime_type = mimetypes.guess_type(path)[0]
+    if not mime_type or not mime_type.startswith("image/"):
+        raise ValueError(f"Not an image file: {path}")
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        raise ValueError(f"Image {path} is {size} bytes, above the {max_bytes}-byte inline limit")
+    with open(path, "rb") as f:
+        return Part(inline_data=Blob(mime_type=mime_type, data=f.read()))
+
+def create_content(text: str, images: Sequence[types.Part] = (), role: str = "user") -> types.Content:
+    """
+    A message with the given image parts ahead of the text. The image parts are
+    used as-is, so one Part loaded per run can be shared by every agent's message.
+    """
+    return types.Content(role=role, parts=[*images, types.Part(text=text)])
+
+def create_simple_text_content(text: str, role: str = "user") -> types.Content:
     """
     Creates a Content object for a simple text message.
+    Runner.run_async reads the message's parts as google.genai Parts (function_response etc.),
+    so the genai types are built here rather than the minimal models above.
     """
-    return Content(role=role, parts=[Part(text=text)])
+    return create_content(text, role=role)
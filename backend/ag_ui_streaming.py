@@ -0,0 +1,149 @@
+"""
+Translation of pipeline progress and ADK events into AG-UI events for SSE streaming.
+
+Each pipeline stage is reported as a tool call (TOOL_CALL_START when it starts,
+TOOL_CALL_END with its validated output when it finishes), framed by
+RUN_STARTED / RUN_FINISHED, so the UI can render every step seconds after the
+agent finishes instead of waiting for the whole run.
+"""
+import asyncio
+import datetime
+import json
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel
+
+from backend.ag_ui_event_types import (
+    ErrorEventData,
+    RunLifecycleData,
+    TextMessageContentData,
+    TextMessageEndData,
+    TextMessageStartData,
+    ToolCallEndData,
+    ToolCallStartData,
+)
+from backend.agents.pipeline import PipelineExecutor, StageResult
+
+_RUN_DONE = object()
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def to_sse(event: BaseModel) -> Dict[str, str]:
+    """sse-starlette message for an AG-UI event model (camelCase aliases on the wire)."""
+    return {"event": event.type, "data": event.model_dump_json(by_alias=True, exclude_none=True)}
+
+
+def stage_started_event(run_id: str, stage_key: str, args: Dict[str, Any]) -> ToolCallStartData:
+    return ToolCallStartData(toolCallId=f"{run_id}:{stage_key}", toolName=stage_key, toolArgs=args, timestamp=_now())
+
+
+def stage_finished_events(run_id: str, result: StageResult) -> List[BaseModel]:
+    events: List[BaseModel] = [
+        ToolCallEndData(
+            toolCallId=f"{run_id}:{result.key}",
+            toolName=result.key,
+            result={
+                "output": result.output_dict(),
+                "duration_s": round(result.duration_s, 3),
+                "cached": result.cached,
+                "skipped": result.skipped,
+            },
+            isError=result.error is not None,
+            errorDetails=result.error,
+            timestamp=_now(),
+        )
+    ]
+    if result.error:
+        events.append(ErrorEventData(message=f"Stage {result.key} failed", details=result.error, runId=run_id, timestamp=_now()))
+    return events
+
+
+async def stream_pipeline_events(executor: PipelineExecutor, query: str, image_url: Optional[str] = None,
+                                 image_id: Optional[str] = None) -> AsyncIterator[BaseModel]:
+    """
+    Runs the pipeline and yields AG-UI events as stages start and finish.
+    Cancelling the iterator (e.g. client disconnect) cancels the run.
+    """
+    run_id = f"run_{uuid.uuid4().hex[:8]}"
+    queue: asyncio.Queue = asyncio.Queue()
+    stage_args = {"query": query, "image_url": image_url}
+
+    async def observer(kind: str, stage_key: str, result: Optional[StageResult]) -> None:
+        if kind == "stage_started":
+            queue.put_nowait(stage_started_event(run_id, stage_key, stage_args))
+        elif kind == "stage_finished" and result is not None:
+            for event in stage_finished_events(run_id, result):
+                queue.put_nowait(event)
+
+    yield RunLifecycleData(type="RUN_STARTED", runId=run_id, context=stage_args, timestamp=_now())
+    run_task = asyncio.ensure_future(
+        executor.run(query, image_url, run_id=run_id, image_id=image_id, observer=observer)
+    )
+    run_task.add_done_callback(lambda _: queue.put_nowait(_RUN_DONE))
+    try:
+        while True:
+            item = await queue.get()
+            if item is _RUN_DONE:
+                break
+            yield item
+        pipeline_run = run_task.result()
+    except asyncio.CancelledError:
+        run_task.cancel()
+        raise
+    except Exception as e:
+        yield ErrorEventData(message="Pipeline run failed", details=str(e), runId=run_id, timestamp=_now())
+        yield RunLifecycleData(type="RUN_FINISHED", runId=run_id, status="failed", timestamp=_now())
+        return
+    finally:
+        if not run_task.done():
+            run_task.cancel()
+
+    yield RunLifecycleData(
+        type="RUN_FINISHED",
+        runId=run_id,
+        status="completed" if not pipeline_run.errors() else "partial",
+        finalData=pipeline_run.to_dict(),
+        timestamp=_now(),
+    )
+
+
+def adk_event_to_ag_ui(adk_event: Any) -> List[BaseModel]:
+    """
+    Maps one ADK runner Event (legacy orchestrator mode) to AG-UI events:
+    function calls -> TOOL_CALL_START, function responses -> TOOL_CALL_END,
+    final text -> TEXT_MESSAGE_START/CONTENT/END.
+    """
+    events: List[BaseModel] = []
+    for call in adk_event.get_function_calls() or []:
+        events.append(ToolCallStartData(
+            toolCallId=call.id or f"call_{uuid.uuid4().hex[:8]}", toolName=call.name, toolArgs=call.args or {},
+            timestamp=_now(),
+        ))
+    for response in adk_event.get_function_responses() or []:
+        events.append(ToolCallEndData(
+            toolCallId=response.id or f"call_{uuid.uuid4().hex[:8]}", toolName=response.name,
+            result=_jsonable(response.response), timestamp=_now(),
+        ))
+    text = _event_text(adk_event.content.parts if adk_event.content and adk_event.content.parts else [])
+    if text and not adk_event.partial:
+        message_id = adk_event.id or f"msg_{uuid.uuid4().hex[:8]}"
+        events.append(TextMessageStartData(messageId=message_id, role="assistant", timestamp=_now()))
+        events.append(TextMessageContentData(messageId=message_id, delta=text, timestamp=_now()))
+        events.append(TextMessageEndData(messageId=message_id, timestamp=_now()))
+    return events
+
+
+def _event_text(parts: Iterable[Any]) -> str:
+    return "".join(part.text for part in parts if getattr(part, "text", None))
+
+
+def _jsonable(value: Any) -> Any:
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return str(value)
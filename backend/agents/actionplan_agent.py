@@ -18,19 +18,20 @@ class Agent10_ActionPlan_Output(BaseModel):
     notes: Optional[str] = Field(None, description="Additional notes on the execution plan")
 
 from google.adk.agents import LlmAgent # Corrected import
+from backend.model_governor import governed_model
 import json
 
 class ActionPlanAgent(LlmAgent): # Inherit from LlmAgent
     def __init__(self):
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20", # Added model
+            model=governed_model("gemini-2.5-flash-preview-05-20"), # Added model
             name="ActionPlanSpecialist",
             description="Defines clear action plan steps and specific invalidation triggers based on trade setup and confidence/risk assessment.",
             output_schema=Agent10_ActionPlan_Output, # Added output_schema
             tools=[] # No external tools for this agent
         )
 
-    async def run(self, context_from_previous_agents: Dict[str, Any]) -> Agent10_ActionPlan_Output:
+    async def simulate_run(self, context_from_previous_agents: Dict[str, Any]) -> Agent10_ActionPlan_Output:
         # PLAN: Check if Agent 8 proposed a trade. If yes, review setup/confidence and define execution steps & invalidation triggers.
         # If no, define re-analysis triggers.
         print("PLAN: Reviewing trade setup and confidence to define actionable steps and invalidation triggers.")
@@ -11,19 +11,20 @@ class Agent9_ConfidenceRisk_Output(BaseModel):
     notes: Optional[str] = Field(None, description="Additional notes or observations")
 
 from google.adk.agents import LlmAgent # Corrected import
+from backend.model_governor import governed_model
 import json
 
 class ConfidenceRiskAgent(LlmAgent): # Inherit from LlmAgent
     def __init__(self):
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20", # Added model
+            model=governed_model("gemini-2.5-flash-preview-05-20"), # Added model
             name="ConfidenceRiskAssessor",
             description="Evaluates overall technical picture, calculates Win Probability (WP), and assigns Confidence tier and Risk budget.",
             output_schema=Agent9_ConfidenceRisk_Output, # Added output_schema
             tools=[] # No external tools for this agent
         )
 
-    async def run(self, context_from_previous_agents: Dict[str, Any]) -> Agent9_ConfidenceRisk_Output:
+    async def simulate_run(self, context_from_previous_agents: Dict[str, Any]) -> Agent9_ConfidenceRisk_Output:
         # PLAN: Review all context A1-A8, A5b. Determine overall potential directional bias.
         # Calculate WP score based on weighted factor alignment with this bias.
         # Apply RR penalty if applicable. Determine Confidence tier & Risk % based on WP and Agent 8's setup.
@@ -0,0 +1,158 @@
+"""
+Deterministic confluence scoring for the confidence-risk stage.
+
+The trade-setup agent already lists typed confirmations (factor_type plus
+high / medium / low strength) and typed risk scenarios, so the win probability
+is a weighted sum over them rather than a model judgement: start at
+base_score, add each factor type's points scaled by the strength of its
+strongest confirmation, subtract a penalty per risk scenario (alternatives
+against the proposed direction, risk factors) and the RR penalty when the
+setup's risk-reward ratio is below MIN_RISK_REWARD, then cap to 0-100. The
+tier and risk budget follow from the score, so reruns on the same setup give
+identical numbers.
+
+Weights default to the rubric the ConfidenceRiskAgent used; CONFLUENCE_WEIGHTS
+(JSON) overrides any field, e.g. {"factor_points": {"liquidity": 25}}.
+"""
+import json
+import os
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from backend.agents.confidencerisk_agent import Agent9_ConfidenceRisk_Output
+from backend.agents.tradesetup_agent import Agent8_TradeSetup_Output
+
+MIN_RISK_REWARD = 2.0
+
+
+@dataclass(frozen=True)
+class ConfluenceWeights:
+    base_score: float = 50.0
+    # Points for a factor type at full (high) strength; unknown types score as "other".
+    factor_points: Dict[str, float] = field(default_factory=lambda: {
+        "structure": 15.0,
+        "liquidity": 20.0,
+        "momentum": 15.0,
+        "derivatives": 15.0,
+        "range": 10.0,
+        "sentiment": 5.0,
+        "news": 5.0,
+        "macro": 5.0,
+        "other": 2.0,
+    })
+    strength_multipliers: Dict[str, float] = field(default_factory=lambda: {"high": 1.0, "medium": 0.6, "low": 0.3})
+    # Used when a confirmation has no (or an unknown) strength.
+    default_strength: float = 0.5
+    # Points subtracted per scenario; alternatives in the setup's own direction are not penalised.
+    scenario_penalties: Dict[str, float] = field(default_factory=lambda: {
+        "alternative_bullish": 5.0,
+        "alternative_bearish": 5.0,
+        "risk_factor": 5.0,
+        "invalidation_point": 0.0,
+    })
+    rr_penalty: float = 20.0
+    high_threshold: float = 70.0
+    medium_threshold: float = 55.0
+    # Risk budget (% of equity) per confidence tier.
+    risk_pct: Dict[str, float] = field(default_factory=lambda: {"high": 1.5, "medium": 1.0, "low": 0.5})
+
+
+def load_confluence_weights(overrides: str) -> ConfluenceWeights:
+    """Default weights with the JSON overrides applied (dict fields are merged key by key)."""
+    defaults = ConfluenceWeights()
+    values = {}
+    for name, value in json.loads(overrides or "{}").items():
+        if name not in {f.name for f in fields(ConfluenceWeights)}:
+            raise ValueError(f"Unknown confluence weight: {name}")
+        current = getattr(defaults, name)
+        values[name] = {**current, **value} if isinstance(current, dict) else float(value)
+    return ConfluenceWeights(**values)
+
+
+CONFLUENCE_WEIGHTS = load_confluence_weights(os.environ.get("CONFLUENCE_WEIGHTS", ""))
+
+
+def risk_reward(direction: Optional[str], entry: Optional[float], stop: Optional[float],
+                take_profit: Optional[float]) -> Optional[float]:
+    if direction not in ("long", "short") or None in (entry, stop, take_profit):
+        return None
+    risk = abs(entry - stop)
+    if risk == 0:
+        return None
+    reward = take_profit - entry if direction == "long" else entry - take_profit
+    return round(reward / risk, 2)
+
+
+def _format_points(points: float) -> str:
+    return f"{points:+g}"
+
+
+def confluence_score(setup: Agent8_TradeSetup_Output,
+                     weights: ConfluenceWeights = CONFLUENCE_WEIGHTS) -> Tuple[int, Optional[float], List[str]]:
+    """Capped win probability, the setup's RR (None without a setup) and one reason per scoring term."""
+    strongest: Dict[str, float] = {}
+    for confirmation in setup.confirmations:
+        factor = confirmation.factor_type.lower()
+        factor = factor if factor in weights.factor_points else "other"
+        strength = weights.strength_multipliers.get((confirmation.strength or "").lower(), weights.default_strength)
+        strongest[factor] = max(strongest.get(factor, 0.0), strength)
+
+    score = weights.base_score
+    reasons = []
+    for factor, strength in strongest.items():
+        points = round(weights.factor_points[factor] * strength, 1)
+        score += points
+        reasons.append(f"{factor} ({_format_points(points)})")
+
+    own_alternative = f"alternative_{'bullish' if setup.direction == 'long' else 'bearish'}"
+    for scenario in setup.scenarios:
+        if setup.direction in ("long", "short") and scenario.type == own_alternative:
+            continue
+        penalty = weights.scenario_penalties.get(scenario.type, 0.0)
+        if penalty:
+            score -= penalty
+            reasons.append(f"{scenario.type} ({_format_points(-penalty)})")
+
+    rr = risk_reward(setup.direction, setup.entry, setup.stop, setup.take_profit)
+    if rr is not None and rr < MIN_RISK_REWARD and weights.rr_penalty:
+        score -= weights.rr_penalty
+        reasons.append(f"RR {rr} below {MIN_RISK_REWARD} ({_format_points(-weights.rr_penalty)})")
+    return int(round(max(0.0, min(100.0, score)))), rr, reasons
+
+
+def score_confidence_risk(upstream: Dict[str, Optional[BaseModel]],
+                          weights: ConfluenceWeights = CONFLUENCE_WEIGHTS) -> Agent9_ConfidenceRisk_Output:
+    """Agent9_ConfidenceRisk_Output from the trade-setup stage's confirmations and scenarios."""
+    setup = upstream.get("step08_tradesetup")
+    if setup is None:
+        raise ValueError("step08_tradesetup produced no output")
+    win_probability, rr, reasons = confluence_score(setup, weights)
+    has_setup = setup.direction in ("long", "short")
+    rr_ok = rr is None or rr >= MIN_RISK_REWARD
+
+    # As in the ConfidenceRiskAgent rubric: RR < MIN_RISK_REWARD only blocks "high" (a score above the high
+    # threshold with a poor RR falls to "low"); "medium" needs a setup and a score within the medium band.
+    if win_probability > weights.high_threshold and has_setup and rr_ok:
+        tier = "high"
+    elif weights.medium_threshold <= win_probability <= weights.high_threshold and has_setup:
+        tier = "medium"
+    else:
+        tier = "low"
+
+    reasoning = (f"Win Probability of {win_probability}% from a base of {weights.base_score:g}: "
+                 f"{'; '.join(reasons) or 'no scored factors'}. Confidence is {tier}")
+    if not has_setup:
+        reasoning += " as no trade setup was proposed."
+    elif tier == "low" and not rr_ok:
+        reasoning += f" as the proposed setup's RR of {rr} is below {MIN_RISK_REWARD}."
+    else:
+        reasoning += "."
+    return Agent9_ConfidenceRisk_Output(
+        winProbability=win_probability,
+        confidence_pct=win_probability,
+        risk_pct=weights.risk_pct[tier],
+        confidence_tier=tier,
+        reasoning=reasoning,
+    )
@@ -2,6 +2,7 @@ from google.adk.agents import LlmAgent
 from pydantic import BaseModel, Field
 from typing import Optional, Union, List
 from backend.tools.mcp_wrappers import CoinGeckoPriceTool # Import the new tool
+from backend.model_governor import governed_model
 
 # 1. Define the Pydantic Output Model
 class Agent1_Context_Output(BaseModel):
@@ -93,7 +94,7 @@ class ContextAgent(LlmAgent):
         cg_price_tool = CoinGeckoPriceTool()
 
         super().__init__(
-            model="gemini-1.5-flash-latest", 
+            model=governed_model("gemini-1.5-flash-latest"), 
             name="analyze_chart_context",
             description="Analyzes chart context from an image, extracts OHLC, calls a tool to fetch live price from CoinGecko, validates, and outputs JSON.",
             instruction=AGENT_INSTRUCTION_CONTEXT,
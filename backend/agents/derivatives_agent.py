@@ -39,38 +39,28 @@ from google.adk.agents import LlmAgent # Corrected import from LlmAgent
 from google.adk.tools.function_tool import FunctionTool # Import FunctionTool
 import json
 
-# Placeholder for a simulated FileSearchTool
-class FileSearchTool:
-    def __init__(self, vector_store_id: str):
-        self.vector_store_id = vector_store_id
-
-    def search(self, query: str) -> str:
-        if "Funding Rate thresholds" in query:
-            return "Funding Rate Thresholds (from Trading Reference Checklist): Very Bullish (>0.02%), Bullish (0.005% to 0.02%), Neutral (-0.005% to 0.005%), Bearish (-0.02% to -0.005%), Very Bearish (<-0.02%)."
-        elif "Open Interest relative to Price" in query:
-            return "Open Interest (OI) relative to Price: Rising OI with rising price = healthy uptrend. Falling OI with rising price = potential short squeeze/weak uptrend. Rising OI with falling price = healthy downtrend. Falling OI with falling price = potential long squeeze/weak downtrend."
-        elif "Cumulative Volume Delta relative to Price" in query:
-            return "Cumulative Volume Delta (CVD) relative to Price: Rising CVD with rising price = strong buying pressure. Falling CVD with falling price = strong selling pressure. Divergence (e.g., rising price but falling CVD) indicates potential weakness."
-        elif "Trapped Traders/Stop Hunts" in query:
-            return "Trapped Traders/Stop Hunts: Trapped longs occur when price breaks support after an uptrend, trapping buyers. Trapped shorts occur when price breaks resistance after a downtrend, trapping sellers. Stop hunts are rapid price movements to trigger stop losses, often followed by reversal."
-        else:
-            return "No specific documentation found for the query."
+from backend.prompts import compiled_instruction
+from backend.rag import search_knowledge_base
+from backend.model_governor import governed_model
 
 class DerivativesAgent(LlmAgent): # Inherit from LlmAgent
     def __init__(self):
+        # Fixed rule lookups resolved once at startup and inlined (None if the compiler is off or failed).
+        compiled = compiled_instruction("derivatives", AGENT_INSTRUCTION_DERIVATIVES)
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20",
+            model=governed_model("gemini-2.5-flash-preview-05-20"),
             name="DerivativesAnalyzer",
             description="Analyzes Open Interest, Liquidations, Funding Rate, and Cumulative Volume Delta from chart subplots using RAG context.",
-            instruction=AGENT_INSTRUCTION_DERIVATIVES, # instruction goes here
+            instruction=compiled or AGENT_INSTRUCTION_DERIVATIVES, # instruction goes here
             output_schema=Agent5b_Derivatives_Output
         )
         # Initialize tools separately
-        tool_file_search = FunctionTool(func=FileSearchTool(vector_store_id="vs_derivatives_rag").search)
+        tool_file_search = FunctionTool(func=search_knowledge_base)
         tool_file_search.name = "FileSearchTool"
-        tool_file_search.description = "Tool for searching documentation in a vector store."
+        tool_file_search.description = "Searches the local derivatives/trading-checklist knowledge base."
 
-        self.tools: List[FunctionTool] = [tool_file_search]
+        # With the rules inlined the agent answers in a single turn, so it gets no search tool.
+        self.tools: List[FunctionTool] = [] if compiled else [tool_file_search]
 
 # Agent instruction constant
 AGENT_INSTRUCTION_DERIVATIVES = """
@@ -31,19 +31,43 @@ class FinalSignal(BaseModel):
     meta: _Meta = Field(..., alias="_meta", description="REQUIRED Metadata about the analysis") # Renamed _meta to meta and added alias
 
 from google.adk.agents import LlmAgent # Corrected import
+from backend.model_governor import governed_model
 import json
 
+class FinalNotes_Output(BaseModel):
+    notes: Optional[str] = Field(None, description="Overarching context, justifications, alternative scenarios, or residual sentiment/news details")
+
+AGENT_INSTRUCTION_FINAL_NOTES = """
+# 📝 Final Notes Writer
+The FinalSignal itself is assembled in code from the upstream results you receive as JSON.
+Your only job is its free-text `notes` field: 3-6 sentences that tie the trade setup, confidence/risk
+assessment and action plan together, name the main alternative scenario, and mention any residual
+sentiment or news context that the structured fields do not capture.
+* Use only facts present in the upstream results; do not invent prices or levels.
+* Output **only** the JSON object `{"notes": "..."}`.
+"""
+
+class FinalNotesAgent(LlmAgent):
+    def __init__(self):
+        super().__init__(
+            model=governed_model("gemini-2.5-flash-preview-05-20"),
+            name="FinalNotesWriter",
+            description="Writes the free-text notes of the final report; every other field is assembled in code.",
+            instruction=AGENT_INSTRUCTION_FINAL_NOTES,
+            output_schema=FinalNotes_Output
+        )
+
 class FinalPackageAgent(LlmAgent): # Inherit from LlmAgent
     def __init__(self):
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20", # Added model
+            model=governed_model("gemini-2.5-flash-preview-05-20"), # Added model
             name="FinalPackagerValidatorSummarizer",
             description="Assembles, validates, and summarizes the final technical analysis report from all previous agents.",
             output_schema=FinalSignal, # Added output_schema
             tools=[] # No external tools for this agent
         )
 
-    async def run(self, context_from_previous_agents: Dict[str, Any]) -> str:
+    async def simulate_run(self, context_from_previous_agents: Dict[str, Any]) -> str:
         # PLAN: Map inputs to FinalSignal fields, set meta, generate JSON, generate Summary,
         # construct final string WITH separator, verify schema.
         print("PLAN: Assembling final report from all agent outputs, validating schema, and generating summary.")
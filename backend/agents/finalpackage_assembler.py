@@ -0,0 +1,205 @@
+"""
+Deterministic FinalPackage assembly.
+
+Every FinalSignal field is a mapping of fields the upstream agents already
+produced (direction / entry / stop / target from trade setup, win probability
+and tier from confidence-risk, Fear & Greed and dominance from sentiment,
+entry and exit conditions from the action plan, indicator and pattern lines
+from the chart-reading agents), so the final stage builds and validates the
+signal in code instead of spending a model turn on it. _meta.error records a
+risk-reward ratio below MIN_RISK_REWARD and any upstream stage that produced
+no output. render_summary() produces the FinalReport_Summary.txt text from a
+fixed template.
+
+Only the free-text notes can benefit from a model: when the optional notes
+stage (FinalNotesAgent) ran, its notes replace the concatenated upstream notes.
+"""
+import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from backend.agents.confluence_scoring import MIN_RISK_REWARD, risk_reward
+from backend.agents.finalpackage_agent import FinalSignal
+
+ANALYST_ID = "assembler-v1"
+FINAL_NOTES_STAGE_KEY = "step11_notes"
+
+# Upstream stages the assembler reads, in report order.
+ASSEMBLER_INPUTS = (
+    "step01_context",
+    "step02_structure",
+    "step03_ranges",
+    "step04_liquidity",
+    "step05_momentum",
+    "step05b_derivatives",
+    "step06_sentiment",
+    "step07_news",
+    "step08_tradesetup",
+    "step09_confidencerisk",
+    "step10_actionplan",
+)
+
+_MARKET_CONDITIONS = {
+    "trend_up": "trending",
+    "trend_down": "trending",
+    "ranging": "ranging",
+    "accumulation": "ranging",
+    "distribution": "ranging",
+}
+
+
+def format_price(value: Optional[float]) -> str:
+    """106500.0 -> "106,500"; 104951.25 -> "104,951.25"."""
+    if value is None:
+        return "N/A"
+    return f"{value:,.2f}".rstrip("0").rstrip(".")
+
+
+def _indicators(momentum: Any, derivatives: Any, sentiment: Any, news: Any) -> List[str]:
+    lines = []
+    if momentum is not None:
+        if momentum.kalman_output and momentum.kalman_output.state_description:
+            lines.append(f"Kalman: {momentum.kalman_output.state_description}")
+        if momentum.moak_output and momentum.moak_output.state_description:
+            lines.append(f"MOAK: {momentum.moak_output.state_description}")
+        if momentum.volume_delta_output and momentum.volume_delta_output.recent_pattern:
+            lines.append(f"Volume delta: {momentum.volume_delta_output.recent_pattern}")
+        if momentum.divergence_flag:
+            lines.append("Momentum divergence against price")
+    if derivatives is not None:
+        if derivatives.funding_rate_state or derivatives.funding_rate_value is not None:
+            value = f" ({derivatives.funding_rate_value})" if derivatives.funding_rate_value is not None else ""
+            trend = f", {derivatives.funding_rate_trend}" if derivatives.funding_rate_trend else ""
+            lines.append(f"Funding rate: {derivatives.funding_rate_state or 'n/a'}{value}{trend}")
+        if derivatives.open_interest_trend_raw or derivatives.oi_price_interpretation:
+            interpretation = f" ({derivatives.oi_price_interpretation})" if derivatives.oi_price_interpretation else ""
+            lines.append(f"Open interest: {derivatives.open_interest_trend_raw or 'n/a'}{interpretation}")
+        if derivatives.cvd_analysis and derivatives.cvd_analysis.trend:
+            interpretation = f" ({derivatives.cvd_analysis.interpretation})" if derivatives.cvd_analysis.interpretation else ""
+            lines.append(f"CVD: {derivatives.cvd_analysis.trend}{interpretation}")
+    if sentiment is not None and sentiment.fear_greed_value is not None:
+        lines.append(f"Fear & Greed Index: {sentiment.fear_greed_value} ({sentiment.fear_greed_rating or 'n/a'})")
+    if news is not None and (news.market_news_sentiment or news.asset_news_sentiment):
+        lines.append(f"News sentiment: market {news.market_news_sentiment or 'n/a'}, "
+                     f"asset {news.asset_news_sentiment or 'n/a'}")
+    return lines
+
+
+def _patterns(structure: Any, ranges: Any, liquidity: Any) -> List[str]:
+    lines = []
+    if structure is not None:
+        events = [e.type for e in (structure.bos_event, structure.choch_event) if e and e.type]
+        phase = structure.structure_phase or "unclear"
+        lines.append(f"Market structure: {phase}" + (f" with {', '.join(events)}" if events else ""))
+        swings = [s.type for s in structure.major_swings]
+        if swings:
+            lines.append(f"Major swings: {' > '.join(swings)}")
+    if liquidity is not None:
+        for fvg in liquidity.fvgs:
+            lines.append(f"{fvg.type.capitalize()} FVG {format_price(fvg.bottom)}-{format_price(fvg.top)} "
+                         f"({round(fvg.strength_pct * 100)}% strength)")
+        for block in liquidity.order_blocks:
+            lines.append(f"{block.type.capitalize()} order block {format_price(block.bottom)}-{format_price(block.top)}")
+        for signal in liquidity.breakout_signals:
+            lines.append(f"{signal.type} at {format_price(signal.price_level)}")
+    if ranges is not None and (ranges.numeric_interaction_state or ranges.visual_touching_level):
+        touching = f", touching {ranges.visual_touching_level}" if ranges.visual_touching_level else ""
+        lines.append(f"Predictive ranges: {ranges.numeric_interaction_state or 'position unclear'}{touching}")
+    return lines
+
+
+def _strategies(setup: Any) -> List[str]:
+    if setup is None or setup.direction not in ("long", "short"):
+        return []
+    lines = [f"{setup.direction.capitalize()} at {format_price(setup.entry)} with stop {format_price(setup.stop)} "
+             f"and target {format_price(setup.take_profit)}"]
+    for scenario in setup.scenarios:
+        if scenario.type.startswith("alternative"):
+            lines.append(f"{scenario.type.replace('_', ' ').capitalize()}: {scenario.description}")
+    return lines
+
+
+def _joined_notes(outputs: Dict[str, Any]) -> Optional[str]:
+    labels = (("step08_tradesetup", "Trade setup"), ("step09_confidencerisk", "Confidence/risk"),
+              ("step07_news", "News"), ("step10_actionplan", "Action plan"))
+    notes = [f"{label}: {outputs[key].notes}" for key, label in labels
+             if outputs.get(key) is not None and getattr(outputs[key], "notes", None)]
+    return " | ".join(notes) or None
+
+
+def assemble_final_signal(upstream: Dict[str, Optional[BaseModel]], analyst: str = ANALYST_ID,
+                          gate_reason: Optional[str] = None) -> FinalSignal:
+    """
+    Builds and validates the FinalSignal from the upstream stage outputs
+    (pydantic models keyed by stage key; None for stages that failed).
+    gate_reason marks a run stopped early by a pipeline gate: it leads
+    _meta.error and replaces the notes.
+    """
+    context = upstream.get("step01_context")
+    setup = upstream.get("step08_tradesetup")
+    risk = upstream.get("step09_confidencerisk")
+    sentiment = upstream.get("step06_sentiment")
+    plan = upstream.get("step10_actionplan")
+    structure = upstream.get("step02_structure")
+    notes_output = upstream.get(FINAL_NOTES_STAGE_KEY)
+
+    errors = [gate_reason] if gate_reason else []
+    missing = [key for key in ASSEMBLER_INPUTS if key in upstream and upstream[key] is None]
+    if missing:
+        errors.append(f"No output from: {', '.join(missing)}.")
+    direction = setup.direction if setup is not None else None
+    rr = risk_reward(direction, setup.entry, setup.stop, setup.take_profit) if setup is not None else None
+    if rr is not None and rr < MIN_RISK_REWARD:
+        errors.append(f"Calculated RR ({rr}) is below minimum {MIN_RISK_REWARD}.")
+
+    win_probability = None
+    if risk is not None:
+        win_probability = risk.winProbability if risk.winProbability is not None else risk.confidence_pct
+
+    return FinalSignal.model_validate({
+        "direction": direction,
+        "entry": setup.entry if setup is not None else None,
+        "stopLoss": setup.stop if setup is not None else None,
+        "takeProfit": setup.take_profit if setup is not None else None,
+        "winProbability": win_probability,
+        "timeframe": (context.timeframe if context is not None else None) or "unknown",
+        "symbol": (context.pair if context is not None else None) or "UNKNOWN",
+        "confidence": risk.confidence_tier if risk is not None else None,
+        "indicators": _indicators(upstream.get("step05_momentum"), upstream.get("step05b_derivatives"),
+                                  sentiment, upstream.get("step07_news")),
+        "patterns": _patterns(structure, upstream.get("step03_ranges"), upstream.get("step04_liquidity")),
+        "strategies": _strategies(setup),
+        "marketCondition": _MARKET_CONDITIONS.get(structure.structure_phase) if structure is not None else None,
+        "entryConditions": [step.description for step in plan.action_plan] if plan is not None else [],
+        "exitConditions": [trigger.description for trigger in plan.invalidation_triggers] if plan is not None else [],
+        "fearAndGreedValue": sentiment.fear_greed_value if sentiment is not None else None,
+        "fearAndGreedRating": sentiment.fear_greed_rating if sentiment is not None else None,
+        "btcDominance": sentiment.btc_dominance if sentiment is not None else None,
+        "totalMarketCap": sentiment.total_market_cap if sentiment is not None else None,
+        "notes": gate_reason or (notes_output.notes if notes_output is not None and notes_output.notes else None)
+                 or _joined_notes(upstream),
+        "_meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
+            "analyst": analyst,
+            "error": " ".join(errors) or None,
+        },
+    })
+
+
+def render_summary(signal: FinalSignal) -> str:
+    """The one-paragraph FinalReport_Summary.txt text."""
+    if signal.direction in ("long", "short"):
+        recommendation = f"{signal.direction.capitalize()} {signal.symbol} on {signal.timeframe} timeframe"
+    else:
+        recommendation = f"No trade on {signal.symbol} {signal.timeframe}"
+    basis = ", ".join(signal.patterns[:2]) or "the available chart readings"
+    factors = "; ".join(signal.indicators[:3]) or "none reported"
+    risk = signal.exitConditions[0] if signal.exitConditions else "no specific invalidation identified"
+    win_probability = f"{signal.winProbability}%" if signal.winProbability is not None else "N/A"
+    text = (f"Recommendation: {recommendation} based on {basis}. Key Factors: {factors}. "
+            f"Key Risk: {risk.rstrip('.')}. Win Probability: {win_probability}. "
+            f"Confidence: {signal.confidence or 'N/A'}. Stop: {format_price(signal.stopLoss)}.")
+    if signal.meta.error:
+        text += f" Warning: {signal.meta.error}"
+    return text
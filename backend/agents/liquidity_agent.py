@@ -2,6 +2,8 @@ from google.adk.agents import LlmAgent
 from google.adk.tools.function_tool import FunctionTool
 from pydantic import BaseModel, Field
 from typing import Optional, List, Literal
+from backend.rag import search_knowledge_base
+from backend.model_governor import governed_model
 
 # 1. Define Pydantic Models for Output Schema (Agent4_Liquidity_Output)
 class FVG(BaseModel):
@@ -64,16 +66,16 @@ STOP: Generate ONLY the required JSON object after completing the PLAN/REFLECT s
 class LiquidityAgent(LlmAgent):
     def __init__(self):
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20", # Assuming vision capabilities
+            model=governed_model("gemini-2.5-flash-preview-05-20"), # Assuming vision capabilities
             name="analyze_liquidity_orderflow",
             description="Analyzes liquidity zones, FVGs, Order Blocks, and Smart Money Breakout signals using RAG context.",
             instruction=AGENT_INSTRUCTION_LIQUIDITY,
             output_schema=Agent4_Liquidity_Output
         )
 
-        search_tool = FunctionTool(func=self._simulated_file_search)
+        search_tool = FunctionTool(func=search_knowledge_base)
         search_tool.name = "file_search_tool"
-        search_tool.description = "Simulates a RAG/FileSearch tool for querying knowledge base about FVG Order Blocks, AlgoAlpha Smart Money Breakout signals, etc."
+        search_tool.description = "Searches the local knowledge base about FVG Order Blocks, AlgoAlpha Smart Money Breakout signals, etc."
         search_tool.input_schema = {
             "type": "object",
             "properties": {
@@ -82,38 +84,3 @@ class LiquidityAgent(LlmAgent):
             "required": ["query"]
         }
         self.tools: List[FunctionTool] = [search_tool]
-
-    async def _simulated_file_search(self, query: str) -> dict:
-        """
-        Simulates a RAG/FileSearch tool for querying knowledge base.
-        """
-        print(f"[LiquidityAgent Tool SIMULATION] _simulated_file_search called with query: {query}")
-        
-        query_lower = query.lower()
-        if "fvg" in query_lower or "order blocks" in query_lower or "bigbeluga" in query_lower:
-            return {
-                "results": [
-                    {
-                        "content": "FVG (Fair Value Gap) Order Blocks by BigBeluga identify imbalance zones where price moved quickly, leaving gaps. Strength percentage indicates the reliability of the zone. Bearish FVGs act as resistance, bullish FVGs as support. Higher strength percentages (>70%) indicate stronger zones.",
-                        "source": "FVG_Order_Blocks_BigBeluga.md"
-                    }
-                ]
-            }
-        elif "algolpha" in query_lower or "smart money" in query_lower or "breakout" in query_lower:
-            return {
-                "results": [
-                    {
-                        "content": "AlgoAlpha Smart Money Breakout signals include BOS (Break of Structure) and CHoCH (Change of Character). BOS indicates continuation of trend, CHoCH indicates potential reversal. These signals are marked at specific price levels where institutional activity is detected.",
-                        "source": "AlgoAlpha_Smart_Money_Breakout.md"
-                    }
-                ]
-            }
-        else:
-            return {
-                "results": [
-                    {
-                        "content": "General liquidity analysis involves identifying order flow imbalances, institutional activity zones, and breakout patterns.",
-                        "source": "Liquidity_Analysis.md"
-                    }
-                ]
-            }
@@ -28,38 +28,28 @@ from google.adk.agents import LlmAgent
 from google.adk.tools.function_tool import FunctionTool
 import json # Keep json if used by Pydantic models or other parts, otherwise can remove if only for the old run method's print
 
-# Placeholder for a simulated FileSearchTool
-# In a real scenario, this would interact with a RAG system.
-class FileSearchTool:
-    def __init__(self, vector_store_id: str):
-        self.vector_store_id = vector_store_id
-
-    def search(self, query: str) -> str:
-        # Simulate RAG response based on query
-        if "Adaptive Kalman Filter" in query:
-            return "Adaptive Kalman Filter (AKF) Trend Strength Oscillator: Blue zones indicate strong trend, thresholds (e.g., 0.5, -0.5) define strength. Values closer to 1 or -1 indicate stronger trends. Positive values for uptrend, negative for downtrend. Zero-line crossovers can signal trend changes."
-        elif "Aggregated Volume Delta" in query:
-            return "Aggregated Volume Delta: A histogram showing the difference between buying and selling volume. Positive bars indicate buying pressure, negative bars indicate selling pressure. Large bars indicate strong conviction. Divergence with price can signal reversals."
-        elif "Multi-Oscillator Adaptive Kernel" in query:
-            return "Multi-Oscillator Adaptive Kernel (MOAK) Opus: Uses fast and slow signal lines. Crossovers indicate potential trend changes. Overbought (OB) and Oversold (OS) zones (e.g., above 80, below 20) suggest potential reversals. Values between 0-100."
-        else:
-            return "No specific documentation found for the query."
+from backend.prompts import compiled_instruction
+from backend.rag import search_knowledge_base
+from backend.model_governor import governed_model
 
 class MomentumAgent(LlmAgent): # Inherit from LlmAgent
     def __init__(self):
+        # Fixed rule lookups resolved once at startup and inlined (None if the compiler is off or failed).
+        compiled = compiled_instruction("momentum", AGENT_INSTRUCTION_MOMENTUM)
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20",
+            model=governed_model("gemini-2.5-flash-preview-05-20"),
             name="MomentumAnalyzer",
             description="Analyzes momentum and volume indicators (Kalman, Volume Delta, MOAK) from chart images and RAG context.",
-            instruction=AGENT_INSTRUCTION_MOMENTUM, # instruction goes here
+            instruction=compiled or AGENT_INSTRUCTION_MOMENTUM, # instruction goes here
             output_schema=Agent5_Momentum_Output
         )
         # Initialize tools separately
-        tool_file_search = FunctionTool(func=FileSearchTool(vector_store_id="vs_momentum_rag").search)
+        tool_file_search = FunctionTool(func=search_knowledge_base)
         tool_file_search.name = "FileSearchTool"
-        tool_file_search.description = "Tool for searching documentation in a vector store."
+        tool_file_search.description = "Searches the local indicator knowledge base."
         
-        self.tools: List[FunctionTool] = [tool_file_search]
+        # With the rules inlined the agent answers in a single turn, so it gets no search tool.
+        self.tools: List[FunctionTool] = [] if compiled else [tool_file_search]
 
 # Agent instruction constant
 AGENT_INSTRUCTION_MOMENTUM = """
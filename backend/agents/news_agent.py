@@ -18,6 +18,7 @@ import os # For environment variables
 import json # May not be needed after refactor
 import re # For date extraction (if used by LLM, though prompt handles it)
 from backend.tools.mcp_wrappers import PerplexityMCPTool # Import the new tool
+from backend.model_governor import governed_model
 
 # Define the Pydantic model for the output schema (Agent7_News_Output is already defined above)
 
@@ -76,7 +77,7 @@ class NewsAgent(LlmAgent):
         pplx_tool = PerplexityMCPTool()
 
         super().__init__(
-            model="gemini-1.5-flash-latest", 
+            model=governed_model("gemini-1.5-flash-latest"), 
             name="NewsAnalyzer",
             description="Researches and analyzes crypto news using the Perplexity MCP wrapper tool.",
             instruction=AGENT_INSTRUCTION_NEWS, # Use the updated instruction
@@ -12,6 +12,7 @@ from backend.agents.tradesetup_agent import TradeSetupAgent # Import the new Tra
 from backend.agents.confidencerisk_agent import ConfidenceRiskAgent # Import the new ConfidenceRiskAgent class
 from backend.agents.actionplan_agent import ActionPlanAgent # Import the new ActionPlanAgent class
 from backend.agents.finalpackage_agent import FinalPackageAgent # Import the new FinalPackageAgent class
+from backend.model_governor import governed_model
 
 # Wrap the specialized agents as tools
 context_analysis_tool = AgentTool(
@@ -106,7 +107,7 @@ Your final output should be a JSON object with the following structure:
 """
 
 root_agent = LlmAgent(
-    model="gemini-2.5-flash-preview-05-20", # Using the same model for consistency for now
+    model=governed_model("gemini-2.5-flash-preview-05-20"), # Using the same model for consistency for now
     name="orchestrator_agent",
     description="Orchestrates calls to specialized TA agents in sequence for comprehensive analysis.",
     instruction=ORCHESTRATOR_INSTRUCTION,
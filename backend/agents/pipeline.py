@@ -0,0 +1,693 @@
+"""
+Code-driven pipeline executor for the Crypto TA agents.
+
+Instead of asking the orchestrator LlmAgent to call twelve AgentTools one after
+another, the pipeline declares which stages depend on which and runs every
+stage as soon as its dependencies have finished. The seven analysis agents only
+need the user input and the context step, so they run concurrently and a run
+costs roughly the critical path (context -> slowest analysis -> tradesetup ->
+confidencerisk -> actionplan -> finalpackage) instead of the sum of all stages.
+
+A local chart is read once per run and attached to every agent's message as
+the same inline image Part (each cropped view likewise once per run), so the
+vision agents receive pixels rather than only the file URL in the prompt text.
+INLINE_CHART_IMAGES=0 sends the URL text alone.
+
+FUSED_VISUAL_STAGES replaces the five chart-reading agents (structure, ranges,
+liquidity, momentum, derivatives) with one multimodal call whose combined
+output is split back into the five per-agent stage results in code, so the
+rest of the graph is unchanged.
+
+The final stage is assembled in code from the upstream outputs by default
+(FINAL_PACKAGE_MODE=assembler); "assembler_notes" adds one model call that only
+writes the report's free-text notes, and "agent" restores the FinalPackageAgent.
+Likewise the confidence-risk stage is a weighted confluence score over the
+trade setup's typed confirmations and scenarios (CONFIDENCE_RISK_MODE=scoring,
+see confluence_scoring); "agent" restores the ConfidenceRiskAgent call.
+
+Gate rules (pipeline_gates) are checked as each stage finishes; when one fires
+the remaining stages it covers are skipped and the run ends with a "no trade"
+FinalSignal, so a chart with an invalid price or no structure break does not
+pay for the synthesis stages.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple, Type
+
+from google.adk.agents import LlmAgent
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+from pydantic import BaseModel, ValidationError
+
+from backend.adk_message_types import create_content, load_image_part
+from backend.analysis_cache import AnalysisCache, agent_fingerprint, text_sha256
+from backend.chart_preprocessing import ChartPreprocessor, ChartViews
+from backend.chart_store import file_sha256, path_from_file_url
+from backend.run_artifacts import FINAL_STAGE_KEY, RunArtifactWriter
+from backend.structured_logging import get_logger, log_event
+from backend.token_budget import (
+    RunTokenLedger,
+    bind_stage,
+    estimate_tokens,
+    install_token_callbacks,
+    json_tokens,
+    token_profiler,
+    trim_upstream,
+    unbind_stage,
+)
+from backend.tracing import annotate_span, set_span_status, trace_span
+from backend.agents.context_agent import ContextAgent, Agent1_Context_Output
+from backend.agents.structure_agent import StructureAgent, Agent2_Structure_Output
+from backend.agents.ranges_agent import RangesAgent, Agent3_Ranges_Output
+from backend.agents.liquidity_agent import LiquidityAgent, Agent4_Liquidity_Output
+from backend.agents.momentum_agent import MomentumAgent, Agent5_Momentum_Output
+from backend.agents.derivatives_agent import DerivativesAgent, Agent5b_Derivatives_Output
+from backend.agents.sentiment_agent import SentimentAgent, Agent6_Sentiment_Output
+from backend.agents.news_agent import NewsAgent, Agent7_News_Output
+from backend.agents.tradesetup_agent import TradeSetupAgent, Agent8_TradeSetup_Output
+from backend.agents.confidencerisk_agent import ConfidenceRiskAgent, Agent9_ConfidenceRisk_Output
+from backend.agents.confluence_scoring import score_confidence_risk
+from backend.agents.actionplan_agent import ActionPlanAgent, Agent10_ActionPlan_Output
+from backend.agents.finalpackage_agent import FinalNotes_Output, FinalNotesAgent, FinalPackageAgent, FinalSignal
+from backend.agents.finalpackage_assembler import FINAL_NOTES_STAGE_KEY, assemble_final_signal, render_summary
+from backend.agents.pipeline_gates import GateRule
+from backend.agents.visual_extraction_agent import FUSED_SECTIONS, Fused_Visual_Output, VisualExtractionAgent
+
+logger = get_logger(__name__)
+
+CONFIDENCE_RISK_MODE = os.environ.get("CONFIDENCE_RISK_MODE", "scoring").lower()
+FINAL_PACKAGE_MODE = os.environ.get("FINAL_PACKAGE_MODE", "assembler").lower()
+INLINE_CHART_IMAGES = os.environ.get("INLINE_CHART_IMAGES", "1") == "1"
+
+
+@dataclass(frozen=True)
+class PipelineStage:
+    """One node of the pipeline graph: an agent, its output schema and the stages it reads from."""
+    key: str
+    agent_factory: Optional[Callable[[], LlmAgent]]
+    output_model: Type[BaseModel]
+    depends_on: Tuple[str, ...] = ()
+    # Output depends only on the chart image, instruction and model, so it may be memoized per image.
+    cacheable: bool = False
+    # Chart view (see chart_preprocessing.VIEW_PROFILES) sent instead of the full screenshot.
+    image_view: Optional[str] = None
+    # Builds the output in code from the upstream outputs (validated models keyed by stage key, None for
+    # failed stages); such stages have no agent (agent_factory=None).
+    compute: Optional[Callable[[Dict[str, Optional[BaseModel]]], Any]] = None
+
+
+@dataclass
+class StageResult:
+    key: str
+    output: Optional[BaseModel] = None
+    raw_text: Optional[str] = None
+    error: Optional[str] = None
+    started_at: float = 0.0  # seconds since the start of the run
+    duration_s: float = 0.0
+    cached: bool = False
+    skipped: Optional[str] = None  # name of the gate rule that skipped the stage
+
+    def output_dict(self) -> Optional[Dict[str, Any]]:
+        if self.output is None:
+            return None
+        return self.output.model_dump(mode="json", by_alias=True)
+
+
+@dataclass
+class PipelineRun:
+    run_id: str
+    query: str
+    image_url: Optional[str]
+    results: Dict[str, StageResult] = field(default_factory=dict)
+    duration_s: float = 0.0
+    tokens: Optional[RunTokenLedger] = None
+    gate: Optional[GateRule] = None  # the gate rule that stopped the run early
+
+    def outputs(self) -> Dict[str, Any]:
+        """Validated stage outputs keyed by step name (None for failed stages)."""
+        return {key: result.output_dict() for key, result in self.results.items()}
+
+    def errors(self) -> Dict[str, str]:
+        return {key: result.error for key, result in self.results.items() if result.error}
+
+    def timings(self) -> Dict[str, Any]:
+        stages = {
+            key: {"started_at_s": round(r.started_at, 3), "duration_s": round(r.duration_s, 3), "cached": r.cached,
+                  "skipped": r.skipped}
+            for key, r in self.results.items()
+        }
+        return {
+            "total_s": round(self.duration_s, 3),
+            "sequential_sum_s": round(sum(r.duration_s for r in self.results.values()), 3),
+            "stages": stages,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "steps": self.outputs(),
+            "errors": self.errors(),
+            "timings": self.timings(),
+            "tokens": self.tokens.summary() if self.tokens is not None else None,
+            "gate": {"name": self.gate.name, "reason": self.gate.reason} if self.gate is not None else None,
+        }
+
+
+# Called with ("stage_started", key, None) and ("stage_finished", key, result) as the run progresses.
+StageObserver = Callable[[str, str, Optional[StageResult]], Awaitable[None]]
+
+
+# --- Default stage graph ---
+
+ANALYSIS_STAGE_KEYS: Tuple[str, ...] = (
+    "step02_structure",
+    "step03_ranges",
+    "step04_liquidity",
+    "step05_momentum",
+    "step05b_derivatives",
+    "step06_sentiment",
+    "step07_news",
+)
+
+FINAL_PACKAGE_INPUTS: Tuple[str, ...] = (
+    ("step01_context",) + ANALYSIS_STAGE_KEYS + ("step08_tradesetup", "step09_confidencerisk", "step10_actionplan")
+)
+
+
+def final_package_stages(mode: str = FINAL_PACKAGE_MODE) -> Tuple[PipelineStage, ...]:
+    """
+    The final stage for a FINAL_PACKAGE_MODE: "agent" (FinalPackageAgent),
+    "assembler_notes" (a notes-only agent feeding the code assembler) or,
+    by default, "assembler" (code only).
+    """
+    if mode == "agent":
+        return (PipelineStage(FINAL_STAGE_KEY, FinalPackageAgent, FinalSignal, FINAL_PACKAGE_INPUTS),)
+    stages: Tuple[PipelineStage, ...] = ()
+    inputs = FINAL_PACKAGE_INPUTS
+    if mode == "assembler_notes":
+        stages = (PipelineStage(FINAL_NOTES_STAGE_KEY, FinalNotesAgent, FinalNotes_Output, FINAL_PACKAGE_INPUTS),)
+        inputs += (FINAL_NOTES_STAGE_KEY,)
+    return stages + (PipelineStage(FINAL_STAGE_KEY, None, FinalSignal, inputs, compute=assemble_final_signal),)
+
+
+def confidence_risk_stage(mode: str = CONFIDENCE_RISK_MODE) -> PipelineStage:
+    """
+    The confidence-risk stage for a CONFIDENCE_RISK_MODE: "agent" (ConfidenceRiskAgent
+    reading every analysis) or, by default, "scoring" (computed from the trade setup).
+    """
+    if mode == "agent":
+        return PipelineStage(
+            "step09_confidencerisk", ConfidenceRiskAgent, Agent9_ConfidenceRisk_Output,
+            ("step01_context",) + ANALYSIS_STAGE_KEYS + ("step08_tradesetup",),
+        )
+    return PipelineStage("step09_confidencerisk", None, Agent9_ConfidenceRisk_Output, ("step08_tradesetup",),
+                         compute=score_confidence_risk)
+
+
+DEFAULT_STAGES: Tuple[PipelineStage, ...] = (
+    PipelineStage("step01_context", ContextAgent, Agent1_Context_Output),
+    PipelineStage("step02_structure", StructureAgent, Agent2_Structure_Output, ("step01_context",),
+                  cacheable=True, image_view="price"),
+    PipelineStage("step03_ranges", RangesAgent, Agent3_Ranges_Output, ("step01_context",),
+                  cacheable=True, image_view="price"),
+    PipelineStage("step04_liquidity", LiquidityAgent, Agent4_Liquidity_Output, ("step01_context",),
+                  cacheable=True, image_view="price"),
+    PipelineStage("step05_momentum", MomentumAgent, Agent5_Momentum_Output, ("step01_context",),
+                  cacheable=True, image_view="momentum"),
+    PipelineStage("step05b_derivatives", DerivativesAgent, Agent5b_Derivatives_Output, ("step01_context",),
+                  cacheable=True, image_view="derivatives"),
+    PipelineStage("step06_sentiment", SentimentAgent, Agent6_Sentiment_Output, ("step01_context",)),
+    PipelineStage("step07_news", NewsAgent, Agent7_News_Output, ("step01_context",)),
+    PipelineStage(
+        "step08_tradesetup", TradeSetupAgent, Agent8_TradeSetup_Output,
+        ("step01_context",) + ANALYSIS_STAGE_KEYS,
+    ),
+    confidence_risk_stage(),
+    PipelineStage(
+        "step10_actionplan", ActionPlanAgent, Agent10_ActionPlan_Output,
+        ("step08_tradesetup", "step09_confidencerisk"),
+    ),
+) + final_package_stages()
+
+
+# --- Fused visual extraction ---
+
+FUSED_VISUAL_STAGE_KEY = "step02_visual"
+
+
+def _fused_section(section: str) -> Callable[[Dict[str, Any]], Any]:
+    def compute(upstream: Dict[str, Optional[BaseModel]]) -> Any:
+        fused = upstream.get(FUSED_VISUAL_STAGE_KEY)
+        if fused is None:
+            raise ValueError(f"{FUSED_VISUAL_STAGE_KEY} produced no output")
+        return getattr(fused, section)
+    return compute
+
+
+def fuse_visual_stages(stages: Iterable[PipelineStage]) -> Tuple[PipelineStage, ...]:
+    """
+    The stage graph with the chart-reading agents replaced by one fused
+    extraction stage (reading the full chart) plus a computed stage per agent
+    that copies its section out, keeping every downstream key and dependency.
+    """
+    stages = tuple(stages)
+    fused_keys = [s.key for s in stages if s.key in FUSED_SECTIONS]
+    if not fused_keys:
+        return stages
+    first = next(s for s in stages if s.key in FUSED_SECTIONS)
+    fused = PipelineStage(FUSED_VISUAL_STAGE_KEY, VisualExtractionAgent, Fused_Visual_Output, first.depends_on,
+                          cacheable=True)
+    result: List[PipelineStage] = []
+    for stage in stages:
+        if stage.key not in FUSED_SECTIONS:
+            result.append(stage)
+            continue
+        if stage is first:
+            result.append(fused)
+        result.append(PipelineStage(stage.key, None, stage.output_model, (FUSED_VISUAL_STAGE_KEY,),
+                                    compute=_fused_section(FUSED_SECTIONS[stage.key])))
+    return tuple(result)
+
+
+FUSED_VISUAL_STAGES: Tuple[PipelineStage, ...] = fuse_visual_stages(DEFAULT_STAGES)
+
+
+def topological_order(stages: Iterable[PipelineStage]) -> List[PipelineStage]:
+    """
+    Returns the stages in a deterministic dependency order (declaration order is
+    kept among stages that are ready at the same time).
+    Raises ValueError on duplicate keys, unknown dependencies or cycles.
+    """
+    stages = list(stages)
+    by_key: Dict[str, PipelineStage] = {}
+    for stage in stages:
+        if stage.key in by_key:
+            raise ValueError(f"Duplicate pipeline stage key: {stage.key}")
+        by_key[stage.key] = stage
+    for stage in stages:
+        unknown = [dep for dep in stage.depends_on if dep not in by_key]
+        if unknown:
+            raise ValueError(f"Stage {stage.key} depends on unknown stage(s): {', '.join(unknown)}")
+
+    ordered: List[PipelineStage] = []
+    done = set()
+    pending = list(stages)
+    while pending:
+        ready = [s for s in pending if all(dep in done for dep in s.depends_on)]
+        if not ready:
+            raise ValueError(f"Pipeline stages contain a dependency cycle: {', '.join(s.key for s in pending)}")
+        for stage in ready:
+            ordered.append(stage)
+            done.add(stage.key)
+        pending = [s for s in pending if s.key not in done]
+    return ordered
+
+
+def downstream_keys(stages: Iterable[PipelineStage], key: str) -> FrozenSet[str]:
+    """Keys of every stage that depends on `key`, directly or transitively."""
+    found = set()
+    for stage in topological_order(stages):
+        if key in stage.depends_on or found.intersection(stage.depends_on):
+            found.add(stage.key)
+    return frozenset(found)
+
+
+def build_stage_prompt(query: str, image_url: Optional[str], upstream: Dict[str, Any],
+                       panels: Iterable[str] = ()) -> str:
+    """
+    Builds the text handed to a stage: the user request plus its dependencies' JSON
+    outputs. panels names the chart panes shown when image_url is a cropped view.
+    """
+    panels = tuple(panels)
+    if image_url and panels:
+        prompt = f"Chart Image URL: {image_url} (cropped to panels: {', '.join(panels)}). User Query: {query}"
+    elif image_url:
+        prompt = f"Chart Image URL: {image_url}. User Query: {query}"
+    else:
+        prompt = query
+    if upstream:
+        prompt += "\n\nUpstream results (JSON):\n" + json.dumps(upstream, separators=(",", ":"))
+    return prompt
+
+
+def extract_json_text(text: str) -> str:
+    """Strips markdown fences / surrounding prose from a model reply and returns the JSON object text."""
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end < start:
+        return text.strip()
+    return text[start:end + 1]
+
+
+class PipelineExecutor:
+    """
+    Runs the stage graph for one request. Each stage gets its own short-lived
+    ADK session; every stage whose dependencies are done is started immediately,
+    so independent stages overlap via asyncio.gather.
+    """
+
+    def __init__(
+        self,
+        stages: Iterable[PipelineStage] = DEFAULT_STAGES,
+        session_service=None,
+        app_name: str = "crypto_ta_pipeline",
+        user_id: str = "crypto_user",
+        analysis_cache: Optional[AnalysisCache] = None,
+        chart_preprocessor: Optional[ChartPreprocessor] = None,
+        artifact_writer: Optional[RunArtifactWriter] = None,
+        gates: Iterable[GateRule] = (),
+    ):
+        self.stages = topological_order(stages)
+        self.session_service = session_service or InMemorySessionService()
+        self.app_name = app_name
+        self.user_id = user_id
+        self.analysis_cache = analysis_cache
+        self.chart_preprocessor = chart_preprocessor
+        self.artifact_writer = artifact_writer
+        # Rules whose stage is not in this graph never fire; the final stage is rebuilt rather than skipped.
+        stage_keys = {stage.key for stage in self.stages}
+        self.gates = tuple(rule for rule in gates if rule.after in stage_keys)
+        self._gate_skips: Dict[str, FrozenSet[str]] = {}
+        for rule in self.gates:
+            downstream = downstream_keys(self.stages, rule.after) - {FINAL_STAGE_KEY}
+            self._gate_skips[rule.name] = downstream if rule.skips is None else downstream & set(rule.skips)
+        self._runners: Dict[str, Runner] = {
+            stage.key: Runner(agent=stage.agent_factory(), app_name=app_name, session_service=self.session_service)
+            for stage in self.stages if stage.compute is None
+        }
+        self._fingerprints = {key: agent_fingerprint(runner.agent) for key, runner in self._runners.items()}
+        self._instruction_tokens: Dict[str, int] = {}
+        for key, runner in self._runners.items():
+            install_token_callbacks(runner.agent)
+            instruction = runner.agent.instruction
+            self._instruction_tokens[key] = estimate_tokens(instruction if isinstance(instruction, str) else "")
+        if chart_preprocessor is not None:
+            # A stage reading a cropped view must not reuse analyses made from other pixels.
+            for stage in self.stages:
+                if stage.image_view:
+                    fingerprint = self._fingerprints[stage.key]
+                    view_signature = chart_preprocessor.signature(stage.image_view)
+                    fingerprint["prompt_hash"] = text_sha256(f"{fingerprint['prompt_hash']}|{view_signature}")
+
+    async def run(self, query: str, image_url: Optional[str] = None, run_id: Optional[str] = None,
+                  image_id: Optional[str] = None, observer: Optional[StageObserver] = None) -> PipelineRun:
+        """
+        Runs every stage for one request. image_id is the chart's content id
+        (SHA-256); it is derived from a local image_url when not given and keys
+        the per-agent analysis cache. observer, if given, is awaited as each
+        stage starts and finishes so callers can stream progress.
+        """
+        run = PipelineRun(run_id=run_id or f"run_{uuid.uuid4().hex[:8]}", query=query, image_url=image_url)
+        # Stage tasks are created inside the span, so every agent / tool / model span nests under it.
+        with trace_span("pipeline.run", "run", run_id=run.run_id, query_bytes=len(query.encode()),
+                        image=bool(image_url)) as run_span:
+            await self._run(run, image_id, observer)
+            errors = run.errors()
+            set_span_status(run_span, "partial" if errors else "completed")
+            run_span.set_attributes({"stages": len(run.results), "failed_stages": len(errors),
+                                     "cached_stages": sum(1 for r in run.results.values() if r.cached),
+                                     "skipped_stages": sum(1 for r in run.results.values() if r.skipped),
+                                     "gate": run.gate.name if run.gate is not None else None})
+        return run
+
+    async def _run(self, run: PipelineRun, image_id: Optional[str], observer: Optional[StageObserver]) -> None:
+        query, image_url = run.query, run.image_url
+        run.tokens = ledger = RunTokenLedger(run.run_id, len(self._runners))
+        run_started = time.perf_counter()
+        # url -> the run's single loaded copy of that chart (or view) as an inline image Part.
+        image_parts: Dict[str, asyncio.Future] = {}
+
+        def image_part(url: str) -> Awaitable[Optional[types.Part]]:
+            if url not in image_parts:
+                image_parts[url] = asyncio.ensure_future(self._load_image_part(url))
+            return image_parts[url]
+
+        main_image = await image_part(image_url) if image_url and INLINE_CHART_IMAGES else None
+        if image_id is None and image_url and self.analysis_cache is not None:
+            image_id = (hashlib.sha256(main_image.inline_data.data).hexdigest() if main_image is not None
+                        else await asyncio.to_thread(_image_id_for_url, image_url))
+        tasks: Dict[str, asyncio.Task] = {}
+        views_task: Optional[asyncio.Future] = None
+        if self.chart_preprocessor is not None and image_url and any(s.image_view for s in self.stages):
+            # Overlaps with the context stage; only stages that actually call their agent wait for it.
+            views_task = asyncio.ensure_future(self._prepare_views(image_url, image_id))
+        artifacts = self.artifact_writer.begin(run.run_id, query, image_url) if self.artifact_writer else None
+
+        async def notify(kind: str, key: str, result: Optional[StageResult] = None) -> None:
+            if observer is None:
+                return
+            try:
+                await observer(kind, key, result)
+            except Exception as e:
+                # Progress reporting must never break the run itself.
+                logger.warning("Pipeline observer failed on %s %s: %s", kind, key, e)
+
+        async def run_node(stage: PipelineStage) -> StageResult:
+            result = None
+            if stage.cacheable and image_id is not None and self.analysis_cache is not None:
+                # A memoized chart reading does not need to wait for its upstream stages.
+                result = await self._cached_result(stage, image_id, run_started)
+            if result is None:
+                if stage.depends_on:
+                    await asyncio.gather(*(tasks[dep] for dep in stage.depends_on))
+                await notify("stage_started", stage.key)
+                upstream = {dep: run.results[dep].output_dict() for dep in stage.depends_on}
+                gate = run.gate
+                if gate is not None and stage.key in self._gate_skips[gate.name]:
+                    result = StageResult(key=stage.key, started_at=time.perf_counter() - run_started,
+                                         skipped=gate.name)
+                elif gate is not None and stage.key == FINAL_STAGE_KEY:
+                    outputs = {dep: run.results[dep].output for dep in stage.depends_on
+                               if not run.results[dep].skipped}
+                    result = self._compute_stage(stage, outputs, run_started,
+                                                 partial(assemble_final_signal, gate_reason=gate.reason))
+                elif stage.compute is not None:
+                    outputs = {dep: run.results[dep].output for dep in stage.depends_on}
+                    result = self._compute_stage(stage, outputs, run_started)
+                else:
+                    stage_image_url, panels = image_url, ()
+                    if stage.image_view and views_task is not None:
+                        views = await views_task
+                        view_url = views.url_for(stage.image_view) if views else None
+                        if view_url:
+                            stage_image_url = view_url
+                            panels = self.chart_preprocessor.roles_for(stage.image_view)
+                    prompt = self._budgeted_prompt(stage, query, stage_image_url, upstream, panels, ledger)
+                    image = await image_part(stage_image_url) if stage_image_url and INLINE_CHART_IMAGES else None
+                    result = await self._run_stage(stage, prompt, run_started, image_id if stage.cacheable else None,
+                                                   ledger, image)
+            else:
+                await notify("stage_started", stage.key)
+            run.results[stage.key] = result
+            if run.gate is None and result.output is not None:
+                # Set before the dependents' tasks resume, so they see it when they check.
+                run.gate = self._check_gates(stage.key, result.output, run.run_id)
+            if artifacts is not None:
+                artifacts.stage_finished(result)
+            await notify("stage_finished", stage.key, result)
+            return result
+
+        # Stages are created in topological order, so every dependency task exists already.
+        for stage in self.stages:
+            tasks[stage.key] = asyncio.ensure_future(run_node(stage))
+        status = "failed"
+        try:
+            await asyncio.gather(*tasks.values())
+            status = "partial" if run.errors() else "completed"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            if views_task is not None and not views_task.done():
+                views_task.cancel()
+            for future in image_parts.values():
+                future.cancel()
+            if artifacts is not None:
+                final = run.results.get(FINAL_STAGE_KEY)
+                summary = render_summary(final.output) if final and isinstance(final.output, FinalSignal) else None
+                artifacts.finish(status, time.perf_counter() - run_started, final.output_dict() if final else None,
+                                 summary)
+
+        # Report results in declaration order rather than completion order.
+        run.results = {stage.key: run.results[stage.key] for stage in self.stages}
+        run.duration_s = time.perf_counter() - run_started
+        for key, entry in ledger.stages.items():
+            if entry.calls:
+                # The request's real system instruction (ADK adds schema / tool text) sizes later budgets.
+                self._instruction_tokens[key] = entry.sections.get("instruction", 0) // entry.calls
+        token_profiler.add_run(ledger)
+        logger.info("Pipeline %s finished in %.2fs (sequential sum %.2fs, ~%d input tokens)",
+                    run.run_id, run.duration_s, run.timings()["sequential_sum_s"], ledger.input_tokens())
+
+    def _budgeted_prompt(self, stage: PipelineStage, query: str, image_url: Optional[str], upstream: Dict[str, Any],
+                         panels: Iterable[str], ledger: RunTokenLedger) -> str:
+        """build_stage_prompt, with the upstream context trimmed to the stage's token allowance."""
+        panels = tuple(panels)
+        entry = ledger.stage(stage.key)
+        entry.allowance = ledger.allowance(stage.key)
+        query_tokens = estimate_tokens(build_stage_prompt(query, image_url, {}, panels))
+        fixed_tokens = self._instruction_tokens[stage.key] + query_tokens
+        if entry.allowance is not None and upstream:
+            untrimmed_tokens = json_tokens(upstream)
+            upstream, entry.trim_level = trim_upstream(upstream, max(0, entry.allowance - fixed_tokens))
+            entry.trimmed_tokens = untrimmed_tokens - json_tokens(upstream)
+        prompt = build_stage_prompt(query, image_url, upstream, panels)
+        entry.prompt_sections = {"query": query_tokens}
+        entry.prompt_sections.update({f"upstream:{key}": json_tokens(value) for key, value in upstream.items()})
+        entry.prompt_tokens = self._instruction_tokens[stage.key] + estimate_tokens(prompt)
+        entry.over_budget = entry.allowance is not None and entry.prompt_tokens > entry.allowance
+        if entry.trim_level or entry.over_budget:
+            log_event(logger, logging.INFO, "stage prompt trimmed to token budget", run_id=ledger.run_id,
+                      stage=stage.key, allowance=entry.allowance, prompt_tokens=entry.prompt_tokens,
+                      trim_level=entry.trim_level, trimmed_tokens=entry.trimmed_tokens, over_budget=entry.over_budget)
+        return prompt
+
+    def _check_gates(self, key: str, output: BaseModel, run_id: str) -> Optional[GateRule]:
+        """The first gate rule reading `key` whose condition holds for its output."""
+        for rule in self.gates:
+            if rule.after != key:
+                continue
+            try:
+                fired = rule.condition(output)
+            except Exception as e:
+                logger.warning("Gate rule %s failed on %s: %s", rule.name, key, e)
+                continue
+            if fired:
+                log_event(logger, logging.INFO, "pipeline gate fired", run_id=run_id, gate=rule.name, stage=key,
+                          skipped=sorted(self._gate_skips[rule.name]), reason=rule.reason)
+                return rule
+        return None
+
+    def _compute_stage(self, stage: PipelineStage, upstream: Dict[str, Optional[BaseModel]],
+                       run_started: float, compute: Optional[Callable[..., Any]] = None) -> StageResult:
+        """Runs stage.compute (or the given compute override) over the upstream outputs."""
+        started = time.perf_counter()
+        result = StageResult(key=stage.key, started_at=started - run_started)
+        with trace_span(f"agent {stage.key}", "agent", agent=stage.key, computed=True) as agent_span:
+            try:
+                result.output = stage.output_model.model_validate((compute or stage.compute)(upstream))
+                result.raw_text = result.output.model_dump_json(by_alias=True)
+            except ValidationError as e:
+                result.error = f"Output failed {stage.output_model.__name__} validation: {e}"
+            except Exception as e:
+                result.error = f"Stage error: {e}"
+            set_span_status(agent_span, "error" if result.error else "ok", result.error)
+        result.duration_s = time.perf_counter() - started
+        if result.error:
+            logger.warning("Pipeline stage %s failed: %s", stage.key, result.error)
+        return result
+
+    async def _run_stage(self, stage: PipelineStage, prompt: str, run_started: float,
+                         image_id: Optional[str] = None, ledger: Optional[RunTokenLedger] = None,
+                         image: Optional[types.Part] = None) -> StageResult:
+        result = StageResult(key=stage.key, started_at=time.perf_counter() - run_started)
+        stage_started = time.perf_counter()
+        with trace_span(f"agent {stage.key}", "agent", agent=stage.key, prompt_bytes=len(prompt.encode()),
+                        image_bytes=len(image.inline_data.data) if image is not None else 0) as agent_span:
+            ledger_token = bind_stage(ledger, stage.key) if ledger is not None else None
+            try:
+                result.raw_text = await self._invoke_agent(stage, prompt, image)
+                if not result.raw_text:
+                    result.error = "Agent produced no final response"
+                else:
+                    result.output = stage.output_model.model_validate_json(extract_json_text(result.raw_text))
+                    if image_id is not None and self.analysis_cache is not None:
+                        await self._store_cached(stage, image_id, result.output)
+            except ValidationError as e:
+                result.error = f"Output failed {stage.output_model.__name__} validation: {e}"
+            except Exception as e:
+                result.error = f"Stage error: {e}"
+            finally:
+                if ledger_token is not None:
+                    unbind_stage(ledger_token)
+            agent_span.set_attribute("output_bytes", len(result.raw_text.encode()) if result.raw_text else 0)
+            if ledger is not None:
+                tokens = ledger.stage(stage.key)
+                agent_span.set_attributes({"input_tokens": tokens.effective_input_tokens,
+                                           "output_tokens": tokens.output_tokens, "trim_level": tokens.trim_level})
+            set_span_status(agent_span, "error" if result.error else "ok", result.error)
+        result.duration_s = time.perf_counter() - stage_started
+        if result.error:
+            logger.warning("Pipeline stage %s failed after %.2fs: %s", stage.key, result.duration_s, result.error)
+        return result
+
+    async def _prepare_views(self, image_url: str, image_id: Optional[str]) -> Optional[ChartViews]:
+        path = path_from_file_url(image_url)
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            views = await self.chart_preprocessor.prepare(path, image_id)
+        except Exception as e:
+            # Agents fall back to the full screenshot.
+            logger.warning("Chart preprocessing failed for %s: %s", image_url, e)
+            return None
+        log_event(logger, logging.INFO, "chart views ready", image_id=views.image_id, roles=list(views.roles),
+                  source_bytes=views.source_bytes, view_bytes=views.view_bytes, duration_s=round(views.duration_s, 3))
+        return views
+
+    async def _load_image_part(self, image_url: str) -> Optional[types.Part]:
+        path = path_from_file_url(image_url)
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            return (await asyncio.to_thread(load_image_part, path)).to_genai()
+        except (OSError, ValueError) as e:
+            # The agents still get the URL in their prompt text.
+            logger.warning("Chart image %s not attached inline: %s", image_url, e)
+            return None
+
+    async def _cached_result(self, stage: PipelineStage, image_id: str, run_started: float) -> Optional[StageResult]:
+        started = time.perf_counter()
+        try:
+            cached_json = await self.analysis_cache.get(image_id, self._fingerprints[stage.key])
+            if cached_json is None:
+                return None
+            output = stage.output_model.model_validate_json(cached_json)
+        except Exception as e:
+            # A broken cache must never fail the run; fall back to the agent.
+            logger.warning("Analysis cache lookup for %s failed: %s", stage.key, e)
+            return None
+        return StageResult(
+            key=stage.key, output=output, raw_text=cached_json, cached=True,
+            started_at=started - run_started, duration_s=time.perf_counter() - started,
+        )
+
+    async def _store_cached(self, stage: PipelineStage, image_id: str, output: BaseModel) -> None:
+        try:
+            await self.analysis_cache.put(image_id, self._fingerprints[stage.key], output.model_dump_json(by_alias=True))
+        except Exception as e:
+            logger.warning("Analysis cache write for %s failed: %s", stage.key, e)
+
+    async def _invoke_agent(self, stage: PipelineStage, prompt: str,
+                            image: Optional[types.Part] = None) -> Optional[str]:
+        session_id = f"{stage.key}_{uuid.uuid4().hex[:8]}"
+        annotate_span(session_id=session_id)
+        await self.session_service.create_session(app_name=self.app_name, user_id=self.user_id, session_id=session_id)
+        try:
+            final_text = None
+            content = create_content(prompt, [image] if image is not None else (), role="user")
+            async for event in self._runners[stage.key].run_async(
+                user_id=self.user_id, session_id=session_id, new_message=content
+            ):
+                if event.is_final_response() and event.content and event.content.parts:
+                    final_text = "".join(part.text for part in event.content.parts if getattr(part, "text", None))
+            return final_text
+        finally:
+            # Stage sessions only exist for the duration of the call; the result lives in the PipelineRun.
+            await self.session_service.delete_session(app_name=self.app_name, user_id=self.user_id, session_id=session_id)
+
+
+def _image_id_for_url(image_url: str) -> Optional[str]:
+    path = path_from_file_url(image_url)
+    try:
+        return file_sha256(path) if path else None
+    except OSError:
+        return None
@@ -0,0 +1,57 @@
+"""
+Early-exit gate rules for the pipeline.
+
+A gate rule reads one stage's validated output as soon as that stage finishes.
+When its condition holds, the executor stops scheduling the rule's downstream
+stages (they are recorded as skipped, not failed) and the final stage becomes
+a well-formed "no trade" FinalSignal assembled from whatever did run, with the
+rule's reason in _meta.error. Rules are evaluated in declaration order and the
+first one to fire wins; a rule whose stage failed never fires.
+
+  invalid_input   the context agent could not validate the price
+                  (price_now == 0.0): every remaining stage is skipped.
+  no_structure    ranging structure with neither BOS nor CHoCH: the chart
+                  readings finish, the synthesis stages are skipped.
+"""
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from pydantic import BaseModel
+
+from backend.agents.finalpackage_assembler import FINAL_NOTES_STAGE_KEY
+
+# The stages that turn the chart readings into a trade (the final stage itself is always produced).
+SYNTHESIS_STAGE_KEYS: Tuple[str, ...] = (
+    "step08_tradesetup",
+    "step09_confidencerisk",
+    "step10_actionplan",
+    FINAL_NOTES_STAGE_KEY,
+)
+
+
+@dataclass(frozen=True)
+class GateRule:
+    name: str
+    # Stage whose output the condition reads.
+    after: str
+    condition: Callable[[BaseModel], bool]
+    reason: str
+    # Stages skipped once the rule fires (only those downstream of `after`); None skips everything downstream.
+    skips: Optional[Tuple[str, ...]] = None
+
+
+def _invalid_price(context: BaseModel) -> bool:
+    return not context.price_now
+
+
+def _no_structure_break(structure: BaseModel) -> bool:
+    return (structure.structure_phase == "ranging"
+            and not structure.bos_event.type and not structure.choch_event.type)
+
+
+DEFAULT_GATES: Tuple[GateRule, ...] = (
+    GateRule("invalid_input", "step01_context", _invalid_price,
+             "Invalid input: the chart's price could not be validated (price_now is 0.0)."),
+    GateRule("no_structure", "step02_structure", _no_structure_break,
+             "No trade: ranging market structure with no BOS or CHoCH.", skips=SYNTHESIS_STAGE_KEYS),
+)
@@ -2,6 +2,9 @@ from google.adk.agents import LlmAgent
 from google.adk.tools.function_tool import FunctionTool
 from pydantic import BaseModel, Field
 from typing import Optional, List, Literal
+from backend.prompts import compiled_instruction
+from backend.rag import search_knowledge_base
+from backend.model_governor import governed_model
 
 # 1. Define Pydantic Models for Output Schema (Agent3_Ranges_Output_V7)
 class LevelDetail(BaseModel):
@@ -106,17 +109,19 @@ Perform ALL checks: Sanity Order, Numeric Comparison, Assertion, Visual Touch.
 
 class RangesAgent(LlmAgent):
     def __init__(self):
+        # Fixed rule lookups resolved once at startup and inlined (None if the compiler is off or failed).
+        compiled = compiled_instruction("ranges", AGENT_INSTRUCTION_RANGES)
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20", # Assuming vision capabilities
+            model=governed_model("gemini-2.5-flash-preview-05-20"), # Assuming vision capabilities
             name="analyze_predictive_ranges",
             description="Analyzes LuxAlgo Predictive Ranges levels, price interaction states, and visual touching levels.",
-            instruction=AGENT_INSTRUCTION_RANGES,
+            instruction=compiled or AGENT_INSTRUCTION_RANGES,
             output_schema=Agent3_Ranges_Output
         )
 
-        search_tool = FunctionTool(func=self._simulated_file_search)
+        search_tool = FunctionTool(func=search_knowledge_base)
         search_tool.name = "file_search_tool"
-        search_tool.description = "Simulates a RAG/FileSearch tool for querying knowledge base about LuxAlgo Predictive Ranges."
+        search_tool.description = "Searches the local knowledge base about LuxAlgo Predictive Ranges."
         search_tool.input_schema = {
             "type": "object",
             "properties": {
@@ -124,30 +129,5 @@ class RangesAgent(LlmAgent):
             },
             "required": ["query"]
         }
-        self.tools: List[FunctionTool] = [search_tool]
-
-    async def _simulated_file_search(self, query: str) -> dict:
-        """
-        Simulates a RAG/FileSearch tool for querying knowledge base about LuxAlgo Predictive Ranges.
-        """
-        print(f"[RangesAgent Tool SIMULATION] _simulated_file_search called with query: {query}")
-        
-        query_lower = query.lower()
-        if "luxalgo" in query_lower or "predictive" in query_lower or "ranges" in query_lower:
-            return {
-                "results": [
-                    {
-                        "content": "LuxAlgo Predictive Ranges displays R2, R1, MID, S1, S2 levels in the top-left status line. These levels act as dynamic support and resistance zones. The indicator shows current price interaction with these levels.",
-                        "source": "LuxAlgo_Predictive_Ranges.md"
-                    }
-                ]
-            }
-        else:
-            return {
-                "results": [
-                    {
-                        "content": "General range analysis involves identifying key support and resistance levels and price interaction with these zones.",
-                        "source": "Range_Analysis.md"
-                    }
-                ]
-            }
+        # With the rules inlined the agent answers in a single turn, so it gets no search tool.
+        self.tools: List[FunctionTool] = [] if compiled else [search_tool]
@@ -6,6 +6,7 @@ from backend.tools.mcp_wrappers import ( # Import new tools
     FearAndGreed_CompareHistoricalTool,
     CoinGecko_GlobalMarketDataTool
 )
+from backend.model_governor import governed_model
 # Define the Pydantic model for the output schema
 from pydantic import BaseModel, Field
 from typing import Optional
@@ -21,7 +22,7 @@ class Agent6_Sentiment_Output(BaseModel):
 class SentimentAgent(LlmAgent):
     def __init__(self):
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20",
+            model=governed_model("gemini-2.5-flash-preview-05-20"),
             name="analyze_sentiment_macro",
             description="Analyzes market sentiment using Fear & Greed Index and global market data via MCP tools.",
             instruction="""
@@ -2,6 +2,8 @@ from google.adk.agents import LlmAgent
 from google.adk.tools.function_tool import FunctionTool
 from pydantic import BaseModel, Field
 from typing import Optional, List, Literal
+from backend.rag import search_knowledge_base
+from backend.model_governor import governed_model
 
 # 1. Define Pydantic Models for Output Schema (v13)
 class MajorSwing(BaseModel):
@@ -95,16 +97,16 @@ ABSOLUTELY NO numeric fields for BOS/CHoCH events or Monday status/levels. Focus
 class StructureAgent(LlmAgent):
     def __init__(self):
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20", # Assuming vision capabilities
+            model=governed_model("gemini-2.5-flash-preview-05-20"), # Assuming vision capabilities
             name="analyze_market_structure",
             description="Analyzes market structure, AlgoAlpha signals, and Monday Range positioning using visual spatial comparison.",
             instruction=AGENT_INSTRUCTION_STRUCTURE,
             output_schema=Agent2_Structure_Output
         )
 
-        search_tool = FunctionTool(func=self._simulated_file_search)
+        search_tool = FunctionTool(func=search_knowledge_base)
         search_tool.name = "file_search_tool"
-        search_tool.description = "Simulates a RAG/FileSearch tool for querying knowledge base about AlgoAlpha definitions, Monday Range strategy, Swing Point definitions, etc."
+        search_tool.description = "Searches the local knowledge base about AlgoAlpha definitions, Monday Range strategy, Swing Point definitions, etc."
         search_tool.input_schema = {
             "type": "object",
             "properties": {
@@ -113,47 +115,3 @@ class StructureAgent(LlmAgent):
             "required": ["query"]
         }
         self.tools: List[FunctionTool] = [search_tool]
-
-    async def _simulated_file_search(self, query: str) -> dict:
-        """
-        Simulates a RAG/FileSearch tool for querying knowledge base.
-        """
-        print(f"[StructureAgent Tool SIMULATION] _simulated_file_search called with query: {query}")
-        
-        query_lower = query.lower()
-        if "algolpha" in query_lower or "bos" in query_lower or "choch" in query_lower:
-            return {
-                "results": [
-                    {
-                        "content": "AlgoAlpha BOS (Break of Structure) indicates a bullish or bearish break. CHoCH (Change of Character) indicates trend reversal. Both are marked with horizontal lines at the break level.",
-                        "source": "AlgoAlpha_definitions.md"
-                    }
-                ]
-            }
-        elif "monday" in query_lower:
-            return {
-                "results": [
-                    {
-                        "content": "Monday Range strategy uses dotted lines labeled 'Monday High' and 'Monday Low' on the right side of the chart. Price above Monday High suggests bullish bias, below Monday Low suggests bearish bias.",
-                        "source": "Monday_Range_strategy.md"
-                    }
-                ]
-            }
-        elif "swing" in query_lower:
-            return {
-                "results": [
-                    {
-                        "content": "Swing points: HH (Higher High), LL (Lower Low), LH (Lower High), HL (Higher Low). Used to determine market structure phases.",
-                        "source": "Swing_Point_definitions.md"
-                    }
-                ]
-            }
-        else:
-            return {
-                "results": [
-                    {
-                        "content": "General market structure analysis involves identifying trend phases, swing points, and key levels.",
-                        "source": "General_TA.md"
-                    }
-                ]
-            }
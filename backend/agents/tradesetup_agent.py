@@ -23,18 +23,19 @@ class Agent8_TradeSetup_Output(BaseModel):
 
 
 from google.adk.agents import LlmAgent # Corrected import
+from backend.model_governor import governed_model
 from typing import Dict, Any
 
 class TradeSetupAgent(LlmAgent): # Inherit from LlmAgent
     def __init__(self):
         super().__init__(
-            model="gemini-2.5-flash-preview-05-20", # Added model
+            model=governed_model("gemini-2.5-flash-preview-05-20"), # Added model
             name="TradeSetupSynthesizer",
             description="Synthesizes trade setups based on analysis from previous agents.",
             output_schema=Agent8_TradeSetup_Output # Added output_schema
         )
 
-    async def run(self, context_from_previous_agents: Dict[str, Any]) -> Agent8_TradeSetup_Output:
+    async def simulate_run(self, context_from_previous_agents: Dict[str, Any]) -> Agent8_TradeSetup_Output:
         # PLAN: Review context including Agent 5b derivatives, apply weighting logic to identify confluence
         # for long/short or determine no setup, define levels, list prioritized confirmations including derivatives,
         # list scenarios/risks.
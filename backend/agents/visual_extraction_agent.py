@@ -0,0 +1,93 @@
+from google.adk.agents import LlmAgent
+from google.adk.tools.function_tool import FunctionTool
+from pydantic import BaseModel
+from typing import Dict, List, Tuple
+from backend.prompts import compiled_instruction
+from backend.rag import search_knowledge_base
+from backend.model_governor import governed_model
+from backend.agents.structure_agent import AGENT_INSTRUCTION_STRUCTURE, Agent2_Structure_Output
+from backend.agents.ranges_agent import AGENT_INSTRUCTION_RANGES, Agent3_Ranges_Output
+from backend.agents.liquidity_agent import AGENT_INSTRUCTION_LIQUIDITY, Agent4_Liquidity_Output
+from backend.agents.momentum_agent import AGENT_INSTRUCTION_MOMENTUM, Agent5_Momentum_Output
+from backend.agents.derivatives_agent import AGENT_INSTRUCTION_DERIVATIVES, Agent5b_Derivatives_Output
+
+# 1. Combined output: one section per chart-reading agent, each in that agent's own schema
+class Fused_Visual_Output(BaseModel):
+    structure: Agent2_Structure_Output
+    ranges: Agent3_Ranges_Output
+    liquidity: Agent4_Liquidity_Output
+    momentum: Agent5_Momentum_Output
+    derivatives: Agent5b_Derivatives_Output
+
+# Pipeline stage key -> section of Fused_Visual_Output holding that stage's output.
+FUSED_SECTIONS: Dict[str, str] = {
+    "step02_structure": "structure",
+    "step03_ranges": "ranges",
+    "step04_liquidity": "liquidity",
+    "step05_momentum": "momentum",
+    "step05b_derivatives": "derivatives",
+}
+
+AGENT_INSTRUCTION_FUSED_PREAMBLE = """
+# 👁️ Fused Visual Extraction – Agents 2, 3, 4, 5 and 5b in one pass
+
+You receive ONE chart image and a user query. Five specialist instructions follow, one per section.
+Read the chart once and apply EACH specialist's rules to fill ITS section:
+
+| section       | specialist                                   | schema                      |
+|---------------|----------------------------------------------|-----------------------------|
+| `structure`   | Agent 2 – Market Structure / Monday Range    | Agent2_Structure_Output     |
+| `ranges`      | Agent 3 – LuxAlgo Predictive Ranges          | Agent3_Ranges_Output        |
+| `liquidity`   | Agent 4 – FVG / Order Blocks / Breakouts     | Agent4_Liquidity_Output     |
+| `momentum`    | Agent 5 – Momentum subplots                  | Agent5_Momentum_Output      |
+| `derivatives` | Agent 5b – Derivatives subplots              | Agent5b_Derivatives_Output  |
+
+## 🔒 Overrides (take precedence over the specialist texts)
+* Emit ONE JSON object with exactly the five keys above; each value is what that specialist alone would emit.
+* A specialist's "output only JSON" / "SCHEMA_VIOLATION" rule applies to its section only: if a section
+  cannot be filled, emit that section with its fields null/empty and explain in its `notes` when it has one.
+* Do not let a reading from one section leak into another unless a specialist asks for it.
+"""
+
+# Section -> specialist instruction; the section name is also the agent's prompt-compiler key.
+SPECIALIST_INSTRUCTIONS = (
+    ("structure", AGENT_INSTRUCTION_STRUCTURE),
+    ("ranges", AGENT_INSTRUCTION_RANGES),
+    ("liquidity", AGENT_INSTRUCTION_LIQUIDITY),
+    ("momentum", AGENT_INSTRUCTION_MOMENTUM),
+    ("derivatives", AGENT_INSTRUCTION_DERIVATIVES),
+)
+
+def build_fused_instruction() -> Tuple[str, bool]:
+    """The combined instruction, and whether any specialist still needs the knowledge-base search tool."""
+    sections = [AGENT_INSTRUCTION_FUSED_PREAMBLE]
+    needs_search = False
+    for section, instruction in SPECIALIST_INSTRUCTIONS:
+        compiled = compiled_instruction(section, instruction)
+        needs_search = needs_search or compiled is None
+        sections.append(f"\n---\n\n# ▶ Section `{section}`\n{compiled or instruction}")
+    return "\n".join(sections), needs_search
+
+class VisualExtractionAgent(LlmAgent):
+    def __init__(self):
+        instruction, needs_search = build_fused_instruction()
+        super().__init__(
+            model=governed_model("gemini-2.5-flash-preview-05-20"), # Assuming vision capabilities
+            name="extract_chart_visuals",
+            description="Reads structure, predictive ranges, liquidity, momentum and derivatives panes of a chart in one pass.",
+            instruction=instruction,
+            output_schema=Fused_Visual_Output
+        )
+
+        search_tool = FunctionTool(func=search_knowledge_base)
+        search_tool.name = "file_search_tool"
+        search_tool.description = "Searches the local knowledge base about the chart indicators (AlgoAlpha, Monday Range, LuxAlgo, FVG / Order Blocks, momentum and derivatives subplots)."
+        search_tool.input_schema = {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "The search query for the knowledge base."}
+            },
+            "required": ["query"]
+        }
+        # Sections whose rules are not inlined still need the search tool.
+        self.tools: List[FunctionTool] = [search_tool] if needs_search else []
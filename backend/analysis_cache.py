@@ -0,0 +1,131 @@
+"""
+Persistent memoization of per-agent chart analyses.
+
+A chart-reading agent's validated output depends only on the image, its
+instruction and the model, so the cache key is
+sha256(image content id | agent name | sha256(instruction) | model id).
+Changing a prompt or model changes the key, which invalidates old results
+automatically; superseded rows for the same image/agent are dropped on write
+and the store is kept under a byte ceiling by evicting least-recently-used rows.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("ANALYSIS_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def model_id_of(model: Any) -> str:
+    """LlmAgent.model may be a model name or a BaseLlm instance."""
+    return model if isinstance(model, str) else str(getattr(model, "model", model))
+
+
+def agent_fingerprint(agent: Any) -> Dict[str, str]:
+    instruction = agent.instruction if isinstance(agent.instruction, str) else repr(agent.instruction)
+    return {
+        "agent_name": agent.name,
+        "prompt_hash": text_sha256(instruction or ""),
+        "model_id": model_id_of(agent.model),
+    }
+
+
+class AnalysisCache:
+    def __init__(self, db_path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS analysis_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    image_id TEXT NOT NULL,
+                    agent_name TEXT NOT NULL,
+                    prompt_hash TEXT NOT NULL,
+                    model_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_lru ON analysis_cache(last_access)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_agent ON analysis_cache(image_id, agent_name)")
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(image_id: str, agent_name: str, prompt_hash: str, model_id: str) -> str:
+        return text_sha256("|".join((image_id, agent_name, prompt_hash, model_id)))
+
+    async def get(self, image_id: str, fingerprint: Dict[str, str]) -> Optional[str]:
+        """Returns the cached output JSON for this image and agent fingerprint, if any."""
+        return await asyncio.to_thread(self._get, self.make_key(image_id, **fingerprint))
+
+    async def put(self, image_id: str, fingerprint: Dict[str, str], payload_json: str) -> None:
+        await asyncio.to_thread(self._put, image_id, fingerprint, payload_json)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM analysis_cache"
+            ).fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _get(self, cache_key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM analysis_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE analysis_cache SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def _put(self, image_id: str, fingerprint: Dict[str, str], payload_json: str) -> None:
+        cache_key = self.make_key(image_id, **fingerprint)
+        size = len(payload_json.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            # Results produced under an older prompt or model can never be hit again.
+            self._conn.execute(
+                "DELETE FROM analysis_cache WHERE image_id = ? AND agent_name = ? AND cache_key != ?",
+                (image_id, fingerprint["agent_name"], cache_key),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (cache_key, image_id, fingerprint["agent_name"], fingerprint["prompt_hash"], fingerprint["model_id"],
+                 payload_json, size, now, now),
+            )
+            self._evict_over_budget()
+            self._conn.commit()
+
+    def _evict_over_budget(self) -> None:
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM analysis_cache").fetchone()
+        if total <= self.max_bytes:
+            return
+        for cache_key, size in self._conn.execute(
+            "SELECT cache_key, size_bytes FROM analysis_cache ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM analysis_cache WHERE cache_key = ?", (cache_key,))
+            total -= size
+            self.evictions += 1
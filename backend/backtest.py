@@ -0,0 +1,352 @@
+"""
+Offline backtest and calibration of emitted trade signals.
+
+Signals come from the SignalIndex (FinalReport levels, or the trade-setup stage's
+entry / stop / take_profit with levels="tradesetup") and are replayed against
+local OHLCV files named <SYMBOL>_<timeframe>.csv|.parquet (or <SYMBOL>.csv|.parquet)
+in one directory. For every (symbol, timeframe) group, the bars following each
+signal are gathered into a (signals x horizon) window matrix and entry fills,
+stop hits and target hits are found with vectorised first-true searches, so
+thousands of signals resolve without a per-bar Python loop.
+
+Rules: the entry fills on the first bar whose range touches it ("touch") or on
+the first bar after the signal ("market"); stop and target are checked from the
+fill bar on; when one bar touches both, the stop is assumed to have come first.
+Trades still open after `horizon` bars are marked to the last close.
+
+    python -m backend.backtest --ohlcv-dir data/ohlcv --horizon 96 [--symbol BTCUSDT]
+"""
+import argparse
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.signal_index import SignalIndex
+
+OUTCOMES: Tuple[str, ...] = ("target", "stop", "open", "unfilled", "no_data", "invalid")
+TARGET, STOP, OPEN, UNFILLED, NO_DATA, INVALID = range(len(OUTCOMES))
+DEFAULT_HORIZON_BARS = 96
+_WINDOW_CELLS = 4_000_000  # signals x horizon cells resolved per chunk (bounds memory)
+_TIME_COLUMNS = ("timestamp", "time", "open_time", "datetime", "date")
+TRADESETUP_FILE = "step08_tradesetup_output.json"
+
+
+@dataclass
+class Bars:
+    times: np.ndarray  # epoch seconds, ascending
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+
+
+@dataclass
+class SignalSet:
+    signal_ids: List[str]
+    symbols: np.ndarray
+    timeframes: np.ndarray
+    times: np.ndarray
+    side: np.ndarray  # +1 long, -1 short, 0 unknown
+    entry: np.ndarray
+    stop: np.ndarray
+    target: np.ndarray
+    win_probability: np.ndarray  # NaN when not given
+    confidence: np.ndarray
+
+
+@dataclass
+class BacktestResult:
+    signals: SignalSet
+    outcome: np.ndarray
+    r_multiple: np.ndarray
+    bars_to_exit: np.ndarray
+    horizon: int
+    fill: str
+    summary: Dict[str, Any] = field(default_factory=dict)
+
+    def trades(self) -> List[Dict[str, Any]]:
+        s = self.signals
+        return [
+            {
+                "signal_id": s.signal_ids[i],
+                "symbol": s.symbols[i],
+                "timeframe": s.timeframes[i],
+                "outcome": OUTCOMES[self.outcome[i]],
+                "r_multiple": None if np.isnan(self.r_multiple[i]) else round(float(self.r_multiple[i]), 3),
+                "bars_to_exit": int(self.bars_to_exit[i]) if self.bars_to_exit[i] >= 0 else None,
+            }
+            for i in range(len(s.signal_ids))
+        ]
+
+
+# --- Loading ---
+
+def load_signals(index: SignalIndex, levels: str = "final", **filters: Any) -> SignalSet:
+    """Signals from the index as arrays; levels="tradesetup" takes entry/stop/target from step08 instead."""
+    rows = index.signal_rows(**filters)
+    if levels == "tradesetup":
+        for row in rows:
+            path = os.path.join(index.workspaces_dir, row["signal_id"], TRADESETUP_FILE)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    setup = json.load(f)
+            except (OSError, ValueError):
+                continue
+            row.update(direction=(setup.get("direction") or "").lower() or None, entry=setup.get("entry"),
+                       stop_loss=setup.get("stop"), take_profit=setup.get("take_profit"))
+
+    def floats(key: str) -> np.ndarray:
+        return np.array([np.nan if r[key] is None else float(r[key]) for r in rows], dtype=np.float64)
+
+    return SignalSet(
+        signal_ids=[r["signal_id"] for r in rows],
+        symbols=np.array([r["symbol"] or "" for r in rows], dtype=object),
+        timeframes=np.array([r["timeframe"] or "" for r in rows], dtype=object),
+        times=floats("signal_time"),
+        side=np.array([{"long": 1, "short": -1}.get(r["direction"], 0) for r in rows], dtype=np.int8),
+        entry=floats("entry"),
+        stop=floats("stop_loss"),
+        target=floats("take_profit"),
+        win_probability=floats("win_probability"),
+        confidence=np.array([r["confidence"] or "unknown" for r in rows], dtype=object),
+    )
+
+
+def _epoch_seconds(values: np.ndarray) -> np.ndarray:
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[ms]").astype(np.int64) / 1000.0
+    try:
+        numeric = values.astype(np.float64)
+    except ValueError:
+        # ISO strings; numpy parses them vectorised once the UTC suffix is removed.
+        stripped = np.char.replace(np.char.replace(values.astype(str), "Z", ""), "+00:00", "")
+        return stripped.astype("datetime64[ms]").astype(np.int64) / 1000.0
+    # Exchange exports use epoch milliseconds.
+    return numeric / 1000.0 if numeric.size and np.nanmedian(numeric) > 1e11 else numeric
+
+
+def load_ohlcv(path: str) -> Bars:
+    """Reads a CSV (header row required) or Parquet OHLCV file; column names are matched case-insensitively."""
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Reading Parquet OHLCV files requires pyarrow") from e
+        table = pq.read_table(path)
+        columns = {name.lower(): table.column(name).to_numpy() for name in table.column_names}
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            header = [name.strip().lower() for name in f.readline().split(",")]
+        data = np.loadtxt(path, delimiter=",", skiprows=1, dtype=str, ndmin=2)
+        columns = {name: data[:, i] for i, name in enumerate(header)}
+    time_column = next((name for name in _TIME_COLUMNS if name in columns), None)
+    missing = [name for name in ("high", "low", "close") if name not in columns]
+    if time_column is None or missing:
+        raise ValueError(f"{path}: needs a time column {_TIME_COLUMNS} and high/low/close (missing {missing})")
+    times = _epoch_seconds(np.asarray(columns[time_column]))
+    order = np.argsort(times, kind="stable")
+    return Bars(
+        times=times[order],
+        high=np.asarray(columns["high"], dtype=np.float64)[order],
+        low=np.asarray(columns["low"], dtype=np.float64)[order],
+        close=np.asarray(columns["close"], dtype=np.float64)[order],
+    )
+
+
+def find_ohlcv_file(ohlcv_dir: str, symbol: str, timeframe: str) -> Optional[str]:
+    for stem in (f"{symbol}_{timeframe}", symbol):
+        for ext in (".parquet", ".csv"):
+            path = os.path.join(ohlcv_dir, stem + ext)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+# --- Resolution ---
+
+def _first_true(mask: np.ndarray) -> np.ndarray:
+    """Column of the first True per row, -1 where none."""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), -1)
+
+
+def resolve_trades(bars: Bars, times: np.ndarray, side: np.ndarray, entry: np.ndarray, stop: np.ndarray,
+                   target: np.ndarray, horizon: int = DEFAULT_HORIZON_BARS,
+                   fill: str = "touch") -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Resolves signals that all trade on `bars`. Returns (outcome code, R multiple,
+    bars from signal to exit) per signal; R is NaN for unfilled / no-data trades.
+    """
+    n = len(times)
+    outcome = np.full(n, NO_DATA, dtype=np.int8)
+    r_multiple = np.full(n, np.nan)
+    bars_to_exit = np.full(n, -1, dtype=np.int64)
+    risk = np.abs(entry - stop)
+    valid = (side != 0) & (risk > 0) & np.isfinite(entry + stop + target) \
+        & (side * (entry - stop) > 0) & (side * (target - entry) > 0)
+    outcome[~valid] = INVALID
+    count = len(bars.times)
+    start = np.searchsorted(bars.times, times, side="right")  # first bar after the signal
+    todo = np.nonzero(valid & (start < count))[0]
+    offsets = np.arange(horizon)
+    chunk = max(1, _WINDOW_CELLS // max(1, horizon))
+    for lo in range(0, len(todo), chunk):
+        rows = todo[lo:lo + chunk]
+        idx = start[rows, None] + offsets
+        in_range = idx < count
+        idx = np.minimum(idx, count - 1)
+        high = np.where(in_range, bars.high[idx], np.nan)
+        low = np.where(in_range, bars.low[idx], np.nan)
+        s, e, st, tg = side[rows, None], entry[rows, None], stop[rows, None], target[rows, None]
+
+        if fill == "market":
+            fill_col = np.zeros(len(rows), dtype=np.int64)
+        else:
+            fill_col = _first_true((low <= e) & (high >= e))
+        after_fill = (offsets >= fill_col[:, None]) & (fill_col[:, None] >= 0)
+        adverse = np.where(s > 0, low, high)
+        favourable = np.where(s > 0, high, low)
+        stop_col = _first_true(after_fill & (s * (adverse - st) <= 0))
+        target_col = _first_true(after_fill & (s * (favourable - tg) >= 0))
+
+        hit_stop = (stop_col >= 0) & ((target_col < 0) | (stop_col <= target_col))
+        hit_target = (target_col >= 0) & ~hit_stop
+        last_col = in_range.sum(axis=1) - 1
+        res = np.full(len(rows), OPEN, dtype=np.int8)
+        res[hit_target] = TARGET
+        res[hit_stop] = STOP
+        res[fill_col < 0] = UNFILLED
+
+        rr = np.abs(target[rows] - entry[rows]) / risk[rows]
+        mark = side[rows] * (bars.close[start[rows] + last_col] - entry[rows]) / risk[rows]
+        r = np.select([res == TARGET, res == STOP, res == OPEN], [rr, -1.0, mark], np.nan)
+        exit_col = np.select([res == TARGET, res == STOP, res == OPEN], [target_col, stop_col, last_col], -1)
+
+        outcome[rows] = res
+        r_multiple[rows] = r
+        bars_to_exit[rows] = np.where(exit_col >= 0, exit_col + 1, -1)
+    return outcome, r_multiple, bars_to_exit
+
+
+# --- Reporting ---
+
+def outcome_stats(outcome: np.ndarray, r_multiple: np.ndarray) -> Dict[str, Any]:
+    counts = {name: int(np.count_nonzero(outcome == code)) for code, name in enumerate(OUTCOMES)}
+    closed = (outcome == TARGET) | (outcome == STOP)
+    filled = closed | (outcome == OPEN)
+    wins = r_multiple[filled & (r_multiple > 0)]
+    losses = r_multiple[filled & (r_multiple < 0)]
+
+    def mean(values: np.ndarray) -> Optional[float]:
+        return round(float(values.mean()), 4) if values.size else None
+
+    return {
+        "signals": int(outcome.size),
+        "outcomes": counts,
+        "hit_rate": round(counts["target"] / int(closed.sum()), 4) if closed.any() else None,
+        "mean_r_closed": mean(r_multiple[closed]),
+        "mean_r_filled": mean(r_multiple[filled]),
+        "total_r": round(float(r_multiple[filled].sum()), 4),
+        "profit_factor": round(float(wins.sum() / -losses.sum()), 4) if losses.size else None,
+    }
+
+
+def calibration_curve(win_probability: np.ndarray, won: np.ndarray, bins: int = 10) -> Dict[str, Any]:
+    """Predicted (winProbability / 100) vs observed target-hit rate per probability bin, plus Brier score and ECE."""
+    mask = np.isfinite(win_probability)
+    p = np.clip(win_probability[mask] / 100.0, 0.0, 1.0)
+    y = won[mask].astype(np.float64)
+    if p.size == 0:
+        return {"samples": 0, "brier": None, "ece": None, "bins": []}
+    bucket = np.minimum((p * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(bucket, minlength=bins)
+    predicted = np.bincount(bucket, weights=p, minlength=bins)
+    observed = np.bincount(bucket, weights=y, minlength=bins)
+    nonempty = counts > 0
+    gap = np.abs(observed[nonempty] - predicted[nonempty]) / counts[nonempty]
+    return {
+        "samples": int(p.size),
+        "brier": round(float(np.mean((p - y) ** 2)), 4),
+        "ece": round(float(np.sum(gap * counts[nonempty]) / p.size), 4),
+        "bins": [
+            {
+                "range": [round(i / bins * 100), round((i + 1) / bins * 100)],
+                "count": int(counts[i]),
+                "mean_predicted": round(float(predicted[i] / counts[i]), 4),
+                "observed_rate": round(float(observed[i] / counts[i]), 4),
+            }
+            for i in range(bins) if counts[i]
+        ],
+    }
+
+
+def summarize(signals: SignalSet, outcome: np.ndarray, r_multiple: np.ndarray) -> Dict[str, Any]:
+    closed = (outcome == TARGET) | (outcome == STOP)
+    summary = outcome_stats(outcome, r_multiple)
+    summary["by_direction"] = {
+        name: outcome_stats(outcome[signals.side == code], r_multiple[signals.side == code])
+        for name, code in (("long", 1), ("short", -1)) if np.any(signals.side == code)
+    }
+    summary["by_confidence"] = {
+        str(tier): outcome_stats(outcome[signals.confidence == tier], r_multiple[signals.confidence == tier])
+        for tier in sorted(set(signals.confidence.tolist()))
+    }
+    # Calibration only over trades that reached a verdict.
+    summary["calibration"] = calibration_curve(signals.win_probability[closed], outcome[closed] == TARGET)
+    return summary
+
+
+def run_backtest(signals: SignalSet, ohlcv_dir: str, horizon: int = DEFAULT_HORIZON_BARS,
+                 fill: str = "touch") -> BacktestResult:
+    n = len(signals.signal_ids)
+    outcome = np.full(n, NO_DATA, dtype=np.int8)
+    r_multiple = np.full(n, np.nan)
+    bars_to_exit = np.full(n, -1, dtype=np.int64)
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for i, key in enumerate(zip(signals.symbols, signals.timeframes)):
+        groups.setdefault(key, []).append(i)
+    for (symbol, timeframe), members in groups.items():
+        path = find_ohlcv_file(ohlcv_dir, symbol, timeframe)
+        if path is None:
+            continue
+        rows = np.array(members)
+        outcome[rows], r_multiple[rows], bars_to_exit[rows] = resolve_trades(
+            load_ohlcv(path), signals.times[rows], signals.side[rows], signals.entry[rows],
+            signals.stop[rows], signals.target[rows], horizon=horizon, fill=fill,
+        )
+    result = BacktestResult(signals, outcome, r_multiple, bars_to_exit, horizon, fill)
+    result.summary = summarize(signals, outcome, r_multiple)
+    return result
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workspaces = os.path.join(project_root, "workspaces")
+    parser = argparse.ArgumentParser(description="Backtest historical FinalReport signals against local OHLCV files.")
+    parser.add_argument("--ohlcv-dir", required=True, help="Directory of <SYMBOL>_<timeframe>.csv|.parquet files")
+    parser.add_argument("--db", default=os.environ.get("SIGNAL_INDEX_PATH", os.path.join(workspaces, "signal_index.sqlite3")))
+    parser.add_argument("--workspaces", default=workspaces)
+    parser.add_argument("--horizon", type=int, default=DEFAULT_HORIZON_BARS, help="Bars to follow each signal")
+    parser.add_argument("--fill", choices=("touch", "market"), default="touch")
+    parser.add_argument("--levels", choices=("final", "tradesetup"), default="final")
+    parser.add_argument("--symbol")
+    parser.add_argument("--timeframe")
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    parser.add_argument("--trades", action="store_true", help="Include every resolved trade in the output")
+    args = parser.parse_args(argv)
+
+    index = SignalIndex(args.db, args.workspaces)
+    index.scan()
+    signals = load_signals(index, args.levels, symbol=args.symbol, timeframe=args.timeframe,
+                           since=args.since, until=args.until)
+    result = run_backtest(signals, args.ohlcv_dir, horizon=args.horizon, fill=args.fill)
+    output: Dict[str, Any] = {"horizon_bars": args.horizon, "fill": args.fill, "levels": args.levels, **result.summary}
+    if args.trades:
+        output["trades"] = result.trades()
+    print(json.dumps(output, indent=2))
+
+
+if __name__ == "__main__":
+    main()
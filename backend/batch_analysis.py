@@ -0,0 +1,221 @@
+"""
+Batch analysis of many (chart, query) items through the pipeline executor.
+
+Items are admitted in order under a concurrency limit and results are yielded as
+each item finishes, so a caller can stream 50-200 charts without waiting for the
+slowest one. All items share one executor and therefore its per-agent analysis
+cache and the process-wide market-data cache; items with the same chart content
+and query inside a batch share a single pipeline run.
+
+Usage:
+    async for result in run_batch(executor, items, concurrency=4):
+        ...
+    results, summary = await analyze_batch(executor, items)
+"""
+import asyncio
+import math
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel, Field
+
+from backend.agents.pipeline import PipelineExecutor, PipelineRun
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+BATCH_DEFAULT_CONCURRENCY = int(os.environ.get("BATCH_DEFAULT_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+
+
+class BatchItem(BaseModel):
+    query: str
+    image_url: Optional[str] = None
+    item_id: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    concurrency: Optional[int] = Field(None, ge=1)
+    stream: bool = True
+
+
+@dataclass
+class BatchItemResult:
+    index: int
+    item_id: str
+    query: str
+    image_url: Optional[str]
+    status: str = "pending"  # success | partial | failed
+    run: Optional[PipelineRun] = None
+    error: Optional[str] = None
+    queued_s: float = 0.0     # waiting for a concurrency slot (coalesced: for the shared run)
+    latency_s: float = 0.0    # pipeline run time (0 when coalesced)
+    finished_at_s: float = 0.0  # since the start of the batch
+    coalesced: bool = False   # reused the run of an identical item
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "item_id": self.item_id,
+            "query": self.query,
+            "image_url": self.image_url,
+            "status": self.status,
+            "error": self.error,
+            "queued_s": round(self.queued_s, 3),
+            "latency_s": round(self.latency_s, 3),
+            "finished_at_s": round(self.finished_at_s, 3),
+            "coalesced": self.coalesced,
+            "result": self.run.to_dict() if self.run is not None else None,
+        }
+
+
+@dataclass
+class BatchReport:
+    """
+    Aggregates per-item outcomes into throughput and latency figures as results
+    arrive. Throughput and the latency / queue figures cover executed runs only;
+    coalesced items are counted and their wait on the shared run reported apart.
+    """
+    batch_id: str
+    total_items: int
+    concurrency: int
+    started: float = field(default_factory=time.perf_counter)
+    statuses: Dict[str, int] = field(default_factory=dict)
+    latencies: List[float] = field(default_factory=list)
+    queue_waits: List[float] = field(default_factory=list)
+    coalesced_waits: List[float] = field(default_factory=list)
+
+    def add(self, result: BatchItemResult) -> None:
+        self.statuses[result.status] = self.statuses.get(result.status, 0) + 1
+        if result.coalesced:
+            self.coalesced_waits.append(result.queued_s)
+        else:
+            self.latencies.append(result.latency_s)
+            self.queue_waits.append(result.queued_s)
+
+    def summary(self) -> Dict[str, Any]:
+        wall_s = time.perf_counter() - self.started
+        executed = len(self.latencies)
+        return {
+            "batch_id": self.batch_id,
+            "total_items": self.total_items,
+            "completed_items": executed + len(self.coalesced_waits),
+            "concurrency": self.concurrency,
+            "statuses": dict(self.statuses),
+            "coalesced_items": len(self.coalesced_waits),
+            "wall_s": round(wall_s, 3),
+            "items_per_minute": round(executed * 60.0 / wall_s, 2) if wall_s > 0 else None,
+            "latency_s": _distribution(self.latencies),
+            "queued_s": _distribution(self.queue_waits),
+            "coalesced_wait_s": _distribution(self.coalesced_waits),
+        }
+
+
+def _distribution(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, math.ceil(p * len(ordered)) - 1))], 3)
+
+    return {
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": pct(0.5),
+        "p90": pct(0.9),
+        "p99": pct(0.99),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def effective_concurrency(requested: Optional[int]) -> int:
+    return max(1, min(requested or BATCH_DEFAULT_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+
+
+async def run_batch(
+    executor: PipelineExecutor,
+    items: Sequence[BatchItem],
+    concurrency: Optional[int] = None,
+    image_id_for: Optional[Callable[[str], Optional[str]]] = None,
+    report: Optional[BatchReport] = None,
+) -> AsyncIterator[BatchItemResult]:
+    """
+    Runs every item through the executor with at most `concurrency` pipeline runs
+    in flight and yields results in completion order. image_id_for maps an image
+    URL to its content id (e.g. ChartStore.content_id_for_url) for cache keys and
+    de-duplication. Closing the iterator cancels outstanding runs.
+    """
+    limit = report.concurrency if report is not None else effective_concurrency(concurrency)
+    semaphore = asyncio.Semaphore(limit)
+    batch_started = report.started if report is not None else time.perf_counter()
+    shared_runs: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def execute(item: BatchItem, image_id: Optional[str], enqueued: float) -> Tuple[PipelineRun, float, float]:
+        async with semaphore:
+            started = time.perf_counter()
+            run = await executor.run(item.query, item.image_url, image_id=image_id)
+            return run, started - enqueued, time.perf_counter() - started
+
+    async def process(index: int, item: BatchItem) -> BatchItemResult:
+        result = BatchItemResult(index=index, item_id=item.item_id or f"item_{index}",
+                                 query=item.query, image_url=item.image_url)
+        enqueued = time.perf_counter()
+        try:
+            image_id = None
+            if item.image_url and image_id_for is not None:
+                image_id = await asyncio.to_thread(image_id_for, item.image_url)
+            key = (image_id or item.image_url or "", item.query)
+            shared = shared_runs.get(key)
+            result.coalesced = shared is not None
+            if shared is None:
+                shared = shared_runs[key] = asyncio.ensure_future(execute(item, image_id, enqueued))
+            # Shielded so one consumer going away does not cancel a run others are waiting on.
+            result.run, queued_s, latency_s = await asyncio.shield(shared)
+            if result.coalesced:
+                result.queued_s = time.perf_counter() - enqueued
+            else:
+                result.queued_s, result.latency_s = queued_s, latency_s
+            result.status = "partial" if result.run.errors() else "success"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result.status = "failed"
+            result.error = str(e)
+            logger.warning("Batch item %s failed: %s", result.item_id, e)
+        result.finished_at_s = time.perf_counter() - batch_started
+        return result
+
+    tasks = [asyncio.ensure_future(process(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if report is not None:
+                report.add(result)
+            yield result
+    finally:
+        for pending in list(tasks) + list(shared_runs.values()):
+            if not pending.done():
+                pending.cancel()
+
+
+async def analyze_batch(
+    executor: PipelineExecutor,
+    items: Sequence[BatchItem],
+    concurrency: Optional[int] = None,
+    image_id_for: Optional[Callable[[str], Optional[str]]] = None,
+) -> Tuple[List[BatchItemResult], Dict[str, Any]]:
+    """Runs a whole batch and returns the results in input order plus the batch summary."""
+    report = new_report(len(items), concurrency)
+    results = [result async for result in run_batch(executor, items, image_id_for=image_id_for, report=report)]
+    results.sort(key=lambda r: r.index)
+    return results, report.summary()
+
+
+def new_report(total_items: int, concurrency: Optional[int] = None) -> BatchReport:
+    return BatchReport(batch_id=f"batch_{uuid.uuid4().hex[:8]}", total_items=total_items,
+                       concurrency=effective_concurrency(concurrency))
@@ -0,0 +1,4 @@
+from backend.benchmark.fake_model import CANNED_TOOL_ARGS, FakeLlm
+from backend.benchmark.stub_mcp_server import StubServer, stub_mcp_env
+
+__all__ = ["CANNED_TOOL_ARGS", "FakeLlm", "StubServer", "stub_mcp_env"]
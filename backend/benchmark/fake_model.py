@@ -0,0 +1,107 @@
+"""
+Stand-in LLM for offline benchmarks.
+
+FakeLlm plugs into LlmAgent(model=...) like a Gemini client but never leaves the
+process: it waits a configurable latency and returns a canned response. When the
+request offers tools it first asks for each tool it has canned arguments for
+(one function-call turn, as a real model would), so tool dispatch, the MCP
+wrappers and the extra model round trip are exercised too. Given a
+ContextCacheManager over a LocalContextCacheBackend, requests go through the
+same context-cache path as GovernedGemini, and cached prefixes are expanded
+(or rejected once expired) the way the provider would.
+"""
+import asyncio
+import random
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+from pydantic import PrivateAttr
+
+from backend.context_cache import ContextCacheManager
+from backend.model_governor import estimate_request_tokens
+from backend.token_budget import CHARS_PER_TOKEN
+
+# Arguments the fake model sends for each tool it knows; other tools are never called.
+CANNED_TOOL_ARGS: Dict[str, Dict[str, Any]] = {
+    "fetch_coingecko_price": {"coins": "bitcoin", "currencies": "usd"},
+    "fetch_fearandgreed_current": {"random_string": "trigger"},
+    "compare_fearandgreed_historical": {"days": 30},
+    "fetch_coingecko_global_market_data": {"include_defi": False},
+    "call_perplexity_mcp": {"tool_to_call": "search", "tool_args": {"query": "Bitcoin market news today"}},
+    "FileSearchTool": {"query": "How to interpret the indicator values and states?"},
+    "file_search_tool": {"query": "How to interpret FVG Order Blocks BigBeluga indicator zones?"},
+}
+
+
+class FakeLlm(BaseLlm):
+    """Returns response_text after latency_s (+/- jitter_s) per call; counts calls and simulated model time."""
+
+    model: str = "fake-llm"
+    response_text: str = "{}"
+    latency_s: float = 0.0
+    jitter_s: float = 0.0
+    call_tools: bool = True
+    context_cache: Optional[ContextCacheManager] = None
+
+    _calls: int = PrivateAttr(default=0)
+    _model_s: float = PrivateAttr(default=0.0)
+
+    @classmethod
+    def supported_models(cls) -> List[str]:
+        return [r"fake-.*"]
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    @property
+    def model_s(self) -> float:
+        return self._model_s
+
+    def reset_counters(self) -> None:
+        self._calls = 0
+        self._model_s = 0.0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        if self.context_cache is None:
+            async for response in self._respond(llm_request):
+                yield response
+            return
+        async for response in self.context_cache.generate(self.model, llm_request, self._respond):
+            yield response
+
+    async def _respond(self, llm_request: LlmRequest) -> AsyncGenerator[LlmResponse, None]:
+        cached_tokens = 0
+        if self.context_cache is not None and llm_request.config and llm_request.config.cached_content:
+            llm_request, cached_tokens = self.context_cache.backend.expand(llm_request)
+        delay = max(0.0, self.latency_s + random.uniform(-self.jitter_s, self.jitter_s))
+        started = time.perf_counter()
+        await asyncio.sleep(delay)
+        self._calls += 1
+        self._model_s += time.perf_counter() - started
+
+        calls = self._tool_calls(llm_request)
+        if calls:
+            parts = [types.Part(function_call=types.FunctionCall(name=name, args=args)) for name, args in calls]
+        else:
+            parts = [types.Part(text=self.response_text)]
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=estimate_request_tokens(llm_request),
+            cached_content_token_count=cached_tokens or None,
+            candidates_token_count=sum(len(part.text or "") for part in parts) // CHARS_PER_TOKEN,
+        )
+        yield LlmResponse(content=types.Content(role="model", parts=parts), usage_metadata=usage)
+
+    def _tool_calls(self, llm_request: LlmRequest) -> List[tuple]:
+        if not self.call_tools or not llm_request.tools_dict:
+            return []
+        for content in llm_request.contents or []:
+            if any(part.function_response is not None for part in content.parts or []):
+                return []  # tools already answered; produce the final output
+        return [(name, CANNED_TOOL_ARGS[name]) for name in llm_request.tools_dict if name in CANNED_TOOL_ARGS]
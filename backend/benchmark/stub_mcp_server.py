@@ -0,0 +1,141 @@
+"""
+Stub MCP stdio servers for offline benchmarks.
+
+    python backend/benchmark/stub_mcp_server.py [coingecko|fearandgreed|perplexity]
+
+Speaks the same newline-delimited JSON-RPC 2.0 as the real Node servers
+(initialize, ping, tools/list, tools/call) and answers every tool with canned
+data after STUB_MCP_LATENCY_S seconds. Requests are handled concurrently, so a
+pooled process multiplexes calls the way the real servers do. Without a server
+name it serves every stub tool (their names do not collide), so
+COINGECKO_MCP_SCRIPT_PATH / FEAR_AND_GREED_MCP_SCRIPT_PATH /
+PERPLEXITY_MCP_SCRIPT_PATH can all point at this file (see stub_mcp_env()).
+"""
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict
+
+STUB_MCP_LATENCY_S = float(os.environ.get("STUB_MCP_LATENCY_S", "0.05"))
+SCRIPT_PATH = os.path.abspath(__file__)
+
+
+def _price(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    prices = {"bitcoin": 104250.0, "ethereum": 2540.0, "solana": 168.0}
+    coins = [c for c in str(arguments.get("coins", "bitcoin")).split(",") if c]
+    currencies = [c for c in str(arguments.get("currencies", "usd")).split(",") if c]
+    return {coin: {cur: prices.get(coin, 1.0) for cur in currencies} for coin in coins}
+
+
+def _fear_and_greed_interpretation(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    value = int(arguments.get("value", 50))
+    label = ("Extreme Fear" if value < 25 else "Fear" if value < 45 else "Neutral" if value < 56
+             else "Greed" if value < 76 else "Extreme Greed")
+    return {"value": value, "classification": label}
+
+
+SERVERS: Dict[str, Dict[str, Callable[[Dict[str, Any]], Any]]] = {
+    "coingecko": {
+        "get-price": _price,
+        "global-market-data": lambda args: {
+            "total_market_cap_usd": 3.41e12,
+            "total_volume_usd": 1.12e11,
+            "btc_dominance_pct": 62.4,
+            "eth_dominance_pct": 8.9,
+            "market_cap_change_24h_pct": 1.3,
+            **({"defi_market_cap_usd": 1.1e11} if args.get("include_defi") else {}),
+        },
+    },
+    "fearandgreed": {
+        "mcp_fearandgreed_get_current": lambda args: {"value": 64, "classification": "Greed", "timestamp": int(time.time())},
+        "mcp_fearandgreed_interpret_value": _fear_and_greed_interpretation,
+        "mcp_fearandgreed_compare_with_historical": lambda args: {
+            "current": 64, "average": 58.2, "days": int(args.get("days", 30)), "trend": "rising",
+        },
+    },
+    "perplexity": {
+        name: lambda args: {
+            "answer": "Bitcoin trades near recent highs on steady ETF inflows; no major regulatory news in the last 24h.",
+            "sources": ["https://example.com/markets/bitcoin"],
+            "query": args.get("query") or args.get("message"),
+        }
+        for name in ("search", "chat_perplexity", "get_documentation", "find_apis", "check_deprecated_code")
+    },
+}
+
+
+class StubServer:
+    def __init__(self, name: str = "all", latency_s: float = STUB_MCP_LATENCY_S):
+        self.name = name
+        self.tools = SERVERS[name] if name in SERVERS else {
+            tool: handler for tools in SERVERS.values() for tool, handler in tools.items()
+        }
+        self.latency_s = latency_s
+        self._write_lock = threading.Lock()
+
+    def serve(self) -> None:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if "id" not in message:
+                continue  # notifications need no reply
+            threading.Thread(target=self._handle, args=(message,), daemon=True).start()
+
+    def _handle(self, message: Dict[str, Any]) -> None:
+        method = message.get("method")
+        params = message.get("params") or {}
+        if method == "initialize":
+            result = {
+                "protocolVersion": params.get("protocolVersion", "2024-11-05"),
+                "capabilities": {"tools": {}},
+                "serverInfo": {"name": f"stub-{self.name}", "version": "0.1"},
+            }
+        elif method == "ping":
+            result = {}
+        elif method == "tools/list":
+            result = {"tools": [{"name": name, "inputSchema": {"type": "object"}} for name in self.tools]}
+        elif method == "tools/call":
+            handler = self.tools.get(params.get("name"))
+            time.sleep(self.latency_s)
+            if handler is None:
+                result = {"content": [{"type": "text", "text": f"Unknown tool {params.get('name')}"}], "isError": True}
+            else:
+                payload = handler(params.get("arguments") or {})
+                result = {"content": [{"type": "text", "text": json.dumps(payload)}]}
+        else:
+            self._send({"jsonrpc": "2.0", "id": message["id"],
+                        "error": {"code": -32601, "message": f"Method not found: {method}"}})
+            return
+        self._send({"jsonrpc": "2.0", "id": message["id"], "result": result})
+
+    def _send(self, message: Dict[str, Any]) -> None:
+        with self._write_lock:
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+
+
+def stub_mcp_env() -> Dict[str, str]:
+    """Script-path overrides that point every MCP wrapper at this stub (set before importing the agents)."""
+    return {
+        "COINGECKO_MCP_SCRIPT_PATH": SCRIPT_PATH,
+        "FEAR_AND_GREED_MCP_SCRIPT_PATH": SCRIPT_PATH,
+        "PERPLEXITY_MCP_SCRIPT_PATH": SCRIPT_PATH,
+    }
+
+
+def main() -> None:
+    name = sys.argv[1] if len(sys.argv) > 1 else "all"
+    if name != "all" and name not in SERVERS:
+        sys.exit(f"usage: stub_mcp_server.py [{'|'.join(SERVERS)}]")
+    StubServer(name).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Offline end-to-end benchmark of the analysis pipeline.
+
+Every stage's agent gets a FakeLlm that answers with that stage's output from
+a fixture run folder (workspaces/<SYMBOL>_Analysis_*/stepNN_*_output.json) after
+a configurable latency, and the MCP wrappers are pointed at the stub stdio
+servers, so a full PipelineExecutor run needs no API keys or network. Runs are
+driven at several concurrency levels and reported as:
+
+  - end-to-end latency percentiles and runs per second,
+  - per-agent overhead: stage duration minus the simulated model time
+    (session setup, prompt building, tool dispatch, MCP round trips, validation),
+  - framework overhead: run wall time minus the model time on the critical path.
+
+--context-cache routes every fake model call through a ContextCacheManager over
+the in-process LocalContextCacheBackend, exercising handle creation, reuse and
+the counters reported by /debug/context-cache. --fused runs the graph with the
+single fused visual-extraction call (FUSED_VISUAL_STAGES), whose fixture is the
+five chart-reading agents' fixtures combined.
+
+    python -m backend.benchmark.suite --runs 20 --concurrency 1,4,16 --latency-ms 200
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from pydantic import ValidationError
+
+from backend.agents.pipeline import (
+    DEFAULT_STAGES,
+    FUSED_VISUAL_STAGE_KEY,
+    FUSED_VISUAL_STAGES,
+    PipelineExecutor,
+    PipelineStage,
+)
+from backend.agents.finalpackage_assembler import FINAL_NOTES_STAGE_KEY
+from backend.agents.pipeline_gates import DEFAULT_GATES, GateRule
+from backend.agents.visual_extraction_agent import FUSED_SECTIONS
+from backend.benchmark.fake_model import FakeLlm
+from backend.context_cache import ContextCacheManager, LocalContextCacheBackend
+from backend.benchmark.stub_mcp_server import SCRIPT_PATH as STUB_MCP_SCRIPT_PATH
+from backend.run_artifacts import FINAL_STAGE_KEY, artifact_file_name
+from backend.structured_logging import get_logger
+from backend.tools import mcp_wrappers
+from backend.tools.mcp_pool import shutdown_mcp_pools
+
+logger = get_logger(__name__)
+
+WORKSPACES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "workspaces")
+DEFAULT_QUERY = "Analyze BTCUSDT 4h chart"
+
+# Stages with no recorded output file of their own, answered from another stage's file.
+FIXTURE_SOURCES = {FINAL_NOTES_STAGE_KEY: FINAL_STAGE_KEY}
+
+
+def _fixture_file(stage_key: str) -> str:
+    return artifact_file_name(FIXTURE_SOURCES.get(stage_key, stage_key))
+
+
+def find_fixture_dir(workspaces_dir: str = WORKSPACES_DIR) -> Optional[str]:
+    """The newest run folder that has an output file for every default stage."""
+    candidates = sorted(glob.glob(os.path.join(workspaces_dir, "*_Analysis_*")), reverse=True)
+    for path in candidates:
+        if all(os.path.isfile(os.path.join(path, _fixture_file(s.key))) for s in DEFAULT_STAGES):
+            return path
+    return None
+
+
+def _drop_invalid_items(model: type, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Makes a recorded output schema-valid by dropping the list items the schema
+    rejects (old runs predate some constraints, e.g. a null FVG strength).
+    """
+    for _ in range(50):
+        try:
+            model.model_validate(payload)
+            return payload
+        except ValidationError as e:
+            loc = next((err["loc"] for err in e.errors() if any(isinstance(p, int) for p in err["loc"])), None)
+            if loc is None:
+                raise
+            index_at = max(i for i, p in enumerate(loc) if isinstance(p, int))
+            container = payload
+            for part in loc[:index_at]:
+                container = container[part]
+            del container[loc[index_at]]
+    model.model_validate(payload)
+    return payload
+
+
+def load_fixtures(fixture_dir: str, stages: Sequence[PipelineStage] = DEFAULT_STAGES) -> Dict[str, str]:
+    """
+    Stage key -> schema-valid JSON response text, from one recorded run folder,
+    plus the fused visual-extraction response assembled from its five sections.
+    """
+    payloads = {}
+    for stage in stages:
+        path = os.path.join(fixture_dir, _fixture_file(stage.key))
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if stage.key == FINAL_NOTES_STAGE_KEY:
+            payload = {"notes": payload.get("notes")}
+        try:
+            stage.output_model.model_validate(payload)
+        except ValidationError:
+            logger.warning("Fixture %s is not a valid %s; dropping the offending list items",
+                           path, stage.output_model.__name__)
+            payload = _drop_invalid_items(stage.output_model, payload)
+        payloads[stage.key] = payload
+    fixtures = {key: json.dumps(payload) for key, payload in payloads.items()}
+    if all(key in payloads for key in FUSED_SECTIONS):
+        fixtures[FUSED_VISUAL_STAGE_KEY] = json.dumps(
+            {section: payloads[key] for key, section in FUSED_SECTIONS.items()}
+        )
+    return fixtures
+
+
+def use_stub_mcp_servers() -> None:
+    """Points every MCP tool wrapper at the stub server script (the wrappers read the paths per call)."""
+    mcp_wrappers.COINGECKO_MCP_SCRIPT_PATH = STUB_MCP_SCRIPT_PATH
+    mcp_wrappers.FEAR_AND_GREED_MCP_SCRIPT_PATH = STUB_MCP_SCRIPT_PATH
+    mcp_wrappers.PERPLEXITY_MCP_SCRIPT_PATH = STUB_MCP_SCRIPT_PATH
+    mcp_wrappers.market_data_cache.clear()
+
+
+def build_executor(fixtures: Dict[str, str], latency_s: float, jitter_s: float = 0.0,
+                   stages: Sequence[PipelineStage] = DEFAULT_STAGES,
+                   context_cache: Optional[ContextCacheManager] = None,
+                   gates: Sequence[GateRule] = DEFAULT_GATES) -> PipelineExecutor:
+    """A PipelineExecutor whose agents all run on FakeLlm; no analysis cache, chart views or artifacts."""
+    executor = PipelineExecutor(stages=stages, app_name="crypto_ta_benchmark", gates=gates)
+    for key, runner in executor._runners.items():
+        runner.agent.model = FakeLlm(response_text=fixtures[key], latency_s=latency_s, jitter_s=jitter_s,
+                                     context_cache=context_cache)
+    return executor
+
+
+def _fake_models(executor: PipelineExecutor) -> Dict[str, FakeLlm]:
+    return {key: runner.agent.model for key, runner in executor._runners.items()}
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    ordered = sorted(values)
+
+    def pct(p: float) -> Optional[float]:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 4) if ordered else None
+
+    return {
+        "mean": round(sum(ordered) / len(ordered), 4) if ordered else None,
+        "p50": pct(0.5),
+        "p90": pct(0.9),
+        "p99": pct(0.99),
+        "max": round(ordered[-1], 4) if ordered else None,
+    }
+
+
+def _critical_path_s(stages: Sequence[PipelineStage], stage_cost: Dict[str, float]) -> float:
+    finish: Dict[str, float] = {}
+    for stage in stages:  # executor.stages is already topologically ordered
+        finish[stage.key] = max((finish[d] for d in stage.depends_on), default=0.0) + stage_cost.get(stage.key, 0.0)
+    return max(finish.values(), default=0.0)
+
+
+async def run_level(executor: PipelineExecutor, concurrency: int, runs: int,
+                    query: str = DEFAULT_QUERY) -> Dict[str, Any]:
+    """Runs `runs` pipelines with at most `concurrency` in flight and summarizes them."""
+    models = _fake_models(executor)
+    for model in models.values():
+        model.reset_counters()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    stage_durations: Dict[str, List[float]] = {key: [] for key in models}
+    failed = 0
+
+    async def one(i: int) -> None:
+        nonlocal failed
+        async with semaphore:
+            run = await executor.run(query, run_id=f"bench_{concurrency}_{i}")
+        latencies.append(run.duration_s)
+        failed += int(bool(run.errors()))
+        for key, result in run.results.items():
+            if key in stage_durations:  # computed stages have no model
+                stage_durations[key].append(result.duration_s)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(runs)))
+    wall_s = time.perf_counter() - started
+
+    agents: Dict[str, Any] = {}
+    model_per_run: Dict[str, float] = {}
+    for key, model in models.items():
+        durations = stage_durations[key]
+        model_per_run[key] = model.model_s / len(durations) if durations else 0.0
+        overheads = [d - model_per_run[key] for d in durations]
+        agents[key] = {
+            "model_calls_per_run": round(model.calls / len(durations), 2) if durations else None,
+            "model_s": round(model_per_run[key], 4),
+            "duration_s": _percentiles(durations),
+            "overhead_s": _percentiles(overheads),
+        }
+    critical_model_s = _critical_path_s(executor.stages, model_per_run)
+    return {
+        "concurrency": concurrency,
+        "runs": runs,
+        "failed_runs": failed,
+        "wall_s": round(wall_s, 3),
+        "runs_per_s": round(runs / wall_s, 3) if wall_s else None,
+        "latency_s": _percentiles(latencies),
+        "critical_path_model_s": round(critical_model_s, 4),
+        "framework_overhead_s": _percentiles([latency - critical_model_s for latency in latencies]),
+        "agents": agents,
+    }
+
+
+async def run_suite(concurrency_levels: Sequence[int] = (1, 4, 16), runs: int = 20, latency_s: float = 0.2,
+                    jitter_s: float = 0.0, fixture_dir: Optional[str] = None, warmup: int = 1,
+                    context_cache: bool = False, fused: bool = False) -> Dict[str, Any]:
+    fixture_dir = fixture_dir or find_fixture_dir()
+    if fixture_dir is None:
+        raise FileNotFoundError(f"No complete *_Analysis_* run folder under {WORKSPACES_DIR}")
+    use_stub_mcp_servers()
+    cache = ContextCacheManager(LocalContextCacheBackend()) if context_cache else None
+    stages = FUSED_VISUAL_STAGES if fused else DEFAULT_STAGES
+    executor = build_executor(load_fixtures(fixture_dir), latency_s, jitter_s, stages, context_cache=cache)
+    try:
+        if warmup:
+            # Spawns the stub MCP processes and loads the knowledge index outside the measurements.
+            await run_level(executor, 1, warmup)
+        levels = [await run_level(executor, level, max(runs, level)) for level in concurrency_levels]
+    finally:
+        await shutdown_mcp_pools()
+    return {
+        "fixture_dir": fixture_dir,
+        "model_latency_s": latency_s,
+        "model_jitter_s": jitter_s,
+        "fused_visual_extraction": fused,
+        "levels": levels,
+        "context_cache": cache.stats() if cache else None,
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f"Fixtures: {report['fixture_dir']}",
+        f"Fake model latency: {report['model_latency_s']}s (+/- {report['model_jitter_s']}s)",
+        f"Fused visual extraction: {'on' if report['fused_visual_extraction'] else 'off'}",
+        "",
+        f"{'conc':>5} {'runs':>5} {'fail':>5} {'runs/s':>8} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} "
+        f"{'crit s':>8} {'fw ovh p50':>11}",
+    ]
+    for level in report["levels"]:
+        latency = level["latency_s"]
+        lines.append(
+            f"{level['concurrency']:>5} {level['runs']:>5} {level['failed_runs']:>5} {level['runs_per_s']:>8} "
+            f"{latency['p50']:>8} {latency['p90']:>8} {latency['p99']:>8} {level['critical_path_model_s']:>8} "
+            f"{level['framework_overhead_s']['p50']:>11}"
+        )
+    for level in report["levels"]:
+        lines += ["", f"Per-agent overhead at concurrency {level['concurrency']} (s, excluding model time):",
+                  f"  {'stage':<24} {'calls':>6} {'p50':>8} {'p90':>8} {'max':>8}"]
+        for key, agent in level["agents"].items():
+            overhead = agent["overhead_s"]
+            lines.append(f"  {key:<24} {agent['model_calls_per_run']:>6} {overhead['p50']:>8} "
+                         f"{overhead['p90']:>8} {overhead['max']:>8}")
+    cache = report.get("context_cache")
+    if cache:
+        lines += ["", f"Context cache: {len(cache['handles'])} handles, {cache['created']} created, "
+                      f"{cache['hits']} hits, {cache['skipped_below_min_tokens']} below min tokens, "
+                      f"{cache['cached_tokens_sent']} prompt tokens served from cache"]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with a fake model and stub MCP servers.")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per concurrency level (at least the level)")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Fake model latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- jitter on the fake latency")
+    parser.add_argument("--fixtures", default=None, help="Run folder with stepNN_*_output.json fixtures")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured runs before the first level")
+    parser.add_argument("--context-cache", action="store_true",
+                        help="Send model calls through the emulated provider context cache")
+    parser.add_argument("--fused", action="store_true",
+                        help="Use one fused visual-extraction call instead of the five chart-reading agents")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the full report as JSON here")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_suite(
+        concurrency_levels=[int(c) for c in args.concurrency.split(",") if c.strip()],
+        runs=args.runs,
+        latency_s=args.latency_ms / 1000.0,
+        jitter_s=args.jitter_ms / 1000.0,
+        fixture_dir=args.fixtures,
+        warmup=args.warmup,
+        context_cache=args.context_cache,
+        fused=args.fused,
+    ))
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Per-agent chart views cut from the uploaded screenshot.
+
+Every vision agent used to receive the full ~400 KB screenshot even though most
+of them read only a few panes (the momentum agent looks at Kalman / volume delta /
+MOAK, the derivatives agent at liquidations / OI / funding / CVD). This module
+finds the horizontal pane separators, crops the panes each consumer needs,
+downscales them to that consumer's width budget and re-encodes them, so each
+agent is sent a fraction of the original pixels.
+
+Decoding, cropping and encoding are CPU-bound and run in a process pool so they
+never block the event loop. Pane roles cannot be read from pixels, so they are
+assigned by position from PANEL_LAYOUTS, keyed by the number of panes detected
+(override with CHART_PANEL_LAYOUTS='{"4": ["price", ...]}'). When a layout is
+unknown or a view's panes are missing, the caller falls back to the full image.
+"""
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from backend.chart_store import file_url_for
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+CHART_PREPROCESS_WORKERS = int(os.environ.get("CHART_PREPROCESS_WORKERS", "2"))
+
+# Pane roles top to bottom, keyed by pane count. Defaults match the two chart
+# templates used with this project (TradingView momentum layout, Velo derivatives layout).
+PANEL_LAYOUTS: Dict[int, Tuple[str, ...]] = {
+    4: ("price", "kalman", "volume_delta", "moak"),
+    5: ("price", "liquidations", "open_interest", "funding", "cvd"),
+}
+if os.environ.get("CHART_PANEL_LAYOUTS"):
+    PANEL_LAYOUTS = {int(k): tuple(v) for k, v in json.loads(os.environ["CHART_PANEL_LAYOUTS"]).items()}
+
+
+@dataclass(frozen=True)
+class ViewProfile:
+    """Which panes a consumer reads and the widest image it should get."""
+    roles: Tuple[str, ...]
+    max_width: int
+
+
+VIEW_PROFILES: Dict[str, ViewProfile] = {
+    "price": ViewProfile(("price",), 1600),
+    "momentum": ViewProfile(("kalman", "volume_delta", "moak"), 1280),
+    "derivatives": ViewProfile(("liquidations", "open_interest", "funding", "cvd"), 1280),
+}
+
+# --- Separator detection tuning ---
+_COLOUR_TOLERANCE = 4       # grey levels a line pixel may deviate from the line colour
+_MIN_BAND_UNIFORMITY = 0.9  # share of the plot band that must be line-coloured
+_MIN_CONTRAST = 8           # line vs. rows 3px above/below
+_MIN_LINE_SPAN = 0.85       # share of the width a line must cross unbroken
+_AXIS_END_TOLERANCE = 0.01  # separators all end at the price axis edge; gridlines stop short of it
+_MIN_PANEL_FRACTION = 0.02  # slivers thinner than this are merged into the pane above
+
+
+@dataclass
+class ChartViews:
+    """Result of preprocessing one chart: pane boxes and the encoded file per view."""
+    image_id: str
+    source_bytes: int
+    panels: List[Tuple[int, int]] = field(default_factory=list)  # (top, bottom) rows per pane
+    roles: Tuple[str, ...] = ()
+    views: Dict[str, str] = field(default_factory=dict)  # view name -> file path
+    view_bytes: Dict[str, int] = field(default_factory=dict)
+    duration_s: float = 0.0
+
+    def url_for(self, view: Optional[str]) -> Optional[str]:
+        path = self.views.get(view) if view else None
+        return file_url_for(path) if path else None
+
+
+def preprocessing_available() -> bool:
+    """numpy and Pillow are only needed when views are rendered."""
+    return all(importlib.util.find_spec(name) is not None for name in ("numpy", "PIL"))
+
+
+def detect_panels(gray: Any) -> Tuple[List[Tuple[int, int]], Tuple[int, int]]:
+    """
+    Finds the chart panes in a greyscale screenshot (2-D uint8 array).
+    Returns the (top, bottom) row range of each pane, top to bottom, and the
+    (left, right) column range of the plot area including its price axis.
+    """
+    import numpy as np
+
+    img = gray.astype(np.int16)
+    height, width = img.shape
+    band = img[:, int(width * 0.05):int(width * 0.9)]
+    colour = np.median(band, axis=1)
+    uniform = (np.abs(band - colour[:, None]) <= _COLOUR_TOLERANCE).mean(axis=1)
+    above = np.roll(colour, 3)
+    below = np.roll(colour, -3)
+    contrast = np.abs(colour - (above + below) / 2)
+    candidates = np.nonzero((uniform >= _MIN_BAND_UNIFORMITY) & (contrast >= _MIN_CONTRAST))[0]
+
+    # Keep rows whose line colour runs unbroken through the middle across nearly the whole width.
+    lines: List[Dict[str, int]] = []
+    centre = width // 2
+    for y in candidates:
+        if y < 3 or y >= height - 3:
+            continue
+        off = np.abs(img[y] - colour[y]) > _COLOUR_TOLERANCE
+        if off[centre]:
+            continue
+        left_breaks = np.nonzero(off[:centre])[0]
+        right_breaks = np.nonzero(off[centre:])[0]
+        left = int(left_breaks[-1]) + 1 if left_breaks.size else 0
+        right = centre + int(right_breaks[0]) if right_breaks.size else width
+        if right - left < _MIN_LINE_SPAN * width:
+            continue
+        if lines and y - lines[-1]["bottom"] <= 2 and lines[-1]["colour"] == int(colour[y]):
+            lines[-1]["bottom"] = int(y)
+        else:
+            lines.append({"top": int(y), "bottom": int(y), "colour": int(colour[y]), "left": left, "right": right})
+
+    # Lines running into the left edge are toolbar borders above the chart body.
+    body_top = 0
+    for line in lines:
+        if line["left"] <= width * 0.005 and line["top"] < height * 0.25:
+            body_top = line["bottom"] + 1
+    separators = [l for l in lines if l["top"] >= body_top and l["left"] > width * 0.005]
+    if not separators:
+        return [(body_top, height)], (0, width)
+    axis_end = max(l["right"] for l in separators)
+    separators = [l for l in separators if l["right"] >= axis_end - _AXIS_END_TOLERANCE * width]
+
+    # Pane separators share one colour; a differently coloured line in the lower
+    # half is the time axis, and everything below it is axis labels and toolbars.
+    colours = [l["colour"] for l in separators]
+    separator_colour = max(set(colours), key=colours.count)
+    body_bottom = height
+    for line in separators:
+        if line["colour"] != separator_colour and line["top"] > height / 2:
+            body_bottom = line["top"]
+            break
+    separators = [l for l in separators if l["colour"] == separator_colour and l["top"] < body_bottom]
+
+    panels: List[Tuple[int, int]] = []
+    top = body_top
+    for line in separators + [{"top": body_bottom, "bottom": body_bottom - 1}]:
+        bottom = line["top"]
+        if bottom - top < _MIN_PANEL_FRACTION * height:
+            if panels:
+                panels[-1] = (panels[-1][0], bottom)
+        else:
+            panels.append((top, bottom))
+        top = line["bottom"] + 1
+
+    plot_left = min(l["left"] for l in separators) if separators else 0
+    return panels, (plot_left, axis_end)
+
+
+def profile_signature(view: str, profile: ViewProfile, layouts: Optional[Dict[int, Tuple[str, ...]]] = None) -> str:
+    """Changes whenever the pixels sent for this view could change (roles, width, layouts)."""
+    payload = json.dumps([view, profile.roles, profile.max_width, sorted((layouts or PANEL_LAYOUTS).items())])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+# Bump when detect_panels changes, so panel sidecars written by older code are ignored.
+_PANELS_VERSION = 1
+
+
+def _panels_path(output_dir: str, image_id: str) -> str:
+    return os.path.join(output_dir, f"{image_id}_panels.json")
+
+
+def _read_panels(output_dir: str, image_id: str) -> Optional[Tuple[List[Tuple[int, int]], Tuple[int, int]]]:
+    """The detected panes and plot columns recorded for image_id, or None when not recorded yet."""
+    try:
+        with open(_panels_path(output_dir, image_id), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != _PANELS_VERSION:
+        return None
+    return [tuple(p) for p in data["panels"]], tuple(data["plot"])
+
+
+def _write_panels(output_dir: str, image_id: str, panels: List[Tuple[int, int]], plot: Tuple[int, int]) -> None:
+    path = _panels_path(output_dir, image_id)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": _PANELS_VERSION, "panels": panels, "plot": plot}, f)
+    os.replace(tmp_path, path)
+
+
+def _view_boxes(panels: List[Tuple[int, int]], roles: Tuple[str, ...],
+                profiles: Dict[str, ViewProfile]) -> Dict[str, List[Tuple[int, int]]]:
+    """Pane boxes per view, for the views whose panes are all present."""
+    boxes = {}
+    for view, profile in profiles.items():
+        view_boxes = [panels[roles.index(role)] for role in profile.roles if role in roles]
+        if len(view_boxes) == len(profile.roles):
+            boxes[view] = view_boxes
+    return boxes
+
+
+def _view_path(output_dir: str, image_id: str, view: str, profile: ViewProfile,
+               layouts: Dict[int, Tuple[str, ...]]) -> str:
+    return os.path.join(output_dir, f"{image_id}_{view}_{profile_signature(view, profile, layouts)}.png")
+
+
+def cached_views(output_dir: str, image_id: str, layouts: Dict[int, Tuple[str, ...]],
+                 profiles: Dict[str, ViewProfile]) -> Optional[Dict[str, Any]]:
+    """
+    The render_views result rebuilt from the panel sidecar and the view files
+    already on disk, or None when the chart still has to be decoded.
+    """
+    detected = _read_panels(output_dir, image_id)
+    if detected is None:
+        return None
+    panels = detected[0]
+    roles = layouts.get(len(panels), ())
+    result: Dict[str, Any] = {"panels": panels, "roles": roles, "views": {}, "view_bytes": {}}
+    for view in _view_boxes(panels, roles, profiles):
+        path = _view_path(output_dir, image_id, view, profiles[view], layouts)
+        if not os.path.exists(path):
+            return None
+        result["views"][view] = path
+        result["view_bytes"][view] = os.path.getsize(path)
+    return result
+
+
+def render_views(image_path: str, output_dir: str, image_id: str,
+                 layouts: Dict[int, Tuple[str, ...]], profiles: Dict[str, ViewProfile]) -> Dict[str, Any]:
+    """
+    Worker entry point (runs in the process pool): detects panes and writes one
+    PNG per view whose panes are all present. Detected panes are recorded in a
+    JSON sidecar per image and views already on disk are reused, so the
+    screenshot is only decoded when a pane detection or a view is missing.
+    """
+    from PIL import Image
+
+    image = None
+
+    def decoded() -> Any:
+        nonlocal image
+        if image is None:
+            with Image.open(image_path) as source:
+                image = source.convert("RGB")
+        return image
+
+    os.makedirs(output_dir, exist_ok=True)
+    detected = _read_panels(output_dir, image_id)
+    if detected is None:
+        import numpy as np
+
+        detected = detect_panels(np.asarray(decoded().convert("L")))
+        _write_panels(output_dir, image_id, *detected)
+    panels, (plot_left, plot_right) = detected
+    roles = layouts.get(len(panels), ())
+    result: Dict[str, Any] = {"panels": panels, "roles": roles, "views": {}, "view_bytes": {}}
+
+    for view, boxes in _view_boxes(panels, roles, profiles).items():
+        profile = profiles[view]
+        path = _view_path(output_dir, image_id, view, profile, layouts)
+        if not os.path.exists(path):
+            crops = [decoded().crop((plot_left, top, plot_right, bottom)) for top, bottom in boxes]
+            canvas = Image.new("RGB", (plot_right - plot_left, sum(c.height for c in crops)))
+            offset = 0
+            for crop in crops:
+                canvas.paste(crop, (0, offset))
+                offset += crop.height
+            if canvas.width > profile.max_width:
+                scale = profile.max_width / canvas.width
+                canvas = canvas.resize((profile.max_width, max(1, round(canvas.height * scale))), Image.LANCZOS)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            canvas.save(tmp_path, format="PNG", optimize=True)
+            os.replace(tmp_path, path)
+        result["views"][view] = path
+        result["view_bytes"][view] = os.path.getsize(path)
+    return result
+
+
+class ChartPreprocessor:
+    """Renders per-agent chart views in a process pool; results are files under output_dir."""
+
+    def __init__(self, output_dir: str, layouts: Optional[Dict[int, Tuple[str, ...]]] = None,
+                 profiles: Optional[Dict[str, ViewProfile]] = None, max_workers: int = CHART_PREPROCESS_WORKERS):
+        self.output_dir = output_dir
+        self.layouts = dict(layouts or PANEL_LAYOUTS)
+        self.profiles = dict(profiles or VIEW_PROFILES)
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def signature(self, view: str) -> str:
+        profile = self.profiles.get(view)
+        return profile_signature(view, profile, self.layouts) if profile else ""
+
+    def roles_for(self, view: str) -> Sequence[str]:
+        profile = self.profiles.get(view)
+        return profile.roles if profile else ()
+
+    async def prepare(self, image_path: str, image_id: Optional[str] = None) -> ChartViews:
+        """Preprocesses one chart off the event loop. image_id defaults to the file's SHA-256."""
+        started = time.perf_counter()
+        if image_id is None:
+            from backend.chart_store import file_sha256
+            image_id = await asyncio.to_thread(file_sha256, image_path)
+        # A chart seen before is served from its sidecar and view files without touching the pool.
+        rendered = await asyncio.to_thread(cached_views, self.output_dir, image_id, self.layouts, self.profiles)
+        if rendered is None:
+            loop = asyncio.get_running_loop()
+            rendered = await loop.run_in_executor(
+                self._get_pool(), render_views, image_path, self.output_dir, image_id, self.layouts, self.profiles
+            )
+        views = ChartViews(
+            image_id=image_id,
+            source_bytes=os.path.getsize(image_path),
+            panels=[tuple(p) for p in rendered["panels"]],
+            roles=tuple(rendered["roles"]),
+            views=rendered["views"],
+            view_bytes=rendered["view_bytes"],
+            duration_s=time.perf_counter() - started,
+        )
+        if not views.roles:
+            logger.info("Chart preprocessing: no layout for %d detected panes in %s; agents get the full image",
+                        len(views.panels), image_path)
+        return views
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
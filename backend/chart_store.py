@@ -0,0 +1,180 @@
+"""
+Content-addressed store for uploaded chart images.
+
+Uploads are hashed (SHA-256) while they are streamed to a temporary file and are
+then kept once under their digest; uploading the same screenshot again only
+bumps a reference count. The digest doubles as a stable content id, so caches
+further down the pipeline can key on image identity instead of a random filename.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, BinaryIO, Dict, Optional
+from urllib.parse import unquote, urlparse
+
+from pydantic import BaseModel
+
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+INDEX_FILENAME = "index.json"
+_ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
+
+
+class StoredChart(BaseModel):
+    content_id: str  # hex SHA-256 of the image bytes
+    filename: str
+    file_path: str
+    file_url: str
+    content_type: Optional[str] = None
+    size_bytes: int
+    ref_count: int
+    deduplicated: bool = False  # True if these bytes were already stored
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def path_from_file_url(image_url: str) -> Optional[str]:
+    """Local filesystem path for a file:// URL (or a plain path); None for remote URLs."""
+    parsed = urlparse(image_url)
+    if parsed.scheme == "file":
+        path = unquote(parsed.path)
+        # file:///C:/... on Windows yields "/C:/..."
+        if len(path) > 2 and path[0] == "/" and path[2] == ":":
+            path = path[1:]
+        return path
+    if parsed.scheme in ("", None) or len(parsed.scheme) == 1:  # relative path or a Windows drive letter
+        return image_url
+    return None
+
+
+def file_url_for(path: str) -> str:
+    abs_path = os.path.abspath(path).replace(os.sep, "/")
+    return f"file:///{abs_path.lstrip('/')}"
+
+
+class ChartStore:
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._index_path = os.path.join(root_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = self._load_index()
+
+    async def save_upload(self, fileobj: BinaryIO, original_filename: Optional[str] = None,
+                          content_type: Optional[str] = None) -> StoredChart:
+        """Streams fileobj into the store off the event loop and returns its stored entry."""
+        return await asyncio.to_thread(self.save_stream, fileobj, original_filename, content_type)
+
+    def save_stream(self, fileobj: BinaryIO, original_filename: Optional[str] = None,
+                    content_type: Optional[str] = None) -> StoredChart:
+        extension = os.path.splitext(original_filename or "")[1].lower()
+        if extension not in _ALLOWED_EXTENSIONS:
+            extension = ".png"
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, prefix=".upload-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            content_id = digest.hexdigest()
+            with self._lock:
+                entry = self._index.get(content_id)
+                deduplicated = entry is not None and os.path.exists(os.path.join(self.root_dir, entry["filename"]))
+                if deduplicated:
+                    entry["ref_count"] += 1
+                else:
+                    entry = {
+                        "filename": f"{content_id}{extension}",
+                        "content_type": content_type,
+                        "size_bytes": size,
+                        "ref_count": 1,
+                    }
+                    os.replace(tmp_path, os.path.join(self.root_dir, entry["filename"]))
+                    self._index[content_id] = entry
+                self._write_index()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self._to_model(content_id, entry, deduplicated=deduplicated)
+
+    def get(self, content_id: str) -> Optional[StoredChart]:
+        with self._lock:
+            entry = self._index.get(content_id)
+            return self._to_model(content_id, entry) if entry else None
+
+    def release(self, content_id: str) -> Optional[int]:
+        """Drops one reference; the file is deleted when the last one goes. Returns the remaining count."""
+        with self._lock:
+            entry = self._index.get(content_id)
+            if entry is None:
+                return None
+            entry["ref_count"] -= 1
+            remaining = entry["ref_count"]
+            if remaining <= 0:
+                del self._index[content_id]
+                path = os.path.join(self.root_dir, entry["filename"])
+                if os.path.exists(path):
+                    os.remove(path)
+            self._write_index()
+            return max(remaining, 0)
+
+    def content_id_for_url(self, image_url: str) -> Optional[str]:
+        """
+        Image identity for an upload URL: the stored digest when the URL points
+        into the store, otherwise the SHA-256 of the local file (None if unreadable).
+        """
+        path = path_from_file_url(image_url)
+        if not path:
+            return None
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.root_dir) and stem in self._index:
+            return stem
+        try:
+            return file_sha256(path)
+        except OSError:
+            return None
+
+    def _to_model(self, content_id: str, entry: Dict[str, Any], deduplicated: bool = False) -> StoredChart:
+        path = os.path.join(self.root_dir, entry["filename"])
+        return StoredChart(
+            content_id=content_id,
+            filename=entry["filename"],
+            file_path=path,
+            file_url=file_url_for(path),
+            content_type=entry.get("content_type"),
+            size_bytes=entry["size_bytes"],
+            ref_count=entry["ref_count"],
+            deduplicated=deduplicated,
+        )
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("ChartStore: could not read %s (%s); starting with an empty index", self._index_path, e)
+            return {}
+
+    def _write_index(self) -> None:
+        # Caller holds self._lock. Write-then-rename keeps the index intact if we crash mid-write.
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, separators=(",", ":"))
+        os.replace(tmp_path, self._index_path)
@@ -0,0 +1,417 @@
+"""
+Provider-side context caching of each agent's static request prefix.
+
+An agent's system instruction and tool declarations are identical on every
+call, and are usually the bulk of its prompt. The first call registers them
+(plus, with CONTEXT_CACHE_IMAGES=1, the inline chart image parts at the start
+of the conversation) as a Gemini CachedContent; later calls send only the
+per-run contents and reference the cache by name, so the provider skips
+re-processing the prefix and bills it at the cached-token rate.
+
+Handles are keyed by a hash of model + prefix, created once per key even
+under concurrent misses, and kept for CONTEXT_CACHE_TTL_S. A handle still in
+use within CONTEXT_CACHE_REFRESH_MARGIN_S of its expiry has its TTL extended
+(or is re-created if that fails). If the provider rejects a handle anyway
+(expired or deleted server-side), the handle is dropped and the call is
+retried once with the full, uncached request. Prefixes below
+CONTEXT_CACHE_MIN_TOKENS are never cached (the provider has a minimum), and a
+prefix whose cache cannot be created is retried after CONTEXT_CACHE_RETRY_S,
+with the calls in between sent uncached.
+
+LocalContextCacheBackend emulates the cache API in-process (create / extend /
+delete, expiry, "not found" errors) for the offline benchmark's FakeLlm.
+CONTEXT_CACHE=0 disables caching.
+"""
+import hashlib
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+from backend.structured_logging import get_logger
+from backend.token_budget import CHARS_PER_TOKEN, IMAGE_TOKENS
+from backend.tools.ttl_cache import SingleFlight
+
+logger = get_logger(__name__)
+
+CONTEXT_CACHE_ENABLED = os.environ.get("CONTEXT_CACHE", "1") == "1"
+CONTEXT_CACHE_TTL_S = int(os.environ.get("CONTEXT_CACHE_TTL_S", "3600"))
+CONTEXT_CACHE_REFRESH_MARGIN_S = float(os.environ.get("CONTEXT_CACHE_REFRESH_MARGIN_S", "120"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+CONTEXT_CACHE_IMAGES = os.environ.get("CONTEXT_CACHE_IMAGES", "0") == "1"
+CONTEXT_CACHE_RETRY_S = float(os.environ.get("CONTEXT_CACHE_RETRY_S", "300"))
+
+
+@dataclass
+class CachePrefix:
+    """The static part of a request that goes into a cache."""
+
+    key: str
+    system_instruction: Any = None
+    tools: Optional[List[Any]] = None
+    tool_config: Any = None
+    contents: List[types.Content] = field(default_factory=list)
+    tokens: int = 0
+
+
+@dataclass
+class CacheHandle:
+    name: str
+    key: str
+    model: str
+    tokens: int
+    expires_at: float  # wall clock (time.time()), as reported by the provider
+    uses: int = 0
+
+    def usable(self, margin_s: float = 0.0) -> bool:
+        return self.expires_at - margin_s > time.time()
+
+
+class CachedContentNotFound(Exception):
+    """Raised by the local backend for an unknown or expired handle, like the provider's 404."""
+
+    code = 404
+
+
+def is_cache_unavailable(error: Exception) -> bool:
+    """True for the provider errors that mean the referenced cache no longer exists."""
+    if isinstance(error, CachedContentNotFound):
+        return True
+    message = str(error).lower()
+    return getattr(error, "code", None) in (400, 403, 404) and ("cachedcontent" in message or "cached content" in message)
+
+
+# --- Splitting requests ---
+
+def _digest(value: Any) -> str:
+    if isinstance(value, types.Content):
+        parts = []
+        for part in value.parts or []:
+            if part.inline_data is not None and part.inline_data.data:
+                parts.append(f"{part.inline_data.mime_type}:{hashlib.sha256(part.inline_data.data).hexdigest()}")
+            else:
+                parts.append(part.model_dump_json(exclude_none=True))
+        return f"{value.role}:{'|'.join(parts)}"
+    if hasattr(value, "model_dump_json"):
+        return value.model_dump_json(exclude_none=True)
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _instruction_chars(system_instruction: Any) -> int:
+    if isinstance(system_instruction, str):
+        return len(system_instruction)
+    if isinstance(system_instruction, types.Content):
+        return sum(len(part.text or "") for part in system_instruction.parts or [])
+    return len(str(system_instruction or ""))
+
+
+def split_request(model: str, llm_request: LlmRequest,
+                  include_images: bool = CONTEXT_CACHE_IMAGES) -> Optional[Tuple[CachePrefix, List[types.Content]]]:
+    """
+    Splits a request into its cacheable prefix and the contents still to be
+    sent, or None when there is nothing static to cache. Image parts are only
+    taken from the first content, and only when it is the user's.
+    """
+    config = llm_request.config
+    if config is None or config.cached_content or not (config.system_instruction or config.tools):
+        return None
+    contents = list(llm_request.contents or [])
+    cached_contents: List[types.Content] = []
+    images = 0
+    if include_images and contents and contents[0].role == "user":
+        first = contents[0]
+        image_parts = [p for p in first.parts or [] if p.inline_data is not None]
+        if image_parts:
+            images = len(image_parts)
+            cached_contents = [types.Content(role="user", parts=image_parts)]
+            rest = [p for p in first.parts or [] if p.inline_data is None]
+            contents = ([types.Content(role=first.role, parts=rest)] if rest else []) + contents[1:]
+
+    tool_chars = sum(len(_digest(tool)) for tool in config.tools or [])
+    tokens = (_instruction_chars(config.system_instruction) + tool_chars) // CHARS_PER_TOKEN + images * IMAGE_TOKENS
+    fingerprint = json.dumps([
+        model,
+        _digest(config.system_instruction),
+        [_digest(tool) for tool in config.tools or []],
+        _digest(config.tool_config),
+        [_digest(content) for content in cached_contents],
+    ])
+    prefix = CachePrefix(
+        key=hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32],
+        system_instruction=config.system_instruction,
+        tools=list(config.tools) if config.tools else None,
+        tool_config=config.tool_config,
+        contents=cached_contents,
+        tokens=tokens,
+    )
+    return prefix, contents
+
+
+def with_cached_content(llm_request: LlmRequest, cache_name: str, contents: List[types.Content]) -> LlmRequest:
+    """
+    A shallow copy of the request that references the cache instead of
+    re-sending its prefix (the provider rejects system_instruction, tools or
+    tool_config alongside cached_content).
+    """
+    config = llm_request.config.model_copy(update={
+        "system_instruction": None, "tools": None, "tool_config": None, "cached_content": cache_name,
+    })
+    return llm_request.model_copy(update={"config": config, "contents": contents})
+
+
+# --- Backends ---
+
+class GeminiContextCacheBackend:
+    """CachedContent create / extend / delete through a google-genai client."""
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    async def create(self, model: str, prefix: CachePrefix, ttl_s: int) -> Tuple[str, float]:
+        cached = await self._client.aio.caches.create(model=model, config=types.CreateCachedContentConfig(
+            display_name=f"crypto-ta-{prefix.key[:12]}",
+            system_instruction=prefix.system_instruction,
+            tools=prefix.tools,
+            tool_config=prefix.tool_config,
+            contents=prefix.contents or None,
+            ttl=f"{ttl_s}s",
+        ))
+        return cached.name, _expires_at(cached, ttl_s)
+
+    async def extend(self, name: str, ttl_s: int) -> float:
+        cached = await self._client.aio.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{ttl_s}s"))
+        return _expires_at(cached, ttl_s)
+
+    async def delete(self, name: str) -> None:
+        await self._client.aio.caches.delete(name=name)
+
+
+def _expires_at(cached: Any, ttl_s: int) -> float:
+    expire_time = getattr(cached, "expire_time", None)
+    return expire_time.timestamp() if expire_time is not None else time.time() + ttl_s
+
+
+class LocalContextCacheBackend:
+    """
+    In-process emulation of the cache API: entries expire after their TTL and
+    unknown or expired names raise CachedContentNotFound. expand() rebuilds the
+    full request from a cached one, the way the provider does before inference.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[CachePrefix, float]] = {}
+        self._ids = itertools.count(1)
+        self.created = 0
+
+    async def create(self, model: str, prefix: CachePrefix, ttl_s: int) -> Tuple[str, float]:
+        name = f"cachedContents/local-{next(self._ids)}"
+        expires_at = time.time() + ttl_s
+        self._entries[name] = (prefix, expires_at)
+        self.created += 1
+        return name, expires_at
+
+    async def extend(self, name: str, ttl_s: int) -> float:
+        prefix, _ = self._lookup(name)
+        expires_at = time.time() + ttl_s
+        self._entries[name] = (prefix, expires_at)
+        return expires_at
+
+    async def delete(self, name: str) -> None:
+        self._entries.pop(name, None)
+
+    def expire(self, name: Optional[str] = None) -> None:
+        """Expires one entry (or all of them) immediately, as if its TTL had run out."""
+        for entry_name in [name] if name else list(self._entries):
+            if entry_name in self._entries:
+                self._entries[entry_name] = (self._entries[entry_name][0], 0.0)
+
+    def expand(self, llm_request: LlmRequest) -> Tuple[LlmRequest, int]:
+        """The request with its cached prefix restored, and the number of tokens served from the cache."""
+        name = llm_request.config.cached_content if llm_request.config else None
+        if not name:
+            return llm_request, 0
+        prefix, _ = self._lookup(name)
+        config = llm_request.config.model_copy(update={
+            "system_instruction": prefix.system_instruction, "tools": prefix.tools,
+            "tool_config": prefix.tool_config, "cached_content": None,
+        })
+        contents = prefix.contents + list(llm_request.contents or [])
+        return llm_request.model_copy(update={"config": config, "contents": contents}), prefix.tokens
+
+    def _lookup(self, name: str) -> Tuple[CachePrefix, float]:
+        entry = self._entries.get(name)
+        if entry is None or entry[1] <= time.time():
+            self._entries.pop(name, None)
+            raise CachedContentNotFound(f"CachedContent not found (or expired): {name}")
+        return entry
+
+
+# --- Manager ---
+
+GenerateFn = Callable[[LlmRequest], AsyncGenerator[LlmResponse, None]]
+
+
+class ContextCacheManager:
+    """Maps request prefixes to live cache handles for one backend."""
+
+    def __init__(self, backend: Any = None, ttl_s: int = CONTEXT_CACHE_TTL_S,
+                 refresh_margin_s: float = CONTEXT_CACHE_REFRESH_MARGIN_S,
+                 min_tokens: int = CONTEXT_CACHE_MIN_TOKENS, include_images: bool = CONTEXT_CACHE_IMAGES,
+                 retry_s: float = CONTEXT_CACHE_RETRY_S):
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self.refresh_margin_s = min(refresh_margin_s, ttl_s / 2)
+        self.min_tokens = min_tokens
+        self.include_images = include_images
+        self.retry_s = retry_s
+        self._handles: Dict[str, CacheHandle] = {}
+        self._flights = SingleFlight()
+        self._unavailable_until: Dict[str, float] = {}
+        # --- Metrics ---
+        self.hits = 0
+        self.created = 0
+        self.extended = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.create_failures = 0
+        self.fallbacks = 0
+        self.cached_tokens = 0
+
+    async def prepare(self, model: str, llm_request: LlmRequest) -> Tuple[LlmRequest, Optional[CacheHandle]]:
+        """The request to send (referencing a cache when one applies) and the handle it uses."""
+        if self.backend is None:
+            return llm_request, None
+        split = split_request(model, llm_request, self.include_images)
+        if split is None:
+            return llm_request, None
+        prefix, contents = split
+        if prefix.tokens < self.min_tokens:
+            self.skipped += 1
+            return llm_request, None
+        handle = await self._handle_for(model, prefix)
+        if handle is None:
+            return llm_request, None
+        handle.uses += 1
+        return with_cached_content(llm_request, handle.name, contents), handle
+
+    async def generate(self, model: str, llm_request: LlmRequest,
+                       generate: GenerateFn) -> AsyncGenerator[LlmResponse, None]:
+        """
+        Runs generate() on the cached form of the request; when the provider no
+        longer knows the cache, drops the handle and re-sends the full request.
+        """
+        request, handle = await self.prepare(model, llm_request)
+        if handle is None:
+            async for response in generate(llm_request):
+                yield response
+            return
+        yielded = False
+        try:
+            async for response in generate(request):
+                yielded = True
+                yield response
+            self.cached_tokens += handle.tokens
+            return
+        except Exception as e:
+            if yielded or not is_cache_unavailable(e):
+                raise
+            self.invalidate(handle)
+            self.fallbacks += 1
+            logger.warning("Context cache %s is gone (%s); re-sending the full request", handle.name, e)
+        async for response in generate(llm_request):
+            yield response
+
+    def invalidate(self, handle: CacheHandle) -> None:
+        if self._handles.get(handle.key) is handle:
+            del self._handles[handle.key]
+
+    async def _handle_for(self, model: str, prefix: CachePrefix) -> Optional[CacheHandle]:
+        handle = self._handles.get(prefix.key)
+        if handle is not None and handle.usable(self.refresh_margin_s):
+            self.hits += 1
+            return handle
+        if self._unavailable_until.get(prefix.key, 0.0) > time.time():
+            return None
+        if self._flights.in_flight(prefix.key):
+            self.coalesced += 1
+        # One create / extend per prefix; a cancelled caller does not cancel it for the others.
+        try:
+            return await self._flights.do(prefix.key, partial(self._renew, model, prefix, handle))
+        except Exception as e:
+            # Caching is an optimisation: an unexpected failure sends the request uncached instead.
+            self._unavailable_until[prefix.key] = time.time() + self.retry_s
+            logger.warning("Preparing a context cache for %s failed (%s); sending uncached for %.0fs",
+                           model, e, self.retry_s)
+            return None
+
+    async def _renew(self, model: str, prefix: CachePrefix, stale: Optional[CacheHandle]) -> Optional[CacheHandle]:
+        # Extending a cache that is still alive avoids re-uploading and re-processing its prefix.
+        if stale is not None and stale.usable():
+            try:
+                stale.expires_at = await self.backend.extend(stale.name, self.ttl_s)
+                self.extended += 1
+                return stale
+            except Exception as e:
+                logger.info("Extending context cache %s failed (%s); creating a new one", stale.name, e)
+        self._handles.pop(prefix.key, None)
+        try:
+            name, expires_at = await self.backend.create(model, prefix, self.ttl_s)
+        except Exception as e:
+            self.create_failures += 1
+            self._unavailable_until[prefix.key] = time.time() + self.retry_s
+            logger.warning("Creating a context cache for %s failed (%s); sending uncached for %.0fs",
+                           model, e, self.retry_s)
+            return None
+        self.created += 1
+        self._unavailable_until.pop(prefix.key, None)
+        handle = self._handles[prefix.key] = CacheHandle(name=name, key=prefix.key, model=model,
+                                                         tokens=prefix.tokens, expires_at=expires_at)
+        return handle
+
+    async def close(self) -> None:
+        """Deletes this process's caches so they stop accruing storage until their TTL."""
+        handles, self._handles = list(self._handles.values()), {}
+        for handle in handles:
+            try:
+                await self.backend.delete(handle.name)
+            except Exception as e:
+                logger.info("Deleting context cache %s failed: %s", handle.name, e)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "enabled": self.backend is not None,
+            "handles": [
+                {"name": h.name, "model": h.model, "tokens": h.tokens, "uses": h.uses,
+                 "expires_in_s": round(h.expires_at - now, 1)}
+                for h in self._handles.values()
+            ],
+            "hits": self.hits,
+            "created": self.created,
+            "extended": self.extended,
+            "coalesced": self.coalesced,
+            "skipped_below_min_tokens": self.skipped,
+            "create_failures": self.create_failures,
+            "expired_fallbacks": self.fallbacks,
+            "cached_tokens_sent": self.cached_tokens,
+        }
+
+
+# Process-wide manager for the Gemini clients; its backend is bound on first use.
+context_cache = ContextCacheManager()
+
+
+def gemini_context_cache(client: Any) -> Optional[ContextCacheManager]:
+    """The shared manager, bound to the first client that asks for it, or None when disabled."""
+    if not CONTEXT_CACHE_ENABLED:
+        return None
+    if context_cache.backend is None:
+        context_cache.backend = GeminiContextCacheBackend(client)
+    return context_cache
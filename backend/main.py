@@ -1,22 +1,43 @@
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, Request
+from fastapi import FastAPI, UploadFile, File, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles # For serving uploaded images if needed
 import uvicorn
 import os
-import shutil
 import uuid
 import json
 import asyncio # For asyncio.sleep
-import datetime # For timestamp in logger
+import datetime # For timestamps in streamed events
+import logging
+import time
 
 load_dotenv()  # Load environment variables from .env file
 
 # ADK Imports (needed for the Action handler)
 from backend.agents import orchestrator_agent
+from backend.agents.pipeline import DEFAULT_STAGES, FUSED_VISUAL_STAGES, PipelineExecutor
+from backend.agents.pipeline_gates import DEFAULT_GATES
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from backend.adk_message_types import create_simple_text_content
+from backend.adk_message_types import create_content, load_image_part
+from backend.chart_store import ChartStore, path_from_file_url
+from backend.chart_preprocessing import ChartPreprocessor, preprocessing_available
+from backend.rag import get_knowledge_index
+from backend.analysis_cache import AnalysisCache
+from backend.ag_ui_streaming import adk_event_to_ag_ui, stream_pipeline_events, to_sse
+from backend.batch_analysis import BatchRequest, new_report, run_batch
+from backend.model_governor import governor_stats
+from backend.context_cache import context_cache
+from backend.session_store import BoundedSessionService
+from backend.run_artifacts import RUN_ARTIFACTS_ENABLED, RunArtifactWriter
+from backend.signal_index import SignalIndex
+from backend.ag_ui_event_types import ErrorEventData, RunLifecycleData
+from sse_starlette.sse import EventSourceResponse
+from backend.structured_logging import configure_logging, get_logger, log_event, should_sample, shutdown_logging
+from backend.metrics import PROMETHEUS_CONTENT_TYPE, registry as metrics_registry
+from backend.tracing import configure_tracing, shutdown_tracing
+from backend.token_budget import token_profiler
+from backend.tools.mcp_pool import shutdown_mcp_pools
+from backend.tools.mcp_wrappers import market_data_cache
 
 # CopilotKit Imports
 from copilotkit import CopilotKitRemoteEndpoint, Action
@@ -30,13 +51,53 @@ UPLOAD_DIR = os.path.join(PROJECT_ROOT, "workspaces", UPLOAD_DIR_NAME)
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+chart_store = ChartStore(UPLOAD_DIR)
 # --- End Configuration for Image Uploads ---
 
 
+configure_logging()
+logger = get_logger(__name__)
+# Run / agent / tool / LLM spans: OTLP/JSON lines in TRACE_FILE, latency histograms at /metrics
+configure_tracing(os.environ.get("TRACE_FILE", os.path.join(PROJECT_ROOT, "workspaces", "traces", "spans.otlp.jsonl")))
+
 # Initialize ADK Runner and Session Service globally
-session_service = InMemorySessionService()
+# (idle TTL + LRU under count/byte ceilings; set SESSION_STORE_PATH to also persist sessions to SQLite)
+session_service = BoundedSessionService()
 adk_runner = Runner(agent=orchestrator_agent.root_agent, session_service=session_service, app_name="crypto_ta_backend")
 
+# "dag" runs the stage graph directly (independent agents concurrently);
+# "orchestrator" keeps the original LlmAgent-driven sequential AgentTool chain.
+PIPELINE_MODE = os.environ.get("CRYPTO_TA_PIPELINE_MODE", "dag").lower()
+# One multimodal call for the five chart-reading agents instead of one call each (per-agent is more accurate)
+FUSED_VISUAL_EXTRACTION = os.environ.get("FUSED_VISUAL_EXTRACTION", "0") == "1"
+# Early-exit gates: skip the synthesis stages for an invalid price or a structure with no BOS / CHoCH
+PIPELINE_GATES = os.environ.get("PIPELINE_GATES", "1") == "1"
+# Memoized chart-reading agent outputs, keyed by image digest + prompt/model fingerprint
+analysis_cache = AnalysisCache(
+    os.environ.get("ANALYSIS_CACHE_PATH", os.path.join(PROJECT_ROOT, "workspaces", "analysis_cache.sqlite3"))
+)
+# Per-agent cropped chart panes (rendered in a process pool); agents get the full image when disabled
+chart_preprocessor = None
+if os.environ.get("CHART_PREPROCESSING", "1") == "1":
+    if preprocessing_available():
+        chart_preprocessor = ChartPreprocessor(os.path.join(PROJECT_ROOT, "workspaces", "chart_views"))
+    else:
+        logger.warning("Chart preprocessing disabled: numpy/Pillow not installed")
+# Per-step outputs, FinalReport.json and a manifest under workspaces/<SYMBOL>_Analysis_<ts>/, written off the event loop
+# Queryable index of every FinalReport.json under workspaces/ (fed by the artifact writer as runs finish)
+signal_index = SignalIndex(
+    os.environ.get("SIGNAL_INDEX_PATH", os.path.join(PROJECT_ROOT, "workspaces", "signal_index.sqlite3")),
+    os.path.join(PROJECT_ROOT, "workspaces"),
+)
+artifact_writer = RunArtifactWriter(
+    os.path.join(PROJECT_ROOT, "workspaces"), on_final_report=signal_index.ingest_report
+) if RUN_ARTIFACTS_ENABLED else None
+pipeline_executor = PipelineExecutor(
+    stages=FUSED_VISUAL_STAGES if FUSED_VISUAL_EXTRACTION else DEFAULT_STAGES,
+    session_service=session_service, analysis_cache=analysis_cache, chart_preprocessor=chart_preprocessor,
+    artifact_writer=artifact_writer, gates=DEFAULT_GATES if PIPELINE_GATES else (),
+)
+
 
 app = FastAPI(
     title="CopilotKit FastAPI Backend for Crypto TA",
@@ -44,28 +105,57 @@ app = FastAPI(
     version="0.2.5", # Version bump for image upload feature
 )
 
+@app.on_event("startup")
+async def load_knowledge_index():
+    # Build/open the shared retrieval index once, before the first agent searches it.
+    await asyncio.to_thread(get_knowledge_index)
+
+@app.on_event("startup")
+async def scan_signal_index():
+    # Picks up reports written while the server was down (only new or changed files are parsed).
+    await asyncio.to_thread(signal_index.scan)
+
+@app.on_event("shutdown")
+async def delete_context_caches():
+    # Provider-side caches bill storage until their TTL; drop the ones this process created.
+    await context_cache.close()
+
+@app.on_event("shutdown")
+async def close_mcp_pools():
+    # Persistent MCP server processes outlive individual requests; stop them with the app.
+    await shutdown_mcp_pools()
+    if chart_preprocessor is not None:
+        chart_preprocessor.shutdown()
+    session_service.close()
+    if artifact_writer is not None:
+        artifact_writer.shutdown()
+    signal_index.close()
+    shutdown_tracing()
+    shutdown_logging()
+
 # Mount static files directory to serve uploaded images (optional, if file:/// URLs don't work for ADK/Gemini)
 # app.mount(f"/static/{UPLOAD_DIR_NAME}", StaticFiles(directory=UPLOAD_DIR), name="uploaded_charts")
 
 
-# Middleware to log incoming request body for /copilotkit paths
+# Middleware to log request metadata for /copilotkit paths.
+# The body is never buffered or parsed here; the handler logs what it needs.
 @app.middleware("http")
 async def action_logger_middleware(request: Request, call_next):
-    request_to_pass_on = request
-    if request.method == "POST" and request.url.path.startswith("/copilotkit"):
-        print(f"🔥 RAW body logging for {request.method} {request.url.path} @ {datetime.datetime.now()}")
-        raw_body_bytes = await request.body()
-        try:
-            decoded_body = raw_body_bytes.decode()
-            print(f"   Raw body content (first 500 chars): {decoded_body[:500]}{'...' if len(decoded_body) > 500 else ''}")
-            parsed_json = json.loads(decoded_body)
-            print(f"   Parsed JSON body: {json.dumps(parsed_json, indent=2)}")
-        except Exception as e:
-            print(f"   Raw body content (could not parse as JSON or other error): {raw_body_bytes.decode()[:500]}... Error: {e}")
-        async def new_receive():
-            return {"type": "http.request", "body": raw_body_bytes, "more_body": False}
-        request_to_pass_on = Request(scope=request.scope, receive=new_receive)
-    response = await call_next(request_to_pass_on)
+    if not (request.method == "POST" and request.url.path.startswith("/copilotkit")):
+        return await call_next(request)
+    started = time.perf_counter()
+    response = await call_next(request)
+    if response.status_code >= 500 or should_sample():
+        log_event(
+            logger, logging.INFO, "copilotkit request",
+            method=request.method,
+            path=request.url.path,
+            status=response.status_code,
+            content_length=request.headers.get("content-length"),
+            content_type=request.headers.get("content-type"),
+            client=request.client.host if request.client else None,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
     return response
 
 # 1. Configure CORS Middleware
@@ -86,50 +176,51 @@ app.add_middleware(
 @app.post("/upload-chart-image/")
 async def upload_chart_image(file: UploadFile = File(...)):
     try:
-        # Ensure UPLOAD_DIR exists (double check, though done at startup)
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-        # Sanitize filename and create a unique name
-        original_filename = file.filename if file.filename else "unknown_image"
-        safe_filename = "".join(c if c.isalnum() or c in ['.', '_'] else '_' for c in original_filename)
-        unique_filename = f"{uuid.uuid4().hex[:8]}_{safe_filename}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # Generate file URL (file:// scheme for local access by ADK/Gemini if supported)
-        # Convert to absolute path and ensure correct slashes for file URI
-        abs_file_path = os.path.abspath(file_path)
-        file_url = f"file:///{abs_file_path.replace(os.sep, '/')}"
-        
-        # Alternative: HTTP URL if StaticFiles is mounted and preferred
-        # http_file_url = f"{request.base_url}static/{UPLOAD_DIR_NAME}/{unique_filename}"
-
+        # Uploads are stored once per SHA-256 digest; re-uploading the same chart only adds a reference.
+        stored = await chart_store.save_upload(file.file, file.filename, file.content_type)
         return {
-            "filename": unique_filename,
-            "content_type": file.content_type,
-            "file_path": file_path, # Absolute local path
-            "file_url": file_url    # file:/// URL
-            # "http_file_url": http_file_url # If serving statically
+            "content_id": stored.content_id, # Stable image identity (hex SHA-256)
+            "filename": stored.filename,
+            "content_type": stored.content_type,
+            "file_path": stored.file_path, # Absolute local path
+            "file_url": stored.file_url,   # file:/// URL
+            "size_bytes": stored.size_bytes,
+            "deduplicated": stored.deduplicated,
         }
     except Exception as e:
-        print(f"Error during image upload: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Image upload failed")
         return {"status": "error", "message": f"Image upload failed: {str(e)}"}
+
+@app.delete("/upload-chart-image/{content_id}")
+async def release_chart_image(content_id: str):
+    # Rewrites the index file (and may delete the chart), so it runs off the event loop like save_upload.
+    remaining = await asyncio.to_thread(chart_store.release, content_id)
+    if remaining is None:
+        return {"status": "error", "message": f"Unknown content id: {content_id}"}
+    return {"status": "success", "content_id": content_id, "ref_count": remaining}
 # --- End Image Upload Endpoint ---
 
 
+async def chart_image_parts(image_url: str | None) -> list:
+    """The uploaded chart as an inline image part (read once per request), or [] for remote / missing files."""
+    image_path = path_from_file_url(image_url) if image_url else None
+    if not image_path or not os.path.isfile(image_path):
+        return []
+    try:
+        return [(await asyncio.to_thread(load_image_part, image_path)).to_genai()]
+    except (OSError, ValueError) as e:
+        logger.warning("Chart image %s not attached inline: %s", image_url, e)
+        return []
+
 # 2. Define CopilotKit Action Handler for ADK OrchestratorAgent
 async def adk_orchestrator_action_handler(**kwargs) -> dict:
-    print(f"✅ HANDLER adk_orchestrator_action_handler reached with kwargs: {kwargs}")
+    log_event(logger, logging.INFO, "action handler reached", kwargs=kwargs)
     
     user_query = kwargs.get('query', None)
     image_url = kwargs.get('image_url', None) # New parameter
     
     if user_query is None:
-        print("Warning: 'query' key not found in kwargs.")
+        logger.warning("'query' key not found in kwargs")
         return {"status": "error", "message": "No query parameter provided in arguments"}
     
     # Construct the input for the ADK agent, including image_url if present
@@ -139,12 +230,29 @@ async def adk_orchestrator_action_handler(**kwargs) -> dict:
     else:
         full_query_to_adk = user_query
     
-    print(f"Processing full query for ADK: '{full_query_to_adk}'")
+    log_event(logger, logging.DEBUG, "processing query", full_query=full_query_to_adk)
+
+    if PIPELINE_MODE != "orchestrator":
+        try:
+            image_id = await asyncio.to_thread(chart_store.content_id_for_url, image_url) if image_url else None
+            pipeline_run = await pipeline_executor.run(user_query, image_url, image_id=image_id)
+            result = pipeline_run.to_dict()
+            log_event(logger, logging.INFO, "pipeline finished", run_id=pipeline_run.run_id,
+                      errors=pipeline_run.errors(), timings=pipeline_run.timings())
+            return {
+                "status": "success" if not pipeline_run.errors() else "partial",
+                "message": "Crypto TA analysis completed",
+                "original_query": user_query,
+                "image_url_provided": image_url,
+                "full_query_to_adk": full_query_to_adk,
+                **result,
+            }
+        except Exception as e:
+            logger.exception("Pipeline executor failed")
+            return {"status": "error", "message": f"Handler error: {str(e)}"}
 
     try:
-        print("Attempting to run ADK Orchestrator Agent...")
-        content = create_simple_text_content(full_query_to_adk, role="user")
-        print(f"ADK Runner: Invoking run_async with content: {content}")
+        content = create_content(full_query_to_adk, await chart_image_parts(image_url), role="user")
 
         adk_results = []
         session_id = f"crypto_session_{uuid.uuid4().hex[:8]}"
@@ -153,9 +261,6 @@ async def adk_orchestrator_action_handler(**kwargs) -> dict:
         # The Runner is initialized with app_name="crypto_ta_backend"
         app_name   = adk_runner.app_name  # This should be "crypto_ta_backend"
 
-        print(f"--- Pre-creating session for ADK Runner (using await, simplified) ---")
-        print(f"Attempting to create session with: app_name='{app_name}', user_id='{user_id}', session_id='{session_id}'")
-        
         # ✅  async call *must* be awaited
         # We assume session_id from uuid.uuid4() is unique for each new request,
         # so "Session already exists" ValueError is highly unlikely and can be omitted for brevity here.
@@ -165,11 +270,9 @@ async def adk_orchestrator_action_handler(**kwargs) -> dict:
             user_id=user_id,
             session_id=session_id,
         )
-        print(f"Successfully pre-created session {session_id}.")
-            
-        print(f"ADK Runner: Invoking run_async with session_id='{session_id}', user_id='{user_id}'.")
+        log_event(logger, logging.DEBUG, "running orchestrator", session_id=session_id, app_name=app_name)
         async for adk_event in adk_runner.run_async(new_message=content, user_id=user_id, session_id=session_id):
-            print(f"ADK Event: {adk_event}")
+            log_event(logger, logging.DEBUG, "ADK event", session_id=session_id, event=adk_event)
             if hasattr(adk_event, '__dict__'):
                 event_dict = {}
                 for key, value in adk_event.__dict__.items():
@@ -192,13 +295,12 @@ async def adk_orchestrator_action_handler(**kwargs) -> dict:
             "analysis_summary": "Multi-agent crypto analysis executed with all 12 specialized agents"
         }
         
-        print(f"✅ HANDLER finished. Final result: {json.dumps(final_result, indent=2)}")
+        # Serialized and truncated on the logging thread, not here
+        log_event(logger, logging.INFO, "action handler finished", session_id=session_id, result=final_result)
         return final_result
         
     except Exception as e:
-        print(f"!!! ERROR IN ACTION HANDLER adk_orchestrator_action_handler !!!: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Action handler adk_orchestrator_action_handler failed")
         return {"status": "error", "message": f"Handler error: {str(e)}"}
 
 # 3. Define the CopilotKit Action
@@ -239,10 +341,132 @@ add_fastapi_endpoint(
 async def read_root():
     return {"message": "Crypto TA FastAPI Backend with CopilotKit is running!"}
 
+# Streaming endpoint: AG-UI events over SSE, one TOOL_CALL_START/END pair per stage as it happens
+@app.post("/stream/analysis")
+async def stream_analysis(request: Request):
+    body = await request.json()
+    user_query = body.get("query")
+    image_url = body.get("image_url")
+    if not user_query:
+        return {"status": "error", "message": "No query parameter provided in arguments"}
+
+    async def event_source():
+        if PIPELINE_MODE != "orchestrator":
+            image_id = await asyncio.to_thread(chart_store.content_id_for_url, image_url) if image_url else None
+            async for event in stream_pipeline_events(pipeline_executor, user_query, image_url, image_id=image_id):
+                yield to_sse(event)
+            return
+        async for event in stream_orchestrator_events(user_query, image_url):
+            yield to_sse(event)
+
+    return EventSourceResponse(event_source())
+
+# Batch endpoint: many (image, query) items through the pipeline under a concurrency limit.
+# Streams batch_started, one item_finished per item in completion order, then batch_finished
+# with throughput / latency figures; with "stream": false returns everything as one JSON body.
+@app.post("/batch/analysis")
+async def batch_analysis(request: Request):
+    try:
+        batch = BatchRequest.model_validate(await request.json())
+    except ValueError as e:
+        return {"status": "error", "message": f"Invalid batch request: {e}"}
+    report = new_report(len(batch.items), batch.concurrency)
+
+    if not batch.stream:
+        results = [r async for r in run_batch(pipeline_executor, batch.items,
+                                               image_id_for=chart_store.content_id_for_url, report=report)]
+        results.sort(key=lambda r: r.index)
+        return {"status": "success", "summary": report.summary(), "results": [r.to_dict() for r in results]}
+
+    async def event_source():
+        yield {"event": "batch_started", "data": json.dumps(
+            {"batch_id": report.batch_id, "total_items": report.total_items, "concurrency": report.concurrency})}
+        async for result in run_batch(pipeline_executor, batch.items,
+                                      image_id_for=chart_store.content_id_for_url, report=report):
+            yield {"event": "item_finished", "data": json.dumps(result.to_dict(), default=str)}
+        summary = report.summary()
+        log_event(logger, logging.INFO, "batch finished", **summary)
+        yield {"event": "batch_finished", "data": json.dumps(summary)}
+
+    return EventSourceResponse(event_source())
+
+# --- Historical signal queries ---
+@app.get("/signals")
+async def list_signals(symbol: str | None = None, timeframe: str | None = None, direction: str | None = None,
+                       confidence: str | None = None, min_win_probability: int | None = None,
+                       max_win_probability: int | None = None, since: str | None = None, until: str | None = None,
+                       limit: int = 50, offset: int = 0, order: str = "desc"):
+    try:
+        return await signal_index.aquery(
+            symbol=symbol, timeframe=timeframe, direction=direction, confidence=confidence,
+            min_win_probability=min_win_probability, max_win_probability=max_win_probability,
+            since=since, until=until, limit=limit, offset=offset, newest_first=order.lower() != "asc",
+        )
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/signals/{signal_id}")
+async def get_signal(signal_id: str):
+    signal = await signal_index.aget(signal_id)
+    if signal is None:
+        return {"status": "error", "message": f"Unknown signal id: {signal_id}"}
+    return signal
+# --- End historical signal queries ---
+
+async def stream_orchestrator_events(user_query: str, image_url: str | None):
+    """Legacy orchestrator mode: translate each ADK event to AG-UI events as the runner yields it."""
+    run_id = f"crypto_session_{uuid.uuid4().hex[:8]}"
+    timestamp = lambda: datetime.datetime.now(datetime.timezone.utc).isoformat()
+    full_query = f"Chart Image URL: {image_url}. User Query: {user_query}" if image_url else user_query
+    yield RunLifecycleData(type="RUN_STARTED", runId=run_id, context={"query": user_query, "image_url": image_url}, timestamp=timestamp())
+    try:
+        await session_service.create_session(app_name=adk_runner.app_name, user_id="crypto_user", session_id=run_id)
+        async for adk_event in adk_runner.run_async(
+            new_message=create_content(full_query, await chart_image_parts(image_url), role="user"),
+            user_id="crypto_user", session_id=run_id
+        ):
+            for event in adk_event_to_ag_ui(adk_event):
+                yield event
+    except Exception as e:
+        yield ErrorEventData(message="Orchestrator run failed", details=str(e), runId=run_id, timestamp=timestamp())
+        yield RunLifecycleData(type="RUN_FINISHED", runId=run_id, status="failed", timestamp=timestamp())
+        return
+    yield RunLifecycleData(type="RUN_FINISHED", runId=run_id, status="completed", timestamp=timestamp())
+
+# Hit / miss counters for the market-data tool cache
+@app.get("/debug/cache-stats")
+async def cache_stats():
+    return {"market_data": market_data_cache.stats(), "analysis": analysis_cache.stats()}
+
+# Per-model admission counters, queue depth and wait-time percentiles from the rate governor
+@app.get("/debug/model-stats")
+async def model_stats():
+    return governor_stats()
+
+# Live provider context-cache handles, hit / create / expired-fallback counters
+@app.get("/debug/context-cache")
+async def context_cache_stats():
+    return context_cache.stats()
+
+# Prometheus exposition of per-run / per-agent / per-tool / per-model latency histograms and token counters
+@app.get("/metrics")
+async def metrics():
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+# Per-stage token totals, the largest prompt contributors and budget trimming counts across runs
+@app.get("/debug/token-stats")
+async def token_stats():
+    return token_profiler.stats()
+
+# Live session count / byte gauges and eviction counters
+@app.get("/debug/session-stats")
+async def session_stats():
+    return session_service.stats()
+
 # Debug endpoint to test the action handler directly
 @app.post("/debug/test-handler")
 async def test_handler_directly_endpoint(request: Request):
-    print("--- DEBUG ENDPOINT (/debug/test-handler) CALLED ---")
+    logger.info("debug endpoint /debug/test-handler called")
     # Example: receive JSON body with query and optional image_url
     try:
         body = await request.json()
@@ -252,12 +476,10 @@ async def test_handler_directly_endpoint(request: Request):
         test_kwargs = {"query": test_query, "image_url": test_image_url}
         
         result = await adk_orchestrator_action_handler(**test_kwargs)
-        print(f"Debug endpoint result: {json.dumps(result, indent=2)}")
+        log_event(logger, logging.DEBUG, "debug endpoint result", result=result)
         return {"status": "success", "debug_handler_result": result}
     except Exception as e:
-        print(f"Error in debug endpoint: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Debug endpoint failed")
         return {"status": "error", "message": f"Debug endpoint error: {str(e)}"}
 
 if __name__ == "__main__":
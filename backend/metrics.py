@@ -0,0 +1,117 @@
+"""
+Minimal in-process Prometheus metrics: labelled histograms and counters
+rendered in the text exposition format served by GET /metrics.
+
+Observations are a bisect plus a few additions under one lock, so they are
+cheap enough to record from span-end callbacks on the event loop.
+"""
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+# Seconds; covers sub-millisecond tool cache hits up to multi-minute model calls.
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}  # bucket counts (+Inf last), then sum
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labelvalues, values in sorted(series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                le = '"+Inf"' if bound == float("inf") else f'"{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, 'le=' + le)} {_number(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {_number(cumulative)}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help_text, labelnames, buckets)
+            return self._metrics[name]
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help_text, labelnames)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
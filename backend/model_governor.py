@@ -0,0 +1,328 @@
+"""
+Process-wide client-side rate governor for Gemini model calls.
+
+Every agent's model call passes through one ModelGovernor per model name, which
+enforces three limits before the request is sent:
+  - a requests-per-minute token bucket,
+  - an input-tokens-per-minute token bucket (charged with an estimate up front
+    and reconciled against the response's usage metadata),
+  - a max-in-flight semaphore.
+Waiters are admitted strictly first-come first-served, so one run issuing many
+calls cannot starve the others. Buckets are sized at MODEL_QUOTA_HEADROOM of
+the provider quota so throughput sits just under the limit; a 429 that gets
+through anyway empties both buckets, which pauses every caller of that model
+until they refill instead of each one retrying into the throttle.
+
+Limits come from MODEL_RATE_LIMITS='{"gemini-1.5-flash-latest": {"rpm": 300,
+"tpm": 1000000, "max_in_flight": 8}}' with MODEL_DEFAULT_* fallbacks. Agents opt
+in by passing model=governed_model(name); MODEL_GOVERNOR=0 passes the plain name.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Deque, Dict, Optional, Union
+
+from google.adk.models.google_llm import Gemini
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+from backend.context_cache import gemini_context_cache
+from backend.structured_logging import get_logger
+from backend.token_budget import CHARS_PER_TOKEN, IMAGE_TOKENS
+from backend.tracing import trace_span
+
+logger = get_logger(__name__)
+
+MODEL_GOVERNOR_ENABLED = os.environ.get("MODEL_GOVERNOR", "1") == "1"
+MODEL_QUOTA_HEADROOM = float(os.environ.get("MODEL_QUOTA_HEADROOM", "0.9"))
+MODEL_DEFAULT_RPM = int(os.environ.get("MODEL_DEFAULT_RPM", "300"))
+MODEL_DEFAULT_TPM = int(os.environ.get("MODEL_DEFAULT_TPM", "1000000"))
+MODEL_DEFAULT_MAX_IN_FLIGHT = int(os.environ.get("MODEL_DEFAULT_MAX_IN_FLIGHT", "8"))
+
+_WAIT_SAMPLES = 1000
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    rpm: int = MODEL_DEFAULT_RPM
+    tpm: int = MODEL_DEFAULT_TPM
+    max_in_flight: int = MODEL_DEFAULT_MAX_IN_FLIGHT
+
+
+MODEL_LIMITS: Dict[str, ModelLimits] = {
+    name: ModelLimits(**limits) for name, limits in json.loads(os.environ.get("MODEL_RATE_LIMITS", "{}")).items()
+}
+
+
+class TokenBucket:
+    """Continuously refilling bucket; the level may go negative when a charge is reconciled upwards."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (requests larger than capacity wait for a full bucket)."""
+        self._refill()
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def drain(self) -> None:
+        self._refill()
+        self.level = min(self.level, 0.0)
+
+
+class ModelGovernor:
+    """Admission control for one model: FIFO queue -> rate buckets -> in-flight slot."""
+
+    def __init__(self, model: str, limits: ModelLimits, headroom: float = MODEL_QUOTA_HEADROOM):
+        self.model = model
+        self.limits = limits
+        self.requests = TokenBucket(limits.rpm * headroom)
+        self.tokens = TokenBucket(limits.tpm * headroom)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._admission: Optional[asyncio.Lock] = None
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        # --- Metrics ---
+        self.admitted = 0
+        self.queued = 0
+        self.active = 0
+        self.throttled = 0
+        self.estimated_tokens = 0
+        self.actual_tokens = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+        self._waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+
+    def _primitives(self):
+        # asyncio primitives belong to one event loop; recreate them if the loop changed.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._admission = asyncio.Lock()
+            self._in_flight = asyncio.Semaphore(self.limits.max_in_flight)
+        return self._admission, self._in_flight
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """
+        Waits for an in-flight slot and this model's turn at the rate buckets, then
+        holds the slot for one provider request.
+        """
+        admission, in_flight = self._primitives()
+        enqueued = time.perf_counter()
+        self.queued += 1
+        try:
+            # The slot is awaited outside the admission lock, so a caller waiting for one does not
+            # hold up the others; both the semaphore and asyncio.Lock wake waiters in arrival order.
+            await in_flight.acquire()
+            try:
+                async with admission:
+                    while True:
+                        delay = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                        if delay <= 0:
+                            break
+                        await asyncio.sleep(delay)
+                    self.requests.take(1)
+                    self.tokens.take(estimated_tokens)
+            except BaseException:
+                in_flight.release()
+                raise
+        finally:
+            self.queued -= 1
+        waited = time.perf_counter() - enqueued
+        self.admitted += 1
+        self.estimated_tokens += estimated_tokens
+        self.total_wait_s += waited
+        self.max_wait_s = max(self.max_wait_s, waited)
+        self._waits.append(waited)
+        self.active += 1
+        usage = _Usage(self, estimated_tokens)
+        try:
+            yield usage
+        except Exception as e:
+            if _is_rate_limited(e):
+                self.throttled += 1
+                self.requests.drain()
+                self.tokens.drain()
+                logger.warning("Model %s returned 429; pausing its callers until the buckets refill", self.model)
+            raise
+        finally:
+            self.active -= 1
+            in_flight.release()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def pct(p: float) -> Optional[float]:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else None
+
+        return {
+            "limits": {"rpm": self.limits.rpm, "tpm": self.limits.tpm, "max_in_flight": self.limits.max_in_flight},
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "in_flight": self.active,
+            "throttled_429": self.throttled,
+            "estimated_tokens": self.estimated_tokens,
+            "actual_tokens": self.actual_tokens,
+            "wait_s": {
+                "mean": round(self.total_wait_s / self.admitted, 4) if self.admitted else None,
+                "p50": pct(0.5),
+                "p95": pct(0.95),
+                "max": round(self.max_wait_s, 4),
+            },
+        }
+
+
+class _Usage:
+    """Reconciles the up-front token estimate with the usage the provider reports."""
+
+    def __init__(self, governor: ModelGovernor, estimated_tokens: int):
+        self._governor = governor
+        self._charged = estimated_tokens
+        self._reported = 0
+
+    def record(self, usage_metadata: Any) -> None:
+        # Streamed chunks repeat the cumulative count, so only the difference is applied.
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) if usage_metadata else None
+        if not prompt_tokens:
+            return
+        self._governor.tokens.take(prompt_tokens - self._charged)
+        self._governor.actual_tokens += prompt_tokens - self._reported
+        self._charged = self._reported = prompt_tokens
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "code", None) == 429 or "RESOURCE_EXHAUSTED" in str(error)
+
+
+def estimate_request_tokens(llm_request: LlmRequest) -> int:
+    """Rough input size: ~4 characters per token for text plus a flat charge per image."""
+    chars = 0
+    images = 0
+    config = getattr(llm_request, "config", None)
+    system_instruction = getattr(config, "system_instruction", None) if config else None
+    if isinstance(system_instruction, str):
+        chars += len(system_instruction)
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.text:
+                chars += len(part.text)
+            elif part.inline_data is not None or part.file_data is not None:
+                images += 1
+            elif part.function_response is not None or part.function_call is not None:
+                chars += len(str(part.function_response or part.function_call))
+    return max(1, chars // CHARS_PER_TOKEN + images * IMAGE_TOKENS)
+
+
+def request_payload_bytes(llm_request: LlmRequest) -> int:
+    """Text characters plus inline image bytes in the request contents."""
+    size = 0
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.text:
+                size += len(part.text)
+            elif part.inline_data is not None and part.inline_data.data:
+                size += len(part.inline_data.data)
+    return size
+
+
+def _response_bytes(response: LlmResponse) -> int:
+    if response.content is None:
+        return 0
+    return sum(len(part.text) for part in response.content.parts or [] if part.text)
+
+
+def _record_token_usage(span: Any, usage_metadata: Any) -> None:
+    if not usage_metadata:
+        return
+    span.set_attributes({
+        name: value for name, value in (
+            ("tokens_prompt", getattr(usage_metadata, "prompt_token_count", None)),
+            ("tokens_output", getattr(usage_metadata, "candidates_token_count", None)),
+            ("tokens_cached", getattr(usage_metadata, "cached_content_token_count", None)),
+            ("tokens_total", getattr(usage_metadata, "total_token_count", None)),
+        ) if value is not None
+    })
+
+
+_governors: Dict[str, ModelGovernor] = {}
+_governors_lock = threading.Lock()
+
+
+def get_model_governor(model: str) -> ModelGovernor:
+    with _governors_lock:
+        governor = _governors.get(model)
+        if governor is None:
+            governor = _governors[model] = ModelGovernor(model, MODEL_LIMITS.get(model, ModelLimits()))
+        return governor
+
+
+def governor_stats() -> Dict[str, Dict[str, Any]]:
+    with _governors_lock:
+        governors = list(_governors.values())
+    return {governor.model: governor.stats() for governor in governors}
+
+
+class GovernedGemini(Gemini):
+    """
+    Gemini client whose every call is admitted by the model's process-wide
+    governor, with the static request prefix served from the context cache.
+
+    The in-flight slot covers the provider request only and is released before
+    the response is handed to ADK: ADK runs the turn's tool calls (and, in
+    orchestrator mode, AgentTool sub-agents calling this same model) while this
+    generator is suspended at its yield, so holding the slot there would count
+    tool time as model time and can deadlock once every slot is held by a parent.
+    """
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        governor = get_model_governor(self.model)
+        estimated_tokens = estimate_request_tokens(llm_request)
+        # Not made the active span: it ends inside this generator, before the responses are yielded.
+        with trace_span(f"llm {self.model}", "llm", current=False, model=self.model,
+                        estimated_tokens=estimated_tokens, request_bytes=request_payload_bytes(llm_request)) as llm_span:
+            enqueued = time.perf_counter()
+            async with governor.slot(estimated_tokens) as usage:
+                llm_span.set_attribute("queue_wait_s", round(time.perf_counter() - enqueued, 4))
+                # Read to the end inside the slot (stream=True chunks are then handed over together;
+                # nothing here streams to a client).
+                received = [response async for response in self._generate(llm_request, stream)]
+            for response in received:
+                usage.record(response.usage_metadata)
+                _record_token_usage(llm_span, response.usage_metadata)
+            llm_span.set_attribute("response_bytes", sum(_response_bytes(response) for response in received))
+        # The span (and so the model latency) ends before ADK runs any tool the response asks for.
+        for response in received:
+            yield response
+
+    def _generate(self, llm_request: LlmRequest, stream: bool) -> AsyncGenerator[LlmResponse, None]:
+        # The static instruction/tool prefix goes through the provider's context cache when enabled.
+        cache = gemini_context_cache(self.api_client)
+        if cache is None:
+            return super().generate_content_async(llm_request, stream)
+        return cache.generate(llm_request.model or self.model, llm_request,
+                              lambda request: super(GovernedGemini, self).generate_content_async(request, stream))
+
+
+def governed_model(model: str) -> Union[str, Gemini]:
+    """The value to pass as LlmAgent(model=...): a governed client, or the plain name when disabled."""
+    return GovernedGemini(model=model) if MODEL_GOVERNOR_ENABLED else model
@@ -0,0 +1,3 @@
+from backend.prompts.compiler import PROMPT_SPECS, PromptSpec, RuleLookup, compile_instruction, compiled_instruction
+
+__all__ = ["PROMPT_SPECS", "PromptSpec", "RuleLookup", "compile_instruction", "compiled_instruction"]
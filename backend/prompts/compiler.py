@@ -0,0 +1,157 @@
+"""
+Startup-time prompt compiler for the chart-reading agents.
+
+Several agents are told to call their knowledge-base search tool for fixed rule
+lookups (funding-rate thresholds, Kalman / MOAK interpretation, LuxAlgo level
+descriptions) before they look at the chart. The answers never change between
+runs, yet each call costs a full extra model turn. The compiler resolves those
+lookups once per process against the local index and inlines the passages into
+the instruction as a REFERENCE RULES section, rewrites the mandatory tool steps
+to point at it, and the agent is built without the search tool so it can answer
+in a single turn.
+
+Compilation is all-or-nothing per agent: if a rewrite no longer matches the
+instruction text (the prompt was edited) or a lookup finds nothing, the agent
+keeps its original instruction and tool. Set PROMPT_COMPILER=0 to disable.
+"""
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from backend.analysis_cache import text_sha256
+from backend.rag import SearchHit, get_knowledge_index
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+PROMPT_COMPILER_ENABLED = os.environ.get("PROMPT_COMPILER", "1") == "1"
+REFERENCE_SECTION_TITLE = "## 📚 REFERENCE RULES (pre-loaded from the knowledge base — no tool call needed)"
+
+
+class PromptCompileError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class RuleLookup:
+    title: str
+    query: str
+    top_k: int = 1
+    # Only passages from these document sections qualify (the analysis docs share one outline).
+    sections: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class PromptSpec:
+    lookups: Tuple[RuleLookup, ...]
+    # (regex, replacement) pairs; every pattern must match at least once.
+    rewrites: Tuple[Tuple[str, str], ...]
+
+
+_TOOL_RULE_REWRITES: Tuple[Tuple[str, str], ...] = (
+    (r"Utilize the `FileSearchTool` to retrieve (.*?) from the RAG system\.",
+     r"Use \1 from the REFERENCE RULES section below."),
+    (r"\*\*Tool Usage\*\* — You \*\*MUST\*\* use `FileSearchTool`",
+     "**Reference Rules** — Use the REFERENCE RULES section below"),
+    (r"^[ \t]*\*[ \t]+\*Params for FileSearchTool:\*.*\n", ""),
+    (r"RAG for [^→\n]+→ ", ""),
+    (r"\*\*RAG Queries:\*\* Invoke `FileSearchTool`.*$",
+     "**Rules:** Take the interpretation rules from the REFERENCE RULES section (already retrieved; do not call any tool)."),
+    (r"Perform RAG queries and visual analysis", "Perform visual analysis"),
+)
+
+PROMPT_SPECS: Dict[str, PromptSpec] = {
+    "derivatives": PromptSpec(
+        lookups=(
+            RuleLookup("Open Interest relative to Price", "open interest rising falling price up down bullish bearish"),
+            RuleLookup("Funding Rate thresholds", "funding rate thresholds greater less than"),
+            RuleLookup("Cumulative Volume Delta relative to Price", "cumulative volume delta CVD rising falling price"),
+            RuleLookup("Trapped Traders & Stop Hunts", "trapped traders stop hunts failed auctions"),
+        ),
+        rewrites=_TOOL_RULE_REWRITES,
+    ),
+    "momentum": PromptSpec(
+        lookups=(
+            RuleLookup("Adaptive Kalman Filter - Trend Strength Oscillator", "adaptive kalman filter trend strength oscillator",
+                       top_k=2, sections=("Key Takeaways", "Entry & Exit Logic")),
+            RuleLookup("Aggregated Volume Delta", "aggregated volume spot futures delta buying selling pressure",
+                       top_k=2, sections=("Key Takeaways", "Entry & Exit Logic")),
+            RuleLookup("Multi-Oscillator Adaptive Kernel (MOAK)", "multi-oscillator adaptive kernel opus signal",
+                       top_k=2, sections=("4. Trading/Usage Insights",)),
+        ),
+        rewrites=_TOOL_RULE_REWRITES,
+    ),
+    "ranges": PromptSpec(
+        lookups=(
+            RuleLookup("LuxAlgo Predictive Ranges levels", "luxalgo predictive ranges levels",
+                       top_k=2, sections=("Key Takeaways", "Entry & Exit Logic")),
+        ),
+        rewrites=(
+            (r"Query RAG\. ", "Read the REFERENCE RULES. "),
+            (r"Perform RAG, OCR", "Perform OCR"),
+        ),
+    ),
+}
+
+Search = Callable[[str, int], List[SearchHit]]
+_SECTION_SEARCH_DEPTH = 50
+
+
+def render_reference_rules(lookups: Tuple[RuleLookup, ...], search: Search) -> str:
+    lines = [REFERENCE_SECTION_TITLE, ""]
+    seen = set()
+    for lookup in lookups:
+        candidates = search(lookup.query, _SECTION_SEARCH_DEPTH if lookup.sections else lookup.top_k)
+        hits = [
+            hit for hit in candidates
+            if (hit.source, hit.content) not in seen and (not lookup.sections or hit.section in lookup.sections)
+        ][:lookup.top_k]
+        if not hits:
+            raise PromptCompileError(f"No knowledge-base passage found for {lookup.title!r}")
+        lines.append(f"### {lookup.title}")
+        for hit in hits:
+            seen.add((hit.source, hit.content))
+            lines.append(f"*Source: {hit.source} — {hit.section}*")
+            lines.append(re.sub(r"\n\s*\n", "\n", hit.content.strip()))
+            lines.append("")
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def compile_instruction(instruction: str, spec: PromptSpec, search: Optional[Search] = None) -> str:
+    """Applies the spec's rewrites and inlines its rule lookups ahead of the first '---' divider."""
+    search = search or (lambda query, top_k: get_knowledge_index().search(query, top_k))
+    text = instruction
+    for pattern, replacement in spec.rewrites:
+        text, count = re.subn(pattern, replacement, text, flags=re.MULTILINE)
+        if count == 0:
+            raise PromptCompileError(f"Rewrite pattern no longer matches the instruction: {pattern!r}")
+    rules = render_reference_rules(spec.lookups, search)
+    divider = text.find("\n---\n")
+    if divider == -1:
+        return f"{text.rstrip()}\n\n{rules}"
+    return f"{text[:divider]}\n\n{rules}{text[divider:]}"
+
+
+_compiled: Dict[Tuple[str, str], Optional[str]] = {}
+_compiled_lock = threading.Lock()
+
+
+def compiled_instruction(agent_key: str, instruction: str) -> Optional[str]:
+    """
+    The compiled instruction for agent_key, computed once per process; None when the
+    compiler is disabled or compilation failed (the agent then keeps its search tool).
+    """
+    spec = PROMPT_SPECS.get(agent_key)
+    if not PROMPT_COMPILER_ENABLED or spec is None:
+        return None
+    cache_key = (agent_key, text_sha256(instruction))
+    with _compiled_lock:
+        if cache_key not in _compiled:
+            try:
+                _compiled[cache_key] = compile_instruction(instruction, spec)
+            except Exception as e:
+                logger.warning("Prompt compiler: keeping the tool-based instruction for %s (%s)", agent_key, e)
+                _compiled[cache_key] = None
+        return _compiled[cache_key]
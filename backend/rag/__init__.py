@@ -0,0 +1,3 @@
+from backend.rag.knowledge_index import KnowledgeIndex, SearchHit, get_knowledge_index, search_knowledge_base
+
+__all__ = ["KnowledgeIndex", "SearchHit", "get_knowledge_index", "search_knowledge_base"]
@@ -0,0 +1,268 @@
+"""
+In-process retrieval over the documents in knowledge_base/.
+
+Documents are split into heading-aware chunks and embedded offline with signed
+feature hashing of unigrams and bigrams, weighted by TF-IDF and L2-normalised, so
+no embedding model or network call is needed. The chunk matrix is written once
+to KNOWLEDGE_INDEX_DIR and opened memory-mapped; it is rebuilt only when the
+corpus (file names, sizes, mtimes) or the embedding parameters change. One index
+is loaded per process and shared by every agent's search tool; a batch of
+queries is scored with one product over the matrix columns they hit.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from backend.structured_logging import get_logger
+from backend.tracing import trace_span
+
+logger = get_logger(__name__)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+KNOWLEDGE_BASE_DIR = os.environ.get("KNOWLEDGE_BASE_DIR", os.path.join(_PROJECT_ROOT, "knowledge_base"))
+KNOWLEDGE_INDEX_DIR = os.environ.get("KNOWLEDGE_INDEX_DIR", os.path.join(_PROJECT_ROOT, "workspaces", "knowledge_index"))
+
+EMBEDDING_DIM = 16384
+CHUNK_MAX_CHARS = 900
+INDEX_VERSION = 1
+_DOC_EXTENSIONS = (".md", ".txt")
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?%?")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can for from how in into is it its of on or that the this to what when which with "
+    "provide interpret interpretation values states".split()
+)
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.*)$")
+# Plain-text documents (e.g. the trading checklist) title their sections with a bare short line.
+_PLAIN_TITLE_RE = re.compile(r"^([A-Z][\w &/()'-]{2,60})$")
+
+
+@dataclass
+class SearchHit:
+    content: str
+    source: str
+    section: str
+    score: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"content": self.content, "source": self.source, "section": self.section, "score": round(self.score, 4)}
+
+
+def tokenize(text: str) -> List[str]:
+    words = [w for w in _TOKEN_RE.findall(text.lower()) if w not in _STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def hashed_counts(text: str, dim: int = EMBEDDING_DIM) -> Dict[int, float]:
+    """Signed feature hashing: bucket from crc32, sign from its top bit (stable across processes)."""
+    counts: Dict[int, float] = {}
+    for token in tokenize(text):
+        h = zlib.crc32(token.encode("utf-8"))
+        bucket = h % dim
+        counts[bucket] = counts.get(bucket, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+    return counts
+
+
+def chunk_document(text: str, default_section: str, max_chars: int = CHUNK_MAX_CHARS) -> List[Dict[str, str]]:
+    """Splits a document into chunks that never cross a section heading, packing paragraphs up to max_chars."""
+    chunks: List[Dict[str, str]] = []
+    section = default_section
+    heading_re = _HEADING_RE if re.search(r"^#{1,6}\s", text, re.MULTILINE) else _PLAIN_TITLE_RE
+    buffer: List[str] = []
+
+    def flush() -> None:
+        body = "\n\n".join(buffer).strip()
+        if body:
+            chunks.append({"section": section, "content": body})
+        buffer.clear()
+
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        heading = heading_re.match(paragraph.splitlines()[0])
+        if heading:
+            flush()
+            section = heading.group(1).strip("*# ").strip() or section
+            paragraph = "\n".join(paragraph.splitlines()[1:]).strip()
+            if not paragraph:
+                continue
+        if buffer and sum(len(p) for p in buffer) + len(paragraph) > max_chars:
+            flush()
+        buffer.append(paragraph)
+    flush()
+    return chunks
+
+
+class KnowledgeIndex:
+    """Top-k cosine search over a memory-mapped chunk embedding matrix."""
+
+    def __init__(self, matrix: np.ndarray, idf: np.ndarray, chunks: List[Dict[str, str]]):
+        self.matrix = matrix
+        self.idf = idf
+        self.chunks = chunks
+
+    @classmethod
+    def load_or_build(cls, docs_dir: str = KNOWLEDGE_BASE_DIR, index_dir: str = KNOWLEDGE_INDEX_DIR) -> "KnowledgeIndex":
+        paths = _corpus_files(docs_dir)
+        fingerprint = _corpus_fingerprint(paths)
+        manifest_path = os.path.join(index_dir, "manifest.json")
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("fingerprint") == fingerprint:
+                return cls._open(index_dir)
+        except (OSError, ValueError):
+            pass
+        started = time.perf_counter()
+        cls._build(paths, index_dir, fingerprint)
+        index = cls._open(index_dir)
+        logger.info("Knowledge index built: %d chunks from %d documents in %.2fs",
+                    len(index.chunks), len(paths), time.perf_counter() - started)
+        return index
+
+    def embed(self, text: str) -> Dict[int, float]:
+        """Sparse query embedding: bucket -> unit-normalised TF-IDF weight."""
+        weights = {
+            bucket: math.copysign(1.0 + math.log(abs(count)), count) * float(self.idf[bucket])
+            for bucket, count in hashed_counts(text, self.matrix.shape[1]).items() if count
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return {bucket: w / norm for bucket, w in weights.items()} if norm else {}
+
+    def search(self, query: str, top_k: int = 3) -> List[SearchHit]:
+        return self.search_batch([query], top_k)[0]
+
+    def search_batch(self, queries: Sequence[str], top_k: int = 3) -> List[List[SearchHit]]:
+        """
+        Scores all queries against every chunk with one matrix product, restricted
+        to the columns the queries actually hit (query vectors are very sparse).
+        """
+        if not self.chunks or not queries:
+            return [[] for _ in queries]
+        embedded = [self.embed(q) for q in queries]
+        columns = sorted({bucket for weights in embedded for bucket in weights})
+        if not columns:
+            return [[] for _ in queries]
+        position = {bucket: i for i, bucket in enumerate(columns)}
+        query_matrix = np.zeros((len(queries), len(columns)), dtype=np.float32)
+        for row, weights in enumerate(embedded):
+            for bucket, weight in weights.items():
+                query_matrix[row, position[bucket]] = weight
+        scores = query_matrix @ self.matrix[:, columns].T
+        k = min(top_k, len(self.chunks))
+        results: List[List[SearchHit]] = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top])]
+            results.append([
+                SearchHit(content=self.chunks[i]["content"], source=self.chunks[i]["source"],
+                          section=self.chunks[i]["section"], score=float(row[i]))
+                for i in top if row[i] > 0.0
+            ])
+        return results
+
+    @classmethod
+    def _open(cls, index_dir: str) -> "KnowledgeIndex":
+        with open(os.path.join(index_dir, "chunks.json"), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        idf = np.load(os.path.join(index_dir, "idf.npy"))
+        if not chunks:
+            return cls(np.zeros((0, len(idf)), dtype=np.float32), idf, chunks)
+        matrix = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+        return cls(matrix, idf, chunks)
+
+    @staticmethod
+    def _build(paths: List[str], index_dir: str, fingerprint: str) -> None:
+        chunks: List[Dict[str, str]] = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            source = os.path.basename(path)
+            for chunk in chunk_document(text, os.path.splitext(source)[0]):
+                chunks.append({"source": source, **chunk})
+
+        counts = np.zeros((len(chunks), EMBEDDING_DIM), dtype=np.float32)
+        for row, chunk in enumerate(chunks):
+            # The document and section titles are part of what a chunk is "about".
+            for bucket, count in hashed_counts(f"{os.path.splitext(chunk['source'])[0]}\n{chunk['section']}\n{chunk['content']}").items():
+                counts[row, bucket] = math.copysign(1.0 + math.log(abs(count)), count) if count else 0.0
+        document_freq = np.count_nonzero(counts, axis=0)
+        idf = (np.log((1 + len(chunks)) / (1 + document_freq)) + 1.0).astype(np.float32)
+        counts *= idf
+        norms = np.linalg.norm(counts, axis=1, keepdims=True)
+        counts /= np.where(norms == 0, 1.0, norms)
+
+        os.makedirs(index_dir, exist_ok=True)
+        # Write-then-rename each file; the manifest goes last so a partial build is never trusted.
+        _atomic_write(os.path.join(index_dir, "embeddings.npy"), lambda f: np.save(f, counts), binary=True)
+        _atomic_write(os.path.join(index_dir, "idf.npy"), lambda f: np.save(f, idf), binary=True)
+        _atomic_write(os.path.join(index_dir, "chunks.json"), lambda f: json.dump(chunks, f, ensure_ascii=False))
+        _atomic_write(os.path.join(index_dir, "manifest.json"), lambda f: json.dump(
+            {"fingerprint": fingerprint, "chunks": len(chunks), "documents": len(paths), "dim": EMBEDDING_DIM}, f))
+
+
+def _corpus_files(docs_dir: str) -> List[str]:
+    if not os.path.isdir(docs_dir):
+        return []
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(docs_dir)
+        for name in names
+        if name.lower().endswith(_DOC_EXTENSIONS)
+    )
+
+
+def _corpus_fingerprint(paths: List[str]) -> str:
+    digest = hashlib.sha256(f"v{INDEX_VERSION}|{EMBEDDING_DIM}|{CHUNK_MAX_CHARS}".encode("utf-8"))
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"|{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _atomic_write(path: str, write, binary: bool = False) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb" if binary else "w", **({} if binary else {"encoding": "utf-8"})) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+_index: Optional[KnowledgeIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_knowledge_index() -> KnowledgeIndex:
+    """The process-wide index, loaded (or built) on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = KnowledgeIndex.load_or_build()
+    return _index
+
+
+def search_knowledge_base(query: str) -> dict:
+    """
+    Searches the trading knowledge base (indicator guides, trading checklist,
+    Monday Range strategy) and returns the most relevant passages with their source.
+    """
+    with trace_span("tool search_knowledge_base", "tool", tool="search_knowledge_base",
+                    request_bytes=len(query.encode())) as tool_span:
+        hits = get_knowledge_index().search(query, top_k=3)
+        tool_span.set_attribute("hits", len(hits))
+        if hits:
+            response = {"results": [hit.to_dict() for hit in hits]}
+        else:
+            response = {"results": [], "message": "No specific documentation found for the query."}
+        # Measured like the MCP tools' replies: the JSON the model receives.
+        tool_span.set_attribute("response_bytes", len(json.dumps(response).encode()))
+        return response
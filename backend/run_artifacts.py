@@ -0,0 +1,191 @@
+"""
+Per-run artifact persistence in the workspaces/ layout:
+
+    workspaces/<SYMBOL>_Analysis_<YYYY-MM-DD_HH-MM-SSZ>/
+        step01_context_output.json ... step11_final_report_output.json
+        FinalReport.json
+        FinalReport_Summary.txt
+        manifest.json
+
+Each stage's validated output is written as soon as the stage finishes, and the
+manifest (run status, per-stage status and timings) is rewritten after every
+stage, so a run that stops half-way can still be inspected. All file I/O runs
+on one background writer thread, in submission order, so the pipeline never
+waits on disk. Each file is written to a temp file and renamed into place, and
+JSON is written without indentation.
+
+The symbol comes from the context stage's "pair". Outputs finishing before it
+(memoized stages) are held back until the run directory can be named.
+"""
+import datetime
+import json
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+RUN_ARTIFACTS_ENABLED = os.environ.get("RUN_ARTIFACTS", "1") == "1"
+
+# Stage keys whose historical file names differ from "<key>_output.json".
+ARTIFACT_FILE_NAMES: Dict[str, str] = {
+    "step06_sentiment": "step06_sentiment_macro_output.json",
+    "step11_finalpackage": "step11_final_report_output.json",
+}
+CONTEXT_STAGE_KEY = "step01_context"
+FINAL_STAGE_KEY = "step11_finalpackage"
+FINAL_REPORT_FILE = "FinalReport.json"
+SUMMARY_FILE = "FinalReport_Summary.txt"
+MANIFEST_FILE = "manifest.json"
+# Run folder start time (UTC), as in <SYMBOL>_Analysis_2025-05-20_12-35-00Z.
+RUN_DIR_TIME_FORMAT = "%Y-%m-%d_%H-%M-%SZ"
+
+
+def artifact_file_name(stage_key: str) -> str:
+    return ARTIFACT_FILE_NAMES.get(stage_key, f"{stage_key}_output.json")
+
+
+def compact_json(payload: Any) -> bytes:
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class RunArtifacts:
+    """Artifacts of one pipeline run; all methods are cheap and called from the event loop."""
+
+    def __init__(self, writer: "RunArtifactWriter", run_id: str, query: str, image_url: Optional[str]):
+        self._writer = writer
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.directory: Optional[str] = None  # set on the writer thread once the symbol is known
+        self._pending: List[Tuple[str, Any]] = []  # (file name, JSON payload or text)
+        self._named = False
+        self.manifest: Dict[str, Any] = {
+            "run_id": run_id,
+            "query": query,
+            "image_url": image_url,
+            "symbol": None,
+            "status": "running",
+            "started_at": self.started.isoformat(),
+            "updated_at": self.started.isoformat(),
+            "total_s": None,
+            "stages": {},
+            "final_report": None,
+        }
+
+    def stage_finished(self, result: Any) -> None:
+        """Records a finished StageResult and queues its output file and a manifest refresh."""
+        output = result.output_dict()
+        self.manifest["stages"][result.key] = {
+            "file": artifact_file_name(result.key) if output is not None else None,
+            "status": "failed" if result.error else "skipped" if result.skipped else "cached" if result.cached else "ok",
+            "started_at_s": round(result.started_at, 3),
+            "duration_s": round(result.duration_s, 3),
+            "error": result.error,
+        }
+        if output is not None:
+            self._pending.append((artifact_file_name(result.key), output))
+        if result.key == CONTEXT_STAGE_KEY:
+            self._name_directory((output or {}).get("pair"))
+        self._flush()
+
+    def finish(self, status: str, total_s: float, final_output: Optional[Dict[str, Any]] = None,
+               summary: Optional[str] = None) -> None:
+        self.manifest["status"] = status
+        self.manifest["total_s"] = round(total_s, 3)
+        if final_output is not None:
+            self._pending.append((FINAL_REPORT_FILE, final_output))
+            self.manifest["final_report"] = FINAL_REPORT_FILE
+        if summary is not None:
+            self._pending.append((SUMMARY_FILE, summary))
+            self.manifest["summary"] = SUMMARY_FILE
+        if not self._named:
+            self._name_directory(None)
+        self._flush()
+
+    def _name_directory(self, pair: Optional[str]) -> None:
+        symbol = re.sub(r"[^A-Za-z0-9]+", "", pair or "").upper() or "UNKNOWN"
+        self.manifest["symbol"] = symbol
+        self._named = True
+        name = f"{symbol}_Analysis_{self.started.strftime(RUN_DIR_TIME_FORMAT)}"
+        self._writer.submit(lambda: self._create_directory(name))
+
+    def _create_directory(self, name: str) -> None:
+        path = os.path.join(self._writer.root_dir, name)
+        try:
+            os.makedirs(path)
+        except FileExistsError:
+            # Concurrent runs for the same symbol in the same second (e.g. a batch).
+            path = f"{path}_{self.manifest['run_id']}"
+            os.makedirs(path, exist_ok=True)
+        self.directory = path
+
+    def _flush(self) -> None:
+        if not self._named:
+            return
+        self.manifest["updated_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        # Encode now, on the loop thread, so later mutations cannot race the writer.
+        files = [(name, payload.encode("utf-8") if isinstance(payload, str) else compact_json(payload))
+                 for name, payload in self._pending]
+        files.append((MANIFEST_FILE, compact_json(self.manifest)))
+        self._pending = []
+        self._writer.submit(lambda: self._write_files(files))
+
+    def _write_files(self, files: List[Tuple[str, bytes]]) -> None:
+        if self.directory is None:
+            return
+        for name, data in files:
+            atomic_write_bytes(os.path.join(self.directory, name), data)
+        if self._writer.on_final_report is not None and any(name == FINAL_REPORT_FILE for name, _ in files):
+            self._writer.on_final_report(os.path.join(self.directory, FINAL_REPORT_FILE))
+
+
+class RunArtifactWriter:
+    """
+    Owns the background writer thread shared by every run. on_final_report, if
+    given, is called on that thread with the path of each FinalReport.json once
+    it (and the run's final manifest) is on disk.
+    """
+
+    def __init__(self, root_dir: str, on_final_report: Optional[Callable[[str], Any]] = None):
+        self.root_dir = root_dir
+        self.on_final_report = on_final_report
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="run-artifacts")
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+        self.writes_failed = 0
+
+    def begin(self, run_id: str, query: str, image_url: Optional[str]) -> RunArtifacts:
+        return RunArtifacts(self, run_id, query, image_url)
+
+    def submit(self, job: Callable[[], None]) -> None:
+        future = self._pool.submit(self._guarded, job)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Blocks until everything submitted so far is on disk (for shutdown and tests)."""
+        with self._lock:
+            pending = list(self._futures)
+        wait(pending, timeout=timeout)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def _guarded(self, job: Callable[[], None]) -> None:
+        try:
+            job()
+        except Exception as e:
+            # Losing an artifact must never fail the run that produced it.
+            self.writes_failed += 1
+            logger.warning("Run artifact write failed: %s", e)
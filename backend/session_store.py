@@ -0,0 +1,281 @@
+"""
+Bounded ADK session service.
+
+The plain InMemorySessionService keeps every session and every event (tool
+payloads included) for the life of the process. BoundedSessionService keeps the
+same in-memory behaviour but tracks each session's serialized size and last
+access, and evicts sessions that have been idle longer than SESSION_TTL_S, then
+the least-recently-used ones while the store is over SESSION_MAX_COUNT sessions
+or SESSION_MAX_MB of events.
+
+With SESSION_STORE_PATH set, events are also written through to a SQLite (WAL)
+database. Memory then acts as a bounded hot tier: a session evicted for space is
+rehydrated from SQLite the next time it is read or appended to, and only the TTL
+removes it for good. Session / byte gauges are exposed through stats().
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig
+
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+SESSION_TTL_S = float(os.environ.get("SESSION_TTL_S", "3600"))
+SESSION_MAX_COUNT = int(os.environ.get("SESSION_MAX_COUNT", "500"))
+SESSION_MAX_BYTES = int(float(os.environ.get("SESSION_MAX_MB", "256")) * 1024 * 1024)
+SESSION_STORE_PATH = os.environ.get("SESSION_STORE_PATH") or None
+
+_SWEEP_INTERVAL_S = 60.0
+
+SessionKey = Tuple[str, str, str]  # (app_name, user_id, session_id)
+
+
+@dataclass
+class _SessionEntry:
+    last_access: float
+    size_bytes: int = 0
+
+
+class SessionDiskStore:
+    """Write-through event log for sessions, one row per session and per event."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS sessions (
+                    app_name TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (app_name, user_id, session_id)
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS session_events (
+                    app_name TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (app_name, user_id, session_id, seq)
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions(last_access)")
+            self._conn.commit()
+
+    def create(self, key: SessionKey, state: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                               (*key, json.dumps(state, default=str), time.time()))
+            self._conn.execute("DELETE FROM session_events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+            self._conn.commit()
+
+    def append(self, key: SessionKey, payload: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO session_events
+                   SELECT ?, ?, ?, COALESCE(MAX(seq), 0) + 1, ? FROM session_events
+                   WHERE app_name = ? AND user_id = ? AND session_id = ?""",
+                (*key, payload, *key),
+            )
+            self._conn.execute("UPDATE sessions SET last_access = ? WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                               (time.time(), *key))
+            self._conn.commit()
+
+    def load(self, key: SessionKey) -> Optional[Tuple[Dict[str, Any], List[str]]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            events = [payload for (payload,) in self._conn.execute(
+                "SELECT payload FROM session_events WHERE app_name = ? AND user_id = ? AND session_id = ? ORDER BY seq",
+                key,
+            )]
+        return json.loads(row[0]), events
+
+    def delete(self, key: SessionKey) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM session_events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+            self._conn.execute("DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+            self._conn.commit()
+
+    def expire(self, idle_before: float) -> int:
+        with self._lock:
+            expired = self._conn.execute(
+                "SELECT app_name, user_id, session_id FROM sessions WHERE last_access < ?", (idle_before,)
+            ).fetchall()
+            for key in expired:
+                self._conn.execute(
+                    "DELETE FROM session_events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+            self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (idle_before,))
+            self._conn.commit()
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (sessions,) = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            events, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM session_events"
+            ).fetchone()
+        return {"sessions": sessions, "events": events, "bytes": size}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class BoundedSessionService(InMemorySessionService):
+    """InMemorySessionService with idle TTL, LRU eviction under count/byte ceilings and optional SQLite durability."""
+
+    def __init__(self, ttl_s: float = SESSION_TTL_S, max_sessions: int = SESSION_MAX_COUNT,
+                 max_bytes: int = SESSION_MAX_BYTES, db_path: Optional[str] = SESSION_STORE_PATH):
+        super().__init__()
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.disk = SessionDiskStore(db_path) if db_path else None
+        self._entries: "OrderedDict[SessionKey, _SessionEntry]" = OrderedDict()  # least recently used first
+        self._total_bytes = 0
+        self._last_disk_sweep = 0.0
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+        self.rehydrated = 0
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[Dict[str, Any]] = None,
+                             session_id: Optional[str] = None) -> Session:
+        await self._evict()
+        session = await super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+        key = (app_name, user_id, session.id)
+        self._touch(key)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.create, key, state or {})
+        return session
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        if key not in self._entries and not await self._rehydrate(key):
+            return None
+        self._touch(key)
+        return await super().get_session(app_name=app_name, user_id=user_id, session_id=session_id, config=config)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        key = (session.app_name, session.user_id, session.id)
+        if key not in self._entries:
+            # Evicted for space while a runner still held it; restore so the event is not dropped.
+            await self._rehydrate(key)
+        event = await super().append_event(session=session, event=event)
+        if event.partial or key not in self._entries:
+            return event
+        payload = event.model_dump_json(exclude_none=True)
+        self._touch(key, len(payload))
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.append, key, payload)
+        await self._evict_over_budget(keep=key)
+        return event
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        self._forget(key)
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.delete, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl_s,
+            "evicted_ttl": self.evicted_ttl,
+            "evicted_lru": self.evicted_lru,
+            "rehydrated": self.rehydrated,
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+    # --- Bookkeeping ---
+
+    def _touch(self, key: SessionKey, added_bytes: int = 0) -> None:
+        entry = self._entries.pop(key, None) or _SessionEntry(last_access=0.0)
+        entry.last_access = time.monotonic()
+        entry.size_bytes += added_bytes
+        self._total_bytes += added_bytes
+        self._entries[key] = entry
+
+    def _forget(self, key: SessionKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size_bytes
+
+    async def _drop_from_memory(self, key: SessionKey) -> None:
+        self._forget(key)
+        app_name, user_id, session_id = key
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def _evict(self) -> None:
+        """Drops idle sessions (memory and disk), then LRU sessions until under the ceilings."""
+        idle_before = time.monotonic() - self.ttl_s
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_access >= idle_before:
+                break
+            await self._drop_from_memory(key)
+            if self.disk is not None:
+                await asyncio.to_thread(self.disk.delete, key)
+            self.evicted_ttl += 1
+        if self.disk is not None and time.monotonic() - self._last_disk_sweep > _SWEEP_INTERVAL_S:
+            self._last_disk_sweep = time.monotonic()
+            self.evicted_ttl += await asyncio.to_thread(self.disk.expire, time.time() - self.ttl_s)
+        # Make room for the session about to be created.
+        await self._evict_over_budget(reserve=1)
+
+    async def _evict_over_budget(self, keep: Optional[SessionKey] = None, reserve: int = 0) -> None:
+        """LRU-evicts from memory (never `keep`) until under the count and byte ceilings."""
+        while len(self._entries) + reserve > self.max_sessions or self._total_bytes > self.max_bytes:
+            victim = next((key for key in self._entries if key != keep), None)
+            if victim is None:
+                break
+            await self._drop_from_memory(victim)
+            self.evicted_lru += 1
+
+    async def _rehydrate(self, key: SessionKey) -> bool:
+        """Rebuilds a session evicted from memory by replaying its stored events."""
+        if self.disk is None:
+            return False
+        stored = await asyncio.to_thread(self.disk.load, key)
+        if stored is None:
+            return False
+        state, payloads = stored
+        app_name, user_id, session_id = key
+        if await super().get_session(app_name=app_name, user_id=user_id, session_id=session_id) is None:
+            session = await super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+            for payload in payloads:
+                await super().append_event(session=session, event=Event.model_validate_json(payload))
+        self._touch(key, sum(len(p) for p in payloads))
+        self.rehydrated += 1
+        await self._evict_over_budget(keep=key)
+        return True
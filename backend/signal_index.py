@@ -0,0 +1,310 @@
+"""
+Queryable index of historical FinalReport signals.
+
+One SQLite (WAL) row per run folder holds the FinalSignal fields that are
+filtered on (symbol, timeframe, direction, entry, stopLoss, takeProfit,
+winProbability, confidence, _meta.timestamp) plus the full report JSON. Reports
+are ingested as runs finish (from the artifact writer thread), and at startup
+scan() picks up any workspaces/*/FinalReport.json that is new or changed since
+it was last indexed (compared by mtime and size), so a restart costs one stat
+per folder rather than a parse per report.
+
+Signals whose _meta.timestamp is a placeholder are timed by the run manifest's
+started_at, then by the report file's mtime.
+"""
+import asyncio
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.run_artifacts import RUN_DIR_TIME_FORMAT
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+REPORT_FILE = "FinalReport.json"
+MANIFEST_FILE = "manifest.json"
+MAX_PAGE_SIZE = 500
+# Bump when _report_row derives columns differently; older rows are dropped and re-ingested on the next scan.
+ROW_VERSION = 2
+
+# Query parameter -> (column, SQL operator)
+_FILTERS: Dict[str, Tuple[str, str]] = {
+    "symbol": ("symbol", "="),
+    "timeframe": ("timeframe", "="),
+    "direction": ("direction", "="),
+    "confidence": ("confidence", "="),
+    "min_win_probability": ("win_probability", ">="),
+    "max_win_probability": ("win_probability", "<="),
+    "since": ("signal_time", ">="),
+    "until": ("signal_time", "<"),
+}
+_COLUMNS = ("signal_id", "symbol", "timeframe", "direction", "entry", "stop_loss", "take_profit",
+            "win_probability", "confidence", "timestamp", "signal_time")
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """Epoch seconds for an ISO-8601 timestamp (trailing Z allowed); None if unparseable."""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+_RUN_DIR_TIME_RE = re.compile(r"_Analysis_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}Z)")
+
+
+def run_dir_time(name: str) -> Optional[float]:
+    """Epoch seconds from a <SYMBOL>_Analysis_<YYYY-MM-DD_HH-MM-SSZ>[_<run_id>] folder name; None otherwise."""
+    match = _RUN_DIR_TIME_RE.search(name)
+    if match is None:
+        return None
+    try:
+        parsed = datetime.datetime.strptime(match.group(1), RUN_DIR_TIME_FORMAT)
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _upper(value: Any) -> Optional[str]:
+    return value.strip().upper() if isinstance(value, str) and value.strip() else None
+
+
+def _lower(value: Any) -> Optional[str]:
+    return value.strip().lower() if isinstance(value, str) and value.strip() else None
+
+
+def _where(filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    clauses, params = [], []
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in _FILTERS:
+            raise ValueError(f"Unknown signal filter: {name}")
+        column, op = _FILTERS[name]
+        if name == "symbol":
+            value = _upper(value)
+        elif column in ("timeframe", "direction", "confidence"):
+            value = _lower(value)
+        elif name in ("since", "until") and not isinstance(value, (int, float)):
+            parsed = float(value) if str(value).replace(".", "", 1).isdigit() else parse_timestamp(value)
+            if parsed is None:
+                raise ValueError(f"Invalid {name} timestamp: {value!r}")
+            value = parsed
+        clauses.append(f"{column} {op} ?")
+        params.append(value)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+
+class SignalIndex:
+    def __init__(self, db_path: str, workspaces_dir: str):
+        self.db_path = db_path
+        self.workspaces_dir = workspaces_dir
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS signals (
+                    signal_id TEXT PRIMARY KEY,
+                    symbol TEXT,
+                    timeframe TEXT,
+                    direction TEXT,
+                    entry REAL,
+                    stop_loss REAL,
+                    take_profit REAL,
+                    win_probability INTEGER,
+                    confidence TEXT,
+                    timestamp TEXT,
+                    signal_time REAL NOT NULL,
+                    report TEXT NOT NULL,
+                    file_mtime_ns INTEGER NOT NULL,
+                    file_size INTEGER NOT NULL
+                )"""
+            )
+            for name, columns in (
+                ("symbol_time", "symbol, signal_time"),
+                ("time", "signal_time"),
+                ("timeframe_time", "timeframe, signal_time"),
+                ("direction_time", "direction, signal_time"),
+                ("confidence_time", "confidence, signal_time"),
+            ):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_signals_{name} ON signals({columns})")
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] < ROW_VERSION:
+                # scan() skips files whose mtime and size are unchanged, so stale rows must go first.
+                self._conn.execute("DELETE FROM signals")
+                self._conn.execute(f"PRAGMA user_version = {ROW_VERSION}")
+            self._conn.commit()
+
+    # --- Ingestion (blocking; call from a worker thread) ---
+
+    def ingest_report(self, report_path: str) -> bool:
+        """Indexes one run folder's FinalReport.json; returns False when the file is not a signal."""
+        row = self._report_row(report_path)
+        if row is None:
+            return False
+        self._insert([row])
+        return True
+
+    def scan(self) -> Dict[str, int]:
+        """Indexes reports that are new or changed since the last scan and drops rows whose folder is gone."""
+        started = time.perf_counter()
+        with self._lock:
+            known = {sid: (mtime, size) for sid, mtime, size in
+                     self._conn.execute("SELECT signal_id, file_mtime_ns, file_size FROM signals")}
+        seen, failed = set(), 0
+        rows: List[Tuple[Any, ...]] = []
+        if os.path.isdir(self.workspaces_dir):
+            for entry in os.scandir(self.workspaces_dir):
+                report_path = os.path.join(entry.path, REPORT_FILE)
+                if not entry.is_dir():
+                    continue
+                try:
+                    stat = os.stat(report_path)
+                except OSError:
+                    continue
+                seen.add(entry.name)
+                if known.get(entry.name) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                try:
+                    row = self._report_row(report_path)
+                except (OSError, ValueError) as e:
+                    failed += 1
+                    logger.warning("Signal index: could not ingest %s: %s", report_path, e)
+                    continue
+                if row is not None:
+                    rows.append(row)
+        self._insert(rows)
+        removed = [sid for sid in known if sid not in seen]
+        if removed:
+            with self._lock:
+                self._conn.executemany("DELETE FROM signals WHERE signal_id = ?", [(sid,) for sid in removed])
+                self._conn.commit()
+        summary = {"ingested": len(rows), "failed": failed, "removed": len(removed), "indexed": len(seen)}
+        logger.info("Signal index scan: %s in %.2fs", summary, time.perf_counter() - started)
+        return summary
+
+    def _report_row(self, report_path: str) -> Optional[Tuple[Any, ...]]:
+        stat = os.stat(report_path)
+        run_dir = os.path.dirname(os.path.abspath(report_path))
+        with open(report_path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        if not isinstance(report, dict) or "symbol" not in report:
+            return None
+        try:
+            with open(os.path.join(run_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        meta = report.get("_meta") or report.get("meta") or {}
+        timestamp = meta.get("timestamp") if isinstance(meta, dict) else None
+        # Historical reports carry a placeholder timestamp and no manifest; their folder name still has the
+        # run's start time, which is far closer than the file's mtime (often checkout or copy time).
+        signal_time = (parse_timestamp(timestamp) or parse_timestamp(manifest.get("started_at"))
+                       or run_dir_time(os.path.basename(run_dir)) or stat.st_mtime)
+        return (
+            os.path.basename(run_dir),
+            _upper(report.get("symbol")),
+            _lower(report.get("timeframe")),
+            _lower(report.get("direction")),
+            report.get("entry"),
+            report.get("stopLoss"),
+            report.get("takeProfit"),
+            report.get("winProbability"),
+            _lower(report.get("confidence")),
+            timestamp,
+            signal_time,
+            json.dumps(report, separators=(",", ":"), ensure_ascii=False),
+            stat.st_mtime_ns,
+            stat.st_size,
+        )
+
+    def _insert(self, rows: List[Tuple[Any, ...]]) -> None:
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(f"INSERT OR REPLACE INTO signals VALUES ({', '.join('?' * len(rows[0]))})", rows)
+            self._conn.commit()
+
+    # --- Queries ---
+
+    def query(self, limit: int = 50, offset: int = 0, newest_first: bool = True, **filters: Any) -> Dict[str, Any]:
+        """
+        Signals matching every given filter (see _FILTERS; since/until accept ISO
+        timestamps or epoch seconds), one page at a time, plus the total match count.
+        """
+        where, params = _where(filters)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        order = "DESC" if newest_first else "ASC"
+        with self._lock:
+            (total,) = self._conn.execute(f"SELECT COUNT(*) FROM signals {where}", params).fetchone()
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM signals {where} ORDER BY signal_time {order}, signal_id {order} "
+                "LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return {
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "items": [self._row_dict(row) for row in rows],
+        }
+
+    def signal_rows(self, **filters: Any) -> List[Dict[str, Any]]:
+        """Every matching signal, oldest first, with signal_time as epoch seconds (for offline analysis)."""
+        where, params = _where(filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM signals {where} ORDER BY signal_time, signal_id", params
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def get(self, signal_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)}, report FROM signals WHERE signal_id = ?", (signal_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        item = self._row_dict(row[:-1])
+        item["report"] = json.loads(row[-1])
+        return item
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total, symbols, first, last = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT symbol), MIN(signal_time), MAX(signal_time) FROM signals"
+            ).fetchone()
+        return {"signals": total, "symbols": symbols, "first_signal_time": first, "last_signal_time": last}
+
+    async def aquery(self, **kwargs: Any) -> Dict[str, Any]:
+        return await asyncio.to_thread(lambda: self.query(**kwargs))
+
+    async def aget(self, signal_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, signal_id)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row_dict(row: Tuple[Any, ...]) -> Dict[str, Any]:
+        item = dict(zip(_COLUMNS, row))
+        item["signal_time"] = datetime.datetime.fromtimestamp(item["signal_time"], datetime.timezone.utc).isoformat()
+        # Field names as they appear in FinalSignal.
+        item["stopLoss"] = item.pop("stop_loss")
+        item["takeProfit"] = item.pop("take_profit")
+        item["winProbability"] = item.pop("win_probability")
+        return item
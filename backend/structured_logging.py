@@ -0,0 +1,145 @@
+"""
+Asynchronous, size-capped structured logging.
+
+Request handlers only build a LogRecord and push it onto a bounded queue; all
+formatting (JSON encoding of payload fields, truncation) and writing happens on
+a background QueueListener thread. Records are emitted as JSON lines with each
+structured field truncated to LOG_FIELD_MAX_CHARS, and when the queue is full
+records are dropped (and counted) instead of stalling the event loop.
+
+Usage:
+    logger = get_logger(__name__)
+    log_event(logger, logging.INFO, "handler finished", status="success", result=final_result)
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.environ.get("LOG_FILE")  # JSON lines file; stderr when unset
+LOG_FILE_MAX_BYTES = int(os.environ.get("LOG_FILE_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_FILE_BACKUPS = int(os.environ.get("LOG_FILE_BACKUPS", "3"))
+LOG_FIELD_MAX_CHARS = int(os.environ.get("LOG_FIELD_MAX_CHARS", "500"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_REQUEST_SAMPLE_RATE = float(os.environ.get("LOG_REQUEST_SAMPLE_RATE", "1.0"))
+
+_ROOT_LOGGER_NAME = "crypto_ta"
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+def truncate_field(value: Any, max_chars: int = LOG_FIELD_MAX_CHARS) -> Any:
+    """Scalars pass through; strings and containers are serialized and cut to max_chars."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else json.dumps(value, default=str, separators=(",", ":"))
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...[+{len(text) - max_chars} chars]"
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def __init__(self, max_field_chars: int = LOG_FIELD_MAX_CHARS):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry[key] = truncate_field(value, self.max_field_chars)
+        if record.exc_info:
+            entry["exc"] = truncate_field(self.formatException(record.exc_info), self.max_field_chars * 4)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the raw record (formatting is left to the
+    listener thread) and drops records instead of blocking when the queue is full.
+    """
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stdlib version formats here, on the caller's thread; defer that to the listener.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging() -> logging.Logger:
+    """Installs the queue handler and starts the background writer (idempotent)."""
+    global _listener
+    root = logging.getLogger(_ROOT_LOGGER_NAME)
+    with _configure_lock:
+        if _listener is not None:
+            return root
+        if LOG_FILE:
+            os.makedirs(os.path.dirname(os.path.abspath(LOG_FILE)), exist_ok=True)
+            sink: logging.Handler = logging.handlers.RotatingFileHandler(
+                LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8"
+            )
+        else:
+            sink = logging.StreamHandler(sys.stderr)
+        sink.setFormatter(JsonLinesFormatter())
+        log_queue: "queue.Queue" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        root.addHandler(DroppingQueueHandler(log_queue))
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        _listener = logging.handlers.QueueListener(log_queue, sink, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+    return root
+
+
+def shutdown_logging() -> None:
+    """Flushes queued records and stops the writer thread."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Loggers live under the crypto_ta namespace so they share the queue handler."""
+    short_name = name.split(".")[-1] if name.startswith("backend.") else name
+    return logging.getLogger(f"{_ROOT_LOGGER_NAME}.{short_name}")
+
+
+def log_event(logger: logging.Logger, level: int, message: str, **fields: Any) -> None:
+    """
+    Logs message with structured fields. Field values are serialized and
+    truncated on the writer thread, so pass the objects as-is; the level check
+    happens first so disabled levels cost nothing.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"fields": fields})
+
+
+def should_sample(rate: float = LOG_REQUEST_SAMPLE_RATE) -> bool:
+    return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+def dropped_records() -> int:
+    handlers = logging.getLogger(_ROOT_LOGGER_NAME).handlers
+    return sum(h.dropped for h in handlers if isinstance(h, DroppingQueueHandler))
@@ -0,0 +1,353 @@
+"""
+Token accounting and per-run token budgets for the pipeline.
+
+Each run gets a RunTokenLedger. It records, per stage:
+  - input, output, cached and image tokens for every model call,
+  - how the input breaks down by contributor: the instruction, the user query,
+    each upstream stage's JSON, tool results, earlier turns and the image.
+
+Token counts come from the provider's usage metadata when it reports them.
+Otherwise they are estimated at ~4 characters per token plus a flat charge per
+image. Counts are captured by before/after-model callbacks installed on each
+agent, and attributed to the run and stage through a context variable the
+executor sets around each agent invocation.
+
+Budgets (0 = unlimited):
+  - RUN_TOKEN_BUDGET caps the input tokens of a whole run. Every stage may use
+    an equal share of what is left when its prompt is built.
+  - STAGE_PROMPT_TOKEN_BUDGET caps a single stage's first request.
+A stage whose prompt would exceed its allowance gets its upstream context
+trimmed in steps until it fits:
+  1. long strings are shortened,
+  2. then lists are cut to their first items as well,
+  3. then nested objects are dropped from the largest upstream outputs.
+A stage that still does not fit runs anyway and is flagged over_budget.
+
+TokenProfiler aggregates the finished ledgers for /debug/token-stats.
+"""
+import contextvars
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258  # Gemini's flat per-image input charge
+
+RUN_TOKEN_BUDGET = int(os.environ.get("RUN_TOKEN_BUDGET", "0"))
+STAGE_PROMPT_TOKEN_BUDGET = int(os.environ.get("STAGE_PROMPT_TOKEN_BUDGET", "0"))
+TOKEN_TRIM_STRING_CHARS = int(os.environ.get("TOKEN_TRIM_STRING_CHARS", "300"))
+TOKEN_TRIM_LIST_ITEMS = int(os.environ.get("TOKEN_TRIM_LIST_ITEMS", "3"))
+TOP_CONTRIBUTORS = 10
+
+# (ledger, stage key) for the agent invocation in progress.
+_current: contextvars.ContextVar[Optional[Tuple["RunTokenLedger", str]]] = contextvars.ContextVar(
+    "token_ledger", default=None
+)
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    return len(text) // CHARS_PER_TOKEN if text else 0
+
+
+def json_tokens(payload: Any) -> int:
+    return estimate_tokens(json.dumps(payload, separators=(",", ":"), default=str))
+
+
+@dataclass
+class StageTokens:
+    calls: int = 0
+    input_tokens: int = 0  # reported by the provider; estimated_input_tokens when it reports nothing
+    estimated_input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    image_tokens: int = 0
+    reported: bool = False
+    prompt_tokens: int = 0  # estimate for the first request, set when the prompt is built
+    sections: Dict[str, int] = field(default_factory=dict)
+    prompt_sections: Dict[str, int] = field(default_factory=dict)
+    allowance: Optional[int] = None
+    trim_level: int = 0
+    trimmed_tokens: int = 0
+    over_budget: bool = False
+
+    @property
+    def effective_input_tokens(self) -> int:
+        if self.reported:
+            return self.input_tokens
+        return self.estimated_input_tokens or self.prompt_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.effective_input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "image_tokens": self.image_tokens,
+            "estimated": not self.reported,
+            "sections": dict(sorted(self.sections.items(), key=lambda item: -item[1])),
+            "allowance": self.allowance,
+            "trim_level": self.trim_level,
+            "trimmed_tokens": self.trimmed_tokens,
+            "over_budget": self.over_budget,
+        }
+
+
+class RunTokenLedger:
+    def __init__(self, run_id: str, stage_count: int, run_budget: int = RUN_TOKEN_BUDGET,
+                 stage_budget: int = STAGE_PROMPT_TOKEN_BUDGET):
+        self.run_id = run_id
+        self.stage_count = stage_count
+        self.run_budget = run_budget
+        self.stage_budget = stage_budget
+        self.stages: Dict[str, StageTokens] = {}
+
+    def stage(self, key: str) -> StageTokens:
+        entry = self.stages.get(key)
+        if entry is None:
+            entry = self.stages[key] = StageTokens()
+        return entry
+
+    def input_tokens(self) -> int:
+        return sum(s.effective_input_tokens for s in self.stages.values())
+
+    def output_tokens(self) -> int:
+        return sum(s.output_tokens for s in self.stages.values())
+
+    def allowance(self, key: str) -> Optional[int]:
+        """Input tokens the stage's first request may use, or None when unbudgeted."""
+        limits = []
+        if self.stage_budget > 0:
+            limits.append(self.stage_budget)
+        if self.run_budget > 0:
+            started = sum(1 for k in self.stages if k != key)
+            remaining_stages = max(1, self.stage_count - started)
+            limits.append(max(0, self.run_budget - self.input_tokens()) // remaining_stages)
+        return min(limits) if limits else None
+
+    # --- Model callbacks (via record_request / record_response) ---
+
+    def record_request(self, key: str, llm_request: Any) -> None:
+        entry = self.stage(key)
+        entry.calls += 1
+        instruction = _system_instruction_text(llm_request)
+        sections: Dict[str, int] = {"instruction": estimate_tokens(instruction)}
+        first_user_text = True
+        for content in getattr(llm_request, "contents", None) or []:
+            for part in content.parts or []:
+                if part.inline_data is not None or part.file_data is not None:
+                    sections["image"] = sections.get("image", 0) + IMAGE_TOKENS
+                elif part.function_response is not None:
+                    sections["tool_results"] = sections.get("tool_results", 0) + json_tokens(
+                        part.function_response.response)
+                elif part.function_call is not None:
+                    sections["history"] = sections.get("history", 0) + json_tokens(part.function_call.args)
+                elif part.text:
+                    if first_user_text and content.role == "user" and entry.prompt_sections:
+                        # The stage prompt; attribute it to the contributors recorded when it was built.
+                        for name, tokens in entry.prompt_sections.items():
+                            sections[name] = sections.get(name, 0) + tokens
+                        first_user_text = False
+                    else:
+                        sections["history"] = sections.get("history", 0) + estimate_tokens(part.text)
+        for name, tokens in sections.items():
+            entry.sections[name] = entry.sections.get(name, 0) + tokens
+        entry.image_tokens += sections.get("image", 0)
+        entry.estimated_input_tokens += sum(sections.values())
+
+    def record_response(self, key: str, llm_response: Any) -> None:
+        entry = self.stage(key)
+        usage = getattr(llm_response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) if usage else None
+        if prompt_tokens:
+            entry.reported = True
+            entry.input_tokens += prompt_tokens
+            entry.output_tokens += getattr(usage, "candidates_token_count", None) or 0
+            entry.cached_tokens += getattr(usage, "cached_content_token_count", None) or 0
+            return
+        content = getattr(llm_response, "content", None)
+        for part in (content.parts if content is not None else None) or []:
+            if part.text:
+                entry.output_tokens += estimate_tokens(part.text)
+            elif part.function_call is not None:
+                entry.output_tokens += json_tokens(part.function_call.args)
+
+    def summary(self) -> Dict[str, Any]:
+        contributors = sorted(
+            ((key, name, tokens) for key, entry in self.stages.items() for name, tokens in entry.sections.items()),
+            key=lambda item: -item[2],
+        )[:TOP_CONTRIBUTORS]
+        return {
+            "input_tokens": self.input_tokens(),
+            "output_tokens": self.output_tokens(),
+            "image_tokens": sum(s.image_tokens for s in self.stages.values()),
+            "cached_tokens": sum(s.cached_tokens for s in self.stages.values()),
+            "estimated": not any(s.reported for s in self.stages.values()),
+            "run_budget": self.run_budget or None,
+            "stage_budget": self.stage_budget or None,
+            "trimmed_stages": sorted(k for k, s in self.stages.items() if s.trim_level),
+            "over_budget_stages": sorted(k for k, s in self.stages.items() if s.over_budget),
+            "top_contributors": [{"stage": k, "section": n, "tokens": t} for k, n, t in contributors],
+            "stages": {key: entry.to_dict() for key, entry in self.stages.items()},
+        }
+
+
+def _system_instruction_text(llm_request: Any) -> str:
+    config = getattr(llm_request, "config", None)
+    instruction = getattr(config, "system_instruction", None) if config else None
+    if isinstance(instruction, str):
+        return instruction
+    parts = getattr(instruction, "parts", None)
+    return "".join(part.text or "" for part in parts or []) if parts else ""
+
+
+# --- Context trimming ---
+
+def _trim(value: Any, max_chars: int, max_items: Optional[int]) -> Any:
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else value[:max_chars] + "…"
+    if isinstance(value, list):
+        items = value if max_items is None else value[:max_items]
+        return [_trim(item, max_chars, max_items) for item in items]
+    if isinstance(value, dict):
+        return {k: _trim(v, max_chars, max_items) for k, v in value.items()}
+    return value
+
+
+def _scalars_only(output: Any) -> Any:
+    if not isinstance(output, dict):
+        return output
+    kept = {k: v for k, v in output.items() if not isinstance(v, (dict, list))}
+    kept["_trimmed"] = True
+    return kept
+
+
+def trim_upstream(upstream: Dict[str, Any], max_tokens: int) -> Tuple[Dict[str, Any], int]:
+    """
+    Shrinks upstream outputs until their JSON fits max_tokens; returns the
+    trimmed dict and the trim level applied (0 = unchanged, 3 = most aggressive).
+    """
+    if json_tokens(upstream) <= max_tokens:
+        return upstream, 0
+    trimmed = _trim(upstream, TOKEN_TRIM_STRING_CHARS, None)
+    if json_tokens(trimmed) <= max_tokens:
+        return trimmed, 1
+    trimmed = _trim(upstream, TOKEN_TRIM_STRING_CHARS // 2, TOKEN_TRIM_LIST_ITEMS)
+    if json_tokens(trimmed) <= max_tokens:
+        return trimmed, 2
+    for key in sorted(trimmed, key=lambda k: -json_tokens(trimmed[k])):
+        reduced = _scalars_only(trimmed[key])
+        if json_tokens(reduced) < json_tokens(trimmed[key]):
+            trimmed[key] = reduced
+        if json_tokens(trimmed) <= max_tokens:
+            break
+    if json_tokens(trimmed) >= json_tokens(upstream):
+        return upstream, 0
+    return trimmed, 3
+
+
+# --- Model callbacks ---
+
+def before_model_callback(callback_context: Any, llm_request: Any) -> None:
+    current = _current.get()
+    if current is not None:
+        ledger, key = current
+        ledger.record_request(key, llm_request)
+    return None
+
+
+def after_model_callback(callback_context: Any, llm_response: Any) -> None:
+    current = _current.get()
+    if current is not None:
+        ledger, key = current
+        ledger.record_response(key, llm_response)
+    return None
+
+
+def install_token_callbacks(agent: Any) -> None:
+    """Adds the accounting callbacks to an agent, keeping any callbacks it already has."""
+    for attribute, callback in (("before_model_callback", before_model_callback),
+                                ("after_model_callback", after_model_callback)):
+        existing = getattr(agent, attribute, None)
+        if existing is None:
+            setattr(agent, attribute, callback)
+        elif isinstance(existing, list):
+            if callback not in existing:
+                setattr(agent, attribute, existing + [callback])
+        elif existing is not callback:
+            setattr(agent, attribute, [existing, callback])
+
+
+def bind_stage(ledger: "RunTokenLedger", key: str) -> contextvars.Token:
+    """Attributes model calls in the current task to (ledger, key); undo with unbind_stage."""
+    return _current.set((ledger, key))
+
+
+def unbind_stage(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+# --- Process-wide profile ---
+
+class TokenProfiler:
+    """Running per-stage and per-contributor totals over every finished run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.trimmed_runs = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._stages: Dict[str, Dict[str, int]] = {}
+        self._sections: Dict[Tuple[str, str], int] = {}
+
+    def add_run(self, ledger: RunTokenLedger) -> None:
+        with self._lock:
+            self.runs += 1
+            self.trimmed_runs += int(any(s.trim_level for s in ledger.stages.values()))
+            self.input_tokens += ledger.input_tokens()
+            self.output_tokens += ledger.output_tokens()
+            for key, entry in ledger.stages.items():
+                totals = self._stages.setdefault(key, {"runs": 0, "calls": 0, "input_tokens": 0, "output_tokens": 0,
+                                                       "image_tokens": 0, "trimmed": 0})
+                totals["runs"] += 1
+                totals["calls"] += entry.calls
+                totals["input_tokens"] += entry.effective_input_tokens
+                totals["output_tokens"] += entry.output_tokens
+                totals["image_tokens"] += entry.image_tokens
+                totals["trimmed"] += int(bool(entry.trim_level))
+                for name, tokens in entry.sections.items():
+                    self._sections[(key, name)] = self._sections.get((key, name), 0) + tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {
+                key: {
+                    **totals,
+                    "mean_input_tokens": round(totals["input_tokens"] / totals["runs"]),
+                    "mean_output_tokens": round(totals["output_tokens"] / totals["runs"]),
+                }
+                for key, totals in sorted(self._stages.items(), key=lambda item: -item[1]["input_tokens"])
+            }
+            contributors = sorted(self._sections.items(), key=lambda item: -item[1])[:TOP_CONTRIBUTORS]
+            return {
+                "runs": self.runs,
+                "trimmed_runs": self.trimmed_runs,
+                "mean_input_tokens": round(self.input_tokens / self.runs) if self.runs else None,
+                "mean_output_tokens": round(self.output_tokens / self.runs) if self.runs else None,
+                "budgets": {"run": RUN_TOKEN_BUDGET or None, "stage": STAGE_PROMPT_TOKEN_BUDGET or None},
+                "top_contributors": [
+                    {"stage": key, "section": name, "tokens": tokens, "share": round(tokens / self.input_tokens, 4)
+                     if self.input_tokens else None}
+                    for (key, name), tokens in contributors
+                ],
+                "stages": stages,
+            }
+
+
+token_profiler = TokenProfiler()
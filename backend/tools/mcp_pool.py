@@ -0,0 +1,315 @@
+# backend/tools/mcp_pool.py
+"""
+Long-lived, multiplexed MCP stdio server processes.
+
+Spawning `node script.js` for every tool call costs a Node cold start per price /
+Fear & Greed / news lookup. Instead, each MCP script gets a small pool of
+persistent processes that speak newline-delimited JSON-RPC 2.0 (the MCP stdio
+transport). Every request carries an id, so many in-flight calls can share one
+process; a reader task routes responses back to the waiting callers, stderr is
+drained concurrently (so a chatty server can never block on a full pipe), and
+dead or unhealthy processes are restarted automatically.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import os
+import time
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+MCP_PROTOCOL_VERSION = "2024-11-05"
+MCP_POOL_SIZE = int(os.environ.get("MCP_POOL_SIZE", "1"))
+MCP_CALL_TIMEOUT_S = float(os.environ.get("MCP_CALL_TIMEOUT_S", "30"))
+MCP_HEALTH_INTERVAL_S = float(os.environ.get("MCP_HEALTH_INTERVAL_S", "30"))
+MCP_MIN_RESTART_INTERVAL_S = 1.0
+_STREAM_LIMIT_BYTES = 16 * 1024 * 1024  # large Perplexity answers arrive as a single JSON line
+_STDERR_TAIL_LINES = 50
+
+
+class MCPProcessError(RuntimeError):
+    """Raised when an MCP server process is unavailable or returns a JSON-RPC error."""
+
+
+class MCPServerProcess:
+    """One persistent MCP server process with id-multiplexed JSON-RPC requests."""
+
+    def __init__(self, cmd_parts: Sequence[str], env: Optional[Dict[str, str]] = None, name: Optional[str] = None):
+        self.cmd_parts = list(cmd_parts)
+        self.env = env
+        self.name = name or " ".join(self.cmd_parts)
+        self.stderr_tail: Deque[str] = collections.deque(maxlen=_STDERR_TAIL_LINES)
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._write_lock = asyncio.Lock()
+        self._reader_tasks: List[asyncio.Task] = []
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def start(self, timeout: float = MCP_CALL_TIMEOUT_S) -> None:
+        env = None
+        if self.env is not None:
+            # Keep PATH etc. from the parent so `node` resolves; the overrides win.
+            env = {**os.environ, **self.env}
+        self._proc = await asyncio.create_subprocess_exec(
+            *self.cmd_parts,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            limit=_STREAM_LIMIT_BYTES,
+        )
+        self._reader_tasks = [
+            asyncio.ensure_future(self._read_stdout(self._proc)),
+            asyncio.ensure_future(self._drain_stderr(self._proc)),
+        ]
+        await self.request(
+            "initialize",
+            {
+                "protocolVersion": MCP_PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": {"name": "crypto-ta-backend", "version": "0.2"},
+            },
+            timeout=timeout,
+        )
+        await self.notify("notifications/initialized")
+        logger.info("MCP Pool: started %s (pid %s)", self.name, self._proc.pid)
+
+    async def request(self, method: str, params: Optional[Dict[str, Any]] = None,
+                      timeout: float = MCP_CALL_TIMEOUT_S) -> Any:
+        """Sends a JSON-RPC request and waits for the response with the same id."""
+        if not self.alive:
+            raise MCPProcessError(f"MCP server {self.name} is not running")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        message = {"jsonrpc": "2.0", "id": request_id, "method": method}
+        if params is not None:
+            message["params"] = params
+        try:
+            await self._send(message)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise MCPProcessError(f"MCP server {self.name} timed out after {timeout}s on {method}")
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def notify(self, method: str, params: Optional[Dict[str, Any]] = None) -> None:
+        message = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        await self._send(message)
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any],
+                        timeout: float = MCP_CALL_TIMEOUT_S) -> Dict[str, Any]:
+        return await self.request("tools/call", {"name": tool_name, "arguments": arguments}, timeout=timeout)
+
+    async def ping(self, timeout: float = 5.0) -> bool:
+        try:
+            await self.request("ping", timeout=timeout)
+            return True
+        except MCPProcessError:
+            return False
+
+    async def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is not None and proc.returncode is None:
+            try:
+                proc.stdin.close()
+                await asyncio.wait_for(proc.wait(), 2.0)
+            except (asyncio.TimeoutError, ProcessLookupError, ConnectionResetError, BrokenPipeError):
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+        for task in self._reader_tasks:
+            task.cancel()
+        self._reader_tasks = []
+        self._fail_pending(MCPProcessError(f"MCP server {self.name} was closed"))
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        line = (json.dumps(message, separators=(",", ":")) + "\n").encode()
+        async with self._write_lock:
+            try:
+                self._proc.stdin.write(line)
+                await self._proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError, AttributeError) as e:
+                raise MCPProcessError(f"MCP server {self.name} stdin closed: {e}")
+
+    async def _read_stdout(self, proc: asyncio.subprocess.Process) -> None:
+        try:
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    # Some servers log banners to stdout; they are not protocol messages.
+                    logger.debug("MCP Pool: non-JSON stdout from %s: %r", self.name, line[:200])
+                    continue
+                future = self._pending.get(message.get("id")) if isinstance(message, dict) else None
+                if future is None or future.done():
+                    continue  # notification, server-initiated request, or a caller that already timed out
+                if "error" in message:
+                    future.set_exception(MCPProcessError(f"MCP error from {self.name}: {message['error']}"))
+                else:
+                    future.set_result(message.get("result"))
+        finally:
+            # A restarted worker already has a new process; only fail calls made against this one.
+            if self._proc is proc:
+                tail = " | ".join(self.stderr_tail)
+                self._fail_pending(MCPProcessError(f"MCP server {self.name} exited. stderr: {tail[-500:]}"))
+
+    async def _drain_stderr(self, proc: asyncio.subprocess.Process) -> None:
+        while True:
+            line = await proc.stderr.readline()
+            if not line:
+                break
+            self.stderr_tail.append(line.decode(errors="replace").rstrip())
+
+    def _fail_pending(self, error: Exception) -> None:
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+
+class MCPWorkerPool:
+    """
+    A fixed-size pool of MCPServerProcess workers for one MCP script.
+    Calls go to the worker with the fewest calls routed to it, preferring a live
+    one on ties, so an idle worker that was never started (or has died) is
+    started as soon as the live ones are busy. Dead workers are also restarted
+    by the health-check loop; workers that were never started are left alone.
+    """
+
+    def __init__(self, cmd_parts: Sequence[str], size: int = MCP_POOL_SIZE, env: Optional[Dict[str, str]] = None,
+                 call_timeout: float = MCP_CALL_TIMEOUT_S, health_interval: float = MCP_HEALTH_INTERVAL_S):
+        self.cmd_parts = list(cmd_parts)
+        self.name = " ".join(self.cmd_parts)
+        self.call_timeout = call_timeout
+        self.health_interval = health_interval
+        self.workers = [MCPServerProcess(cmd_parts, env=env, name=f"{self.name}#{i}") for i in range(max(1, size))]
+        self.restarts = 0
+        # Calls routed to each worker and not yet finished (including ones waiting for it to start).
+        self._load = [0] * len(self.workers)
+        self._last_start: Dict[int, float] = {}
+        self._start_locks = [asyncio.Lock() for _ in self.workers]
+        self._health_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        if self._closed:
+            raise MCPProcessError(f"MCP pool {self.name} is closed")
+        self._ensure_health_loop()
+        index = min(range(len(self.workers)), key=lambda i: (self._load[i], not self.workers[i].alive))
+        self._load[index] += 1
+        try:
+            try:
+                worker = await self._ensure_started(index)
+            except Exception as e:
+                live = [w for w in self.workers if w.alive]
+                if not live:
+                    raise
+                logger.warning("MCP Pool: could not start %s (%s); using a live worker",
+                               self.workers[index].name, e)
+                worker = min(live, key=lambda w: w.in_flight)
+            return await worker.call_tool(tool_name, arguments, timeout=timeout or self.call_timeout)
+        finally:
+            self._load[index] -= 1
+
+    async def health_check(self) -> Dict[str, bool]:
+        """Pings every started worker and restarts the ones that are dead or unresponsive."""
+        status = {}
+        for index, worker in enumerate(self.workers):
+            if index not in self._last_start:
+                continue  # never started: started on demand by call_tool
+            healthy = worker.alive and await worker.ping()
+            if not healthy and not self._closed:
+                logger.warning("MCP Pool: %s unhealthy, restarting", worker.name)
+                await worker.close()
+                try:
+                    await self._ensure_started(index)
+                except Exception as e:
+                    logger.error("MCP Pool: restart of %s failed: %s", worker.name, e)
+            status[worker.name] = healthy
+        return status
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(*(worker.close() for worker in self.workers))
+
+    async def _ensure_started(self, index: int) -> MCPServerProcess:
+        worker = self.workers[index]
+        async with self._start_locks[index]:
+            if worker.alive:
+                return worker
+            last = self._last_start.get(index)
+            if last is not None:
+                # Back off a little so a crashing server does not spin.
+                self.restarts += 1
+                await worker.close()
+                await asyncio.sleep(max(0.0, MCP_MIN_RESTART_INTERVAL_S - (time.monotonic() - last)))
+            self._last_start[index] = time.monotonic()
+            try:
+                await worker.start(timeout=self.call_timeout)
+            except Exception:
+                await worker.close()
+                raise
+            return worker
+
+    def _ensure_health_loop(self) -> None:
+        if self.health_interval > 0 and (self._health_task is None or self._health_task.done()):
+            self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        while not self._closed:
+            await asyncio.sleep(self.health_interval)
+            await self.health_check()
+
+
+_pools: Dict[Tuple[Tuple[str, ...], Tuple[Tuple[str, str], ...]], MCPWorkerPool] = {}
+
+
+def get_mcp_pool(cmd_parts: Sequence[str], env: Optional[Dict[str, str]] = None) -> MCPWorkerPool:
+    """Returns the process-wide pool for a command line (and env overrides), creating it on first use."""
+    key = (tuple(cmd_parts), tuple(sorted((env or {}).items())))
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = MCPWorkerPool(cmd_parts, env=env)
+    return pool
+
+
+async def shutdown_mcp_pools() -> None:
+    pools = list(_pools.values())
+    _pools.clear()
+    await asyncio.gather(*(pool.close() for pool in pools), return_exceptions=True)
+
+
+def format_tool_result(result: Any) -> str:
+    """
+    Flattens an MCP `tools/call` result into the JSON string the agents already expect:
+    the text content on success, or an {"error": ...} object when the tool reports isError.
+    """
+    if not isinstance(result, dict):
+        return json.dumps(result)
+    texts = [item.get("text", "") for item in result.get("content", []) if isinstance(item, dict) and item.get("type") == "text"]
+    text = "\n".join(texts) if texts else json.dumps(result)
+    if result.get("isError"):
+        return json.dumps({"error": "MCP tool error", "details": text})
+    return text
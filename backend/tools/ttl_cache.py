@@ -0,0 +1,153 @@
+# backend/tools/ttl_cache.py
+"""
+In-process TTL + LRU result cache with single-flight loading.
+
+Concurrent misses for the same key share one upstream call (SingleFlight): the
+loader runs in a detached task every caller awaits, so a caller that is
+cancelled stops waiting without cancelling the call for the others. Entries expire after
+their TTL and the cache is bounded by entry count and approximate byte size,
+evicting least-recently-used entries first.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def canonical_key(name: str, arguments: Optional[Dict[str, Any]] = None) -> str:
+    """Stable cache key for a tool name plus its arguments (key order and whitespace independent)."""
+    return f"{name}:{json.dumps(arguments or {}, sort_keys=True, separators=(',', ':'), default=str)}"
+
+
+def _approx_size(value: Any) -> int:
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    return len(json.dumps(value, default=str))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls per key onto one detached task. A cancelled caller
+    only stops waiting; the shared task is cancelled when its last waiter leaves.
+    Exceptions from the call are raised in every waiter.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(partial(self._finished, key))
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    task.cancel()
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark retrieved so an exception whose waiters all left is not reported as unhandled.
+            task.exception()
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()  # key -> (expires_at, size, value)
+        self._flights = SingleFlight()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        size = _approx_size(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float,
+                          cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Returns the cached value for key, or runs loader once for all concurrent
+        callers. Values rejected by cache_if (e.g. error payloads) are returned to
+        the waiting callers but not stored.
+        """
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+        if self._flights.in_flight(key):
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        return await self._flights.do(key, partial(self._load, key, loader, ttl, cache_if))
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float,
+                    cache_if: Optional[Callable[[Any], bool]]) -> Any:
+        # Stored by the shared task, so the value is cached even if the caller that started it has gone.
+        value = await loader()
+        if cache_if is None or cache_if(value):
+            self.set(key, value, ttl)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,249 @@
+"""
+Per-run tracing spans (OpenTelemetry SDK) with an OTLP/JSON file sink and
+Prometheus histograms derived from the same spans.
+
+Spans are opened around each pipeline run ("run"), each agent invocation
+("agent"), each tool call ("tool": MCP calls and knowledge-base searches) and
+each LLM request ("llm"). run_id, session_id and agent are inherited by every
+span opened beneath them, so a single tool or model call can be traced back to
+its run without walking parents. Finished spans are:
+  - exported in batches, on the SDK's background thread, as OTLP/JSON
+    ExportTraceServiceRequest objects, one per line, to TRACE_FILE (rotated
+    once at TRACE_FILE_MAX_MB),
+  - folded into the duration histograms / token counters served by /metrics.
+
+The provider is private to this module (not the global one), so the ADK's own
+spans, which carry full request payloads, are not written to the file.
+TRACING=0 turns spans into no-ops; the metrics then stay empty.
+"""
+import contextvars
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.trace import Span, Status, StatusCode
+
+from backend.metrics import registry
+from backend.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+TRACING_ENABLED = os.environ.get("TRACING", "1") == "1"
+TRACE_FILE_MAX_BYTES = int(float(os.environ.get("TRACE_FILE_MAX_MB", "50")) * 1024 * 1024)
+SERVICE_NAME = "crypto-ta-backend"
+
+# Attributes copied onto every span opened beneath the span that sets them.
+INHERITED_ATTRIBUTES = ("run_id", "session_id", "agent")
+
+_inherited: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("trace_inherited", default=None)
+
+# --- Metrics fed from finished spans ---
+
+RUN_SECONDS = registry.histogram("crypto_ta_run_duration_seconds", "Pipeline run wall time.", ("status",))
+AGENT_SECONDS = registry.histogram("crypto_ta_agent_duration_seconds", "Agent invocation time per stage.",
+                                   ("agent", "status"))
+TOOL_SECONDS = registry.histogram("crypto_ta_tool_duration_seconds", "Tool call time.", ("tool", "status"))
+LLM_SECONDS = registry.histogram("crypto_ta_llm_request_duration_seconds", "Model request time, including queueing.",
+                                 ("model", "agent", "status"))
+LLM_TOKENS = registry.counter("crypto_ta_llm_tokens_total", "Tokens reported by the model.", ("model", "agent", "type"))
+TOOL_RETRIES = registry.counter("crypto_ta_tool_retries_total", "MCP server restarts during tool calls.", ("tool",))
+
+
+class MetricsSpanProcessor(SpanProcessor):
+    """Observes each finished span's duration into the histogram for its kind."""
+
+    def on_end(self, span: ReadableSpan) -> None:
+        attributes = span.attributes or {}
+        kind = attributes.get("kind")
+        seconds = (span.end_time - span.start_time) / 1e9
+        status = "error" if span.status.status_code == StatusCode.ERROR else str(attributes.get("status", "ok"))
+        if kind == "run":
+            RUN_SECONDS.observe(seconds, status)
+        elif kind == "agent":
+            AGENT_SECONDS.observe(seconds, str(attributes.get("agent", "")), status)
+        elif kind == "tool":
+            tool = str(attributes.get("tool", span.name))
+            TOOL_SECONDS.observe(seconds, tool, status)
+            if attributes.get("retries"):
+                TOOL_RETRIES.inc(float(attributes["retries"]), tool)
+        elif kind == "llm":
+            model, agent = str(attributes.get("model", "")), str(attributes.get("agent", ""))
+            LLM_SECONDS.observe(seconds, model, agent, status)
+            for token_type in ("prompt", "output", "cached"):
+                count = attributes.get(f"tokens_{token_type}")
+                if count:
+                    LLM_TOKENS.inc(float(count), model, agent, token_type)
+
+
+# --- OTLP/JSON file sink ---
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Any) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in (attributes or {}).items()]
+
+
+def _otlp_span(span: ReadableSpan) -> Dict[str, Any]:
+    context = span.get_span_context()
+    encoded: Dict[str, Any] = {
+        "traceId": format(context.trace_id, "032x"),
+        "spanId": format(context.span_id, "016x"),
+        "name": span.name,
+        "kind": span.kind.value + 1,  # OTLP numbering starts at SPAN_KIND_UNSPECIFIED = 0
+        "startTimeUnixNano": str(span.start_time),
+        "endTimeUnixNano": str(span.end_time),
+        "attributes": _otlp_attributes(span.attributes),
+        "status": {"code": span.status.status_code.value},
+    }
+    if span.parent is not None:
+        encoded["parentSpanId"] = format(span.parent.span_id, "016x")
+    if span.status.description:
+        encoded["status"]["message"] = span.status.description
+    if span.events:
+        encoded["events"] = [
+            {"timeUnixNano": str(event.timestamp), "name": event.name, "attributes": _otlp_attributes(event.attributes)}
+            for event in span.events
+        ]
+    return encoded
+
+
+class OtlpJsonFileExporter(SpanExporter):
+    """Appends one OTLP/JSON ExportTraceServiceRequest per export batch to a file."""
+
+    def __init__(self, path: str, max_bytes: int = TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        if not spans:
+            return SpanExportResult.SUCCESS
+        resource = spans[0].resource
+        scopes: Dict[str, List[Dict[str, Any]]] = {}
+        for span in spans:
+            scope = span.instrumentation_scope.name if span.instrumentation_scope else ""
+            scopes.setdefault(scope, []).append(_otlp_span(span))
+        request = {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes(resource.attributes if resource else {})},
+            "scopeSpans": [{"scope": {"name": name}, "spans": encoded} for name, encoded in scopes.items()],
+        }]}
+        line = json.dumps(request, separators=(",", ":"), ensure_ascii=False, default=str) + "\n"
+        try:
+            with self._lock:
+                self._rotate_if_full()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            logger.warning("Trace export to %s failed: %s", self.path, e)
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def _rotate_if_full(self) -> None:
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+# --- Provider ---
+
+_provider: Optional[TracerProvider] = None
+_tracer: trace.Tracer = trace.NoOpTracer()
+
+
+def configure_tracing(trace_file: Optional[str] = None) -> None:
+    """Installs the module's tracer provider; spans go to /metrics, and to trace_file when given."""
+    global _provider, _tracer
+    if not TRACING_ENABLED or _provider is not None:
+        return
+    _provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+    _provider.add_span_processor(MetricsSpanProcessor())
+    if trace_file:
+        _provider.add_span_processor(BatchSpanProcessor(OtlpJsonFileExporter(trace_file)))
+    _tracer = _provider.get_tracer("crypto_ta")
+    logger.info("Tracing enabled (file sink: %s)", trace_file or "none")
+
+
+def shutdown_tracing() -> None:
+    """Flushes buffered spans to the file sink."""
+    global _provider, _tracer
+    if _provider is not None:
+        _provider.shutdown()
+        _provider = None
+        _tracer = trace.NoOpTracer()
+
+
+def _clean(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    # OTel attributes must be primitives (or sequences of them); drop None, stringify the rest.
+    return {
+        key: value if isinstance(value, (bool, int, float, str)) else str(value)
+        for key, value in attributes.items() if value is not None
+    }
+
+
+@contextmanager
+def trace_span(name: str, kind: str, current: bool = True, **attributes: Any) -> Iterator[Span]:
+    """
+    Opens a span of the given kind ("run", "agent", "tool" or "llm"). Exceptions
+    are recorded on the span and re-raised. With current=False the span is not
+    made the active parent; use that when the body yields (async generators),
+    where the active context cannot be restored reliably.
+    """
+    parent = _inherited.get() or {}
+    inherited = {**parent, **{k: attributes.pop(k) for k in INHERITED_ATTRIBUTES if attributes.get(k) is not None}}
+    all_attributes = _clean({"kind": kind, **inherited, **attributes})
+    if not current:
+        s = _tracer.start_span(name, attributes=all_attributes)
+        try:
+            yield s
+        except BaseException as e:
+            s.record_exception(e)
+            s.set_status(Status(StatusCode.ERROR, str(e)))
+            raise
+        finally:
+            s.end()
+        return
+    token = _inherited.set(inherited)
+    try:
+        with _tracer.start_as_current_span(name, attributes=all_attributes) as s:
+            yield s
+    finally:
+        _inherited.reset(token)
+
+
+def annotate_span(**attributes: Any) -> None:
+    """Sets attributes on the active span; inherited ones (e.g. session_id) also apply to its later children."""
+    inherited = _inherited.get()
+    if inherited is not None:
+        inherited.update({k: v for k, v in attributes.items() if k in INHERITED_ATTRIBUTES and v is not None})
+    current = trace.get_current_span()
+    if current.is_recording():
+        current.set_attributes(_clean(attributes))
+
+
+def set_span_status(s: Span, status: str, error: Optional[str] = None) -> None:
+    """Records a handled outcome (e.g. a stage that failed validation) without an exception."""
+    s.set_attribute("status", status)
+    if error:
+        s.set_status(Status(StatusCode.ERROR, error[:500]))